@@ -2,6 +2,14 @@ import sqlite3
 import random
 import datetime
 
+from database import (
+    migrate_database,
+    create_rollup_table,
+    apply_transactions_to_rollup,
+    rebuild_agent_month_totals,
+    bump_data_version,
+)
+
 DB_PATH = 'database.db'  # Same directory as this script
 
 # Sample address components for random generation
@@ -70,12 +78,14 @@ def generate_transactions(num=300):
 def insert_transactions(transactions):
     """
     Insert the given list of (agent_id, volume, date, address) tuples
-    into the existing 'transactions' table in database.db.
+    into the existing 'transactions' table in database.db and update the
+    'agent_month_totals' rollup used by the leaderboard graphs.
     """
     if not transactions:
         return
 
     conn = sqlite3.connect(DB_PATH)
+    migrate_database(conn)
     cursor = conn.cursor()
 
     # The table already exists with columns: id, agent_id, volume, date, address
@@ -84,8 +94,19 @@ def insert_transactions(transactions):
         VALUES (?, ?, ?, ?)
     """
     cursor.executemany(insert_sql, transactions)
+    inserted = cursor.rowcount
+
+    # Keep the leaderboard rollup in step with the new rows
+    if create_rollup_table(cursor):
+        rebuild_agent_month_totals(conn)
+    else:
+        apply_transactions_to_rollup(
+            cursor,
+            [(agent_id, volume, date) for agent_id, volume, date, _ in transactions]
+        )
+        bump_data_version(cursor)
     conn.commit()
-    print(f"{cursor.rowcount} transaction(s) inserted into the 'transactions' table.")
+    print(f"{inserted} transaction(s) inserted into the 'transactions' table.")
     conn.close()
 
 def main():
@@ -1,23 +1,180 @@
-from flask import Flask, render_template, request, make_response
+from flask import (
+    Flask, render_template, request, make_response, jsonify, Response, g, redirect, url_for,
+    stream_template, stream_with_context,
+)
 import sqlite3
-from datetime import datetime
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-import io
+from datetime import date, datetime, timedelta, timezone
 import hashlib
 import os
 import calendar
+import json
+import logging
+import base64
+import io
+import queue
+import re
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
 from markupsafe import escape
+from werkzeug.http import is_resource_modified
+import click
+from database import (
+    migrate_database,
+    month_bounds,
+    year_bounds,
+    create_rollup_table,
+    apply_transactions_to_rollup,
+    remove_transaction_from_rollup,
+    remove_agent_from_rollup,
+    rebuild_agent_month_totals,
+    bump_data_version,
+    get_data_version,
+    ThreadConnections,
+    SerializedWriter,
+    TRANSACTION_SORT_COLUMNS,
+    fetch_transaction_page,
+    transaction_page_key,
+    search_transactions,
+    iter_transactions,
+    iter_agent_totals,
+)
+from graph_cache import MemoryGraphCache, SingleFlight, acquire_lock_file
+from renderers import RENDERERS, render_dashboard_png
+from exporter import csv_chunks, gzip_chunks
+from importer import DEFAULT_BATCH_SIZE, detect_format, read_records, import_transactions
+from events import ChangeNotifier
+import render_worker
+from timing import phase, start_timing, stop_timing, server_timing_header
+import metrics
 app = Flask(__name__)
 DB_PATH = 'database.db'
+SQLITE_BUSY_TIMEOUT = 5.0  # Seconds a write waits for another writer before 'database is locked'
+SQLITE_CACHED_STATEMENTS = 256  # Prepared statements kept per connection
+
+ADMIN_PAGE_SIZE = 50  # Transactions per admin page unless ?page_size= says otherwise
+ADMIN_MAX_PAGE_SIZE = 500
+ADMIN_SEARCH_LIMIT = 100  # Best matches shown for an admin search
+ADMIN_STREAM_BATCH_ROWS = 500  # Rows fetched from SQLite at a time when streaming ?page_size=all
+ADMIN_STREAM_CHUNK_BYTES = 16 * 1024  # Streamed admin HTML is flushed to the client in chunks this big
+EXPORT_BATCH_ROWS = 1000  # Rows fetched from SQLite and encoded per chunk of a CSV export
+
+# Reads go through one read-only connection per server thread (get_db),
+# writes through a single shared writer connection (write_transaction)
+db_readers = ThreadConnections(SQLITE_BUSY_TIMEOUT, SQLITE_CACHED_STATEMENTS, read_only=True)
+db_writer = SerializedWriter(SQLITE_BUSY_TIMEOUT, SQLITE_CACHED_STATEMENTS)
 CACHE_DIR = 'cache/'  # Directory to store cached graphs
+CACHE_MAX_AGE = 7 * 24 * 3600  # Cached graphs untouched for a week are deleted
+CACHE_PRUNE_INTERVAL = 3600  # Check for old cached graphs at most once an hour
+_last_cache_prune = 0.0
+GRAPH_FORMAT = 'png'  # Default /graphs format; any key of renderers.RENDERERS ('png', 'svg')
+GRAPH_TYPES = ('monthly_volume', 'monthly_transactions', 'ytd_volume', 'ytd_transactions')
+DASHBOARD_GRAPH = 'dashboard'  # All of GRAPH_TYPES as one 2x2 PNG (/dashboard.png)
+# /api/leaderboard (metric, period) -> graph type
+API_GRAPH_TYPES = {
+    ('volume', 'month'): 'monthly_volume',
+    ('count', 'month'): 'monthly_transactions',
+    ('volume', 'ytd'): 'ytd_volume',
+    ('count', 'ytd'): 'ytd_transactions',
+}
+MONTH_PATTERN = re.compile(r'\d{4}-(0[1-9]|1[0-2])')
+GRAPH_MEMORY_CACHE_MAX_BYTES = 32 * 1024 * 1024  # In-process graph cache budget
+GRAPH_MEMORY_CACHE_TTL = 3600  # Seconds an in-process cached graph is kept
+
+# In-process LRU in front of the CACHE_DIR disk cache
+graph_memory_cache = MemoryGraphCache(GRAPH_MEMORY_CACHE_MAX_BYTES, GRAPH_MEMORY_CACHE_TTL)
+
+# Only one render per cache key at a time: threads of this process share a
+# SingleFlight, other processes a '<cache key>.<format>.lock' file in CACHE_DIR
+render_flights = SingleFlight()
+RENDER_LOCK_POLL_INTERVAL = 0.05  # Seconds between checks while another process renders
+RENDER_LOCK_TIMEOUT = 60  # Stop waiting for another process and render anyway
+RENDER_LOCK_STALE = 120  # Lock files older than this were left by a crashed process
+
+# Server-Sent Events. Every open /events stream parks one server thread, so
+# at most SSE_MAX_STREAMS are open at once; further dashboards get a 503 and
+# fall back to polling. `flask --app app serve` gives waitress a thread per
+# stream plus SERVER_REQUEST_THREADS for every other request; under
+# waitress-serve keep --threads well above SSE_MAX_STREAMS.
+SSE_HEARTBEAT_INTERVAL = 25  # Seconds between keep-alive comments / version checks
+SSE_RETRY_MS = 5000  # How long browsers wait before reconnecting
+SSE_MAX_STREAMS = 32
+SSE_FULL_RETRY_AFTER = 60  # Retry-After (seconds) when every stream slot is taken
+SERVER_REQUEST_THREADS = 8
+_sse_streams = 0  # /events streams open right now
+_sse_streams_lock = threading.Lock()
+leaderboard_changes = ChangeNotifier()
+
+# Background pre-rendering (see start_prerender_worker)
+PRERENDER_ENABLED = True
+PRERENDER_POLL_INTERVAL = 5  # Seconds between data version checks for out-of-process writes
+PRERENDER_RECENT_WINDOW = 3600  # Keep graphs requested in the last hour warm...
+PRERENDER_MAX_RECENT = 16  # ...but only this many, the most recently requested
+PRERENDER_WAIT_TIMEOUT = 10  # Seconds a cold request waits for the worker
+recent_graphs = OrderedDict()  # (graph_type, month, format) -> last request time, oldest first
+latest_graph_keys = {}  # (graph_type, month, format) -> cache key of the newest rendition
+_prerender_queue = queue.Queue()
+_prerender_pending = {}  # (graph_type, month, format) -> Event set once rendered
+_prerender_lock = threading.Lock()
+_prerender_thread = None
+# /events holds an announcement back until the worker has rendered that
+# version, and once a version is announced requests stop getting older graphs
+prerendered_version = None  # Newest data version with the standard graph rendered
+announced_version = None  # Newest data version announced on /events
+_prerendered = threading.Condition()
+
+# Optional multi-process rendering (see render_image). Matplotlib holds the
+# GIL while it draws, so without a pool PNG renders from every server thread
+# share a single core.
+RENDER_PROCESSES = 0  # Size of the render process pool; 0 renders in the calling thread
+RENDER_TIMEOUT = 30  # Seconds a request waits for a pooled render
+RENDER_MAX_TASKS_PER_CHILD = 200  # Replace each render process after this many graphs
+POOLED_RENDER_FORMATS = ('png',)  # SVG is cheaper to draw than to ship to another process
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+# Per-request phase timing (see timing.py): a Server-Timing header for
+# browser devtools and one JSON line per request on the 'app.timing' logger.
+# Off by default; the phase markers cost next to nothing then.
+REQUEST_TIMING_ENABLED = False
+request_timing_log = app.logger.getChild('timing')
+request_timing_log.setLevel(logging.INFO)
+
+# Prometheus metrics served at /metrics (see metrics.py). Updates go to
+# per-thread shards, so recording one takes no lock.
+metrics_registry = metrics.Registry()
+HTTP_REQUESTS = metrics_registry.counter(
+    'leaderboard_http_requests_total', 'HTTP requests answered.', ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = metrics_registry.histogram(
+    'leaderboard_http_request_duration_seconds',
+    'Time to build a response (a streamed body is not included).', ('route', 'method'))
+GRAPH_CACHE_REQUESTS = metrics_registry.counter(
+    'leaderboard_graph_cache_requests_total',
+    'Graph requests by cache outcome: hit, miss (rendered or waited for) or stale.', ('graph_type', 'result'))
+GRAPH_RENDER_SECONDS = metrics_registry.histogram(
+    'leaderboard_graph_render_seconds', 'Time to draw and encode a graph.', ('graph_type', 'format'),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+SQLITE_QUERY_SECONDS = metrics_registry.histogram(
+    'leaderboard_sqlite_query_duration_seconds', 'SQLite query time, by query.', ('query',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+_table_rows = None  # ((DB_PATH, data version), rows) behind table_row_counts()
 
 # Ensure cache directory exists
 if not os.path.exists(CACHE_DIR):
     os.makedirs(CACHE_DIR)
 
+# The database is set up on first use (the first request, or a CLI command)
+# instead of at import time, so importing this module never writes to it
+_initialized_databases = set()  # DB_PATHs initialize_database has run on
+_initialize_lock = threading.Lock()
+
+def ensure_database():
+    if DB_PATH not in _initialized_databases:
+        with _initialize_lock:
+            if DB_PATH not in _initialized_databases:
+                initialize_database()
+
 # Initialize the database
 def initialize_database():
     """
@@ -27,6 +184,7 @@ def initialize_database():
     - Populates sample data for demo purposes.
     """
     conn = sqlite3.connect(DB_PATH)
+    conn.execute('PRAGMA journal_mode = WAL')  # Persistent; lets reads run alongside writes
     cursor = conn.cursor()
 
     # Create the agents table if it does not exist
@@ -54,6 +212,12 @@ def initialize_database():
     if 'address' not in columns:
         cursor.execute('ALTER TABLE transactions ADD COLUMN address TEXT')
 
+    # Apply pending schema migrations (secondary indexes etc.)
+    migrate_database(conn)
+
+    # Create the agent/month rollup table read by the leaderboard graphs
+    rollup_created = create_rollup_table(cursor)
+
     # Populate the agents table with sample data (demo purposes only)
     ## sample_agents = [('Alice',), ('Bob',), ('Charlie',)]
     ##cursor.executemany(
@@ -72,6 +236,17 @@ def initialize_database():
         sample_transactions
     )
 
+    # Existing databases get their rollup built once; afterwards it is kept
+    # up to date incrementally
+    if rollup_created:
+        rebuild_agent_month_totals(conn)
+    else:
+        apply_transactions_to_rollup(
+            cursor,
+            [(agent_id, volume, date) for agent_id, volume, date, _ in sample_transactions]
+        )
+        bump_data_version(cursor)
+
     conn.commit()
     conn.close()
     conn = sqlite3.connect(DB_PATH)
@@ -110,1076 +285,1186 @@ def initialize_database():
 
     conn.commit()
     conn.close()
+    _initialized_databases.add(DB_PATH)
 
 
 # Generate cache key
-def generate_cache_key(graph_type, month):
-    key = f"{graph_type}_{month}"
+def generate_cache_key(graph_type, month, data_version, image_format='png'):
+    # The data version changes on every leaderboard write, so a cached graph
+    # stays valid for exactly as long as the data it was drawn from. Graphs
+    # showing year-to-date figures also depend on the current year, which
+    # changes without any write.
+    key = f"{graph_type}_{month}_{data_version}_{image_format}"
+    if graph_type.startswith('ytd_') or graph_type == DASHBOARD_GRAPH:
+        key += f"_ytd{ytd_month_range()[0][:4]}"
     return hashlib.md5(key.encode()).hexdigest()
 
-# Generate and cache graphs
-def generate_graph(graph_type, month):
-    # Generate a unique cache key based on graph type and month
-    cache_key = generate_cache_key(graph_type, month)
-    cache_path = os.path.join(CACHE_DIR, f"{cache_key}.png")
-
-    # Check for cached graph
-    if os.path.exists(cache_path):
-        mtime = os.path.getmtime(cache_path)
-        now = time.time()
-        if (now - mtime) < 5:  # Use cache if less than 5 seconds old
-            with open(cache_path, 'rb') as f:
-                return io.BytesIO(f.read())
-
-    # Connect to the database
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Define the SQL query and graph settings based on graph type
+# This thread's read-only connection to DB_PATH. Do not close it: it is
+# reused by the next request. Every statement reads the latest committed
+# WAL snapshot, so a long admin write never stalls it.
+def get_db():
+    return db_readers.get(DB_PATH)
+
+# Run a write: 'with write_transaction() as cursor:' holds the single writer
+# connection, commits at the end of the block and rolls back on errors
+def write_transaction():
+    return db_writer.transaction(DB_PATH)
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    db_readers.release()
+
+# Read the leaderboard data version as (version, updated_at)
+def current_data_version():
+    with phase('version'), SQLITE_QUERY_SECONDS.time('data_version'):
+        return get_data_version(get_db().cursor())
+
+# Remove cached graphs that have not been rewritten for a while
+def prune_graph_cache(max_age=CACHE_MAX_AGE):
+    global _last_cache_prune
+    now = time.time()
+    if now - _last_cache_prune < CACHE_PRUNE_INTERVAL:
+        return
+    _last_cache_prune = now
+
+    for entry in os.scandir(CACHE_DIR):
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+        except OSError:
+            pass  # Another worker removed it first
+
+# Title and x-axis settings of a graph type, or None for an unknown graph type
+def leaderboard_settings(graph_type, month):
+    month_name = calendar.month_name[int(month.split('-')[1])]
+    ytd_year = datetime.now().strftime('%Y')
     if graph_type == "monthly_volume":
-        month_name = calendar.month_name[int(month.split('-')[1])]
-        title = f"Monthly Volume - {month_name}"
-        query = '''
-            SELECT a.name, SUM(t.volume) AS total_volume
-            FROM agents a
-            LEFT JOIN transactions t 
-                ON a.id = t.agent_id AND strftime('%Y-%m', t.date) = ?
-            GROUP BY a.id
-            ORDER BY total_volume DESC
-        '''
-        cursor.execute(query, (month,))
-        xlabel = "Volume ($)"
-        values_step = 200000  # Increment for x-axis
-
+        title, xlabel, values_step = f"Monthly Volume - {month_name}", "Volume ($)", 200000
     elif graph_type == "monthly_transactions":
-        month_name = calendar.month_name[int(month.split('-')[1])]
-        title = f"Monthly Transactions - {month_name}"
-        query = '''
-            SELECT a.name, COUNT(t.id) AS transaction_count
-            FROM agents a
-            LEFT JOIN transactions t 
-                ON a.id = t.agent_id AND strftime('%Y-%m', t.date) = ?
-            GROUP BY a.id
-            ORDER BY transaction_count DESC
-        '''
-        cursor.execute(query, (month,))
-        xlabel = "Transactions"
-        values_step = 1
-
+        title, xlabel, values_step = f"Monthly Transactions - {month_name}", "Transactions", 1
     elif graph_type == "ytd_volume":
-        ytd_year = datetime.now().strftime('%Y')
-        title = f"YTD Volume ({ytd_year})"
-        query = '''
-            SELECT a.name, SUM(t.volume) AS total_volume
-            FROM agents a
-            LEFT JOIN transactions t 
-                ON a.id = t.agent_id AND strftime('%Y', t.date) = ?
-            GROUP BY a.id
-            ORDER BY total_volume DESC
-        '''
-        cursor.execute(query, (ytd_year,))
-        xlabel = "Volume (Millions $)"
-        values_step = 1000000  # Increment for x-axis
-
+        title, xlabel, values_step = f"YTD Volume ({ytd_year})", "Volume (Millions $)", 1000000
     elif graph_type == "ytd_transactions":
-        ytd_year = datetime.now().strftime('%Y')
-        title = f"YTD Transactions ({ytd_year})"
-        query = '''
-            SELECT a.name, COUNT(t.id) AS transaction_count
-            FROM agents a
-            LEFT JOIN transactions t 
-                ON a.id = t.agent_id AND strftime('%Y', t.date) = ?
-            GROUP BY a.id
-            ORDER BY transaction_count DESC
-        '''
-        cursor.execute(query, (ytd_year,))
-        xlabel = "Transactions"
-        values_step = 5
-
+        title, xlabel, values_step = f"YTD Transactions ({ytd_year})", "Transactions", 5
     else:
-        conn.close()
+        return None
+    return {'graph_type': graph_type, 'title': title, 'xlabel': xlabel, 'values_step': values_step}
+
+# Rollup month range [first, last) covered by the YTD graphs
+def ytd_month_range():
+    ytd_year = datetime.now().strftime('%Y')
+    return f"{ytd_year}-01", f"{int(ytd_year) + 1}-01"
+
+# Run the leaderboard query behind a graph type. Returns a dict with the
+# graph title, axis settings and (agent name, value) rows sorted best first,
+# or None for an unknown graph type
+def fetch_leaderboard(graph_type, month):
+    leaderboard = leaderboard_settings(graph_type, month)
+    if leaderboard is None:
         return None  # Invalid graph type
 
-    # Fetch the data from the query
-    data = cursor.fetchall()
-    conn.close()
-
-    # Extract agent names and values, ensuring no data scenario is handled
-    agents = [row[0] for row in data] or ["No Data"]
-    values = [row[1] if row[1] is not None else 0 for row in data] or [0]
-
-    # Set colors to highlight top performers
-    colors = [
-        'green' if i == 0 else 'gold' if i == 1 else 'silver' if i == 2 else 'skyblue'
-        for i in range(len(values))
-    ]
-
-    # Create the graph
-    plt.figure(figsize=(10, 6))
-    bars = plt.barh(agents, values, color=colors)
-
-    # Add labels and titles
-    plt.xlabel(xlabel)
-    plt.ylabel("Agents")
-    plt.title(title)
-
-    # Adjust x-axis ticks based on the maximum value
-    max_value = max(values) if values else values_step
-    plt.xticks(
-        range(0, int(max_value) + values_step, values_step),
-        [
-            f'{x // 1000000}M' if graph_type == "ytd_volume" else f'{x:,}'
-            for x in range(0, int(max_value) + values_step, values_step)
-        ]
-    )
-
-    # Add value labels to bars, skipping zero values
-    for bar in bars:
-        if bar.get_width() > 0:  # Only label non-zero values
-            if graph_type in ["monthly_volume", "ytd_volume"]:
-                plt.text(
-                    bar.get_width(),
-                    bar.get_y() + bar.get_height() / 2,
-                    f'${bar.get_width():,.2f}',
-                    va='center'
-                )
-            elif graph_type in ["monthly_transactions", "ytd_transactions"]:
-                plt.text(
-                    bar.get_width(),
-                    bar.get_y() + bar.get_height() / 2,
-                    f'{int(bar.get_width())}',
-                    va='center'
-                )
-
-    # Reverse the y-axis to show top performers at the top
-    plt.gca().invert_yaxis()
-    plt.tight_layout()
-
-    # Save the graph to an in-memory buffer
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-
-    # Save the graph to the cache
-    with open(cache_path, 'wb') as f:
-        f.write(buf.getbuffer())
-
-    return buf
-
-    cache_key = generate_cache_key(graph_type, month)
-    cache_path = os.path.join(CACHE_DIR, f"{cache_key}.png")
-
-    # Check if cached file exists and is newer than 5 seconds
-    if os.path.exists(cache_path):
-        mtime = os.path.getmtime(cache_path)
-        now = time.time()
-        if (now - mtime) < 5:
-            with open(cache_path, 'rb') as f:
-                return io.BytesIO(f.read())
+    # Monthly graphs read one rollup month, YTD graphs the current year's
+    if graph_type.startswith('monthly_'):
+        month_filter = 'r.month = ?'
+        params = (month,)
+    else:
+        month_filter = 'r.month >= ? AND r.month < ?'
+        params = ytd_month_range()
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    if graph_type.endswith('_volume'):
+        value = 'SUM(r.total_volume)'
+    else:
+        value = 'COALESCE(SUM(r.transaction_count), 0)'
 
-    if graph_type == "monthly_volume":
-        month_name = calendar.month_name[int(month.split('-')[1])]
-        title = f"Monthly Volume - {month_name}"
-        query = '''
-            SELECT a.name, SUM(t.volume) AS total_volume
-            FROM agents a
-            LEFT JOIN transactions t 
-                ON a.id = t.agent_id AND strftime('%Y-%m', t.date) = ?
-            GROUP BY a.id
-            ORDER BY total_volume DESC
-        '''
-        cursor.execute(query, (month,))
-        xlabel = "Volume ($)"
-        values_step = 200000
-    elif graph_type == "monthly_transactions":
-        month_name = calendar.month_name[int(month.split('-')[1])]
-        title = f"Monthly Transactions - {month_name}"
-        query = '''
-            SELECT a.name, COUNT(t.id) AS transaction_count
-            FROM agents a
-            LEFT JOIN transactions t 
-                ON a.id = t.agent_id AND strftime('%Y-%m', t.date) = ?
-            GROUP BY a.id
-            ORDER BY transaction_count DESC
-        '''
-        cursor.execute(query, (month,))
-        xlabel = "Transactions"
-        values_step = 1
-    elif graph_type == "ytd_volume":
-        ytd_year = datetime.now().strftime('%Y')
-        title = f"YTD Volume ({ytd_year})"
-        query = '''
-            SELECT a.name, SUM(t.volume) AS total_volume
+    with phase('sql'), SQLITE_QUERY_SECONDS.time('leaderboard'):
+        leaderboard['rows'] = get_db().execute(f'''
+            SELECT a.name, {value} AS value
             FROM agents a
-            LEFT JOIN transactions t 
-                ON a.id = t.agent_id AND strftime('%Y', t.date) = ?
+            LEFT JOIN agent_month_totals r
+                ON a.id = r.agent_id AND {month_filter}
             GROUP BY a.id
-            ORDER BY total_volume DESC
-        '''
-        cursor.execute(query, (ytd_year,))
-        xlabel = "Volume (Millions $)"
-        values_step = 1000000
-    elif graph_type == "ytd_transactions":
-        ytd_year = datetime.now().strftime('%Y')
-        title = f"YTD Transactions ({ytd_year})"
-        query = '''
-            SELECT a.name, COUNT(t.id) AS transaction_count
+            ORDER BY value DESC
+        ''', params).fetchall()
+    return leaderboard
+
+# All four dashboard leaderboards (in GRAPH_TYPES order) from one pass over
+# the rollup: the join picks up the selected month and the current year, and
+# conditional aggregation splits them into the four columns
+def fetch_dashboard(month):
+    ytd_start, ytd_end = ytd_month_range()
+    with phase('sql'), SQLITE_QUERY_SECONDS.time('dashboard'):
+        rows = get_db().execute('''
+            SELECT a.name,
+                SUM(CASE WHEN r.month = :month THEN r.total_volume END),
+                COALESCE(SUM(CASE WHEN r.month = :month THEN r.transaction_count END), 0),
+                SUM(CASE WHEN r.month >= :ytd_start AND r.month < :ytd_end THEN r.total_volume END),
+                COALESCE(SUM(CASE WHEN r.month >= :ytd_start AND r.month < :ytd_end
+                             THEN r.transaction_count END), 0)
             FROM agents a
-            LEFT JOIN transactions t 
-                ON a.id = t.agent_id AND strftime('%Y', t.date) = ?
+            LEFT JOIN agent_month_totals r
+                ON a.id = r.agent_id
+                AND (r.month = :month OR (r.month >= :ytd_start AND r.month < :ytd_end))
             GROUP BY a.id
-            ORDER BY transaction_count DESC
-        '''
-        cursor.execute(query, (ytd_year,))
-        xlabel = "Transactions"
-        values_step = 5
-    else:
-        conn.close()
-        return None
-
-    data = cursor.fetchall()
-    conn.close()
-
-    agents = [row[0] for row in data] or ["No Data"]
-    values = [row[1] if row[1] is not None else 0 for row in data] or [0]
-
-    colors = ['green' if i == 0 else 'gold' if i == 1 else 'silver' if i == 2 else 'skyblue' for i in range(len(values))]
-
-    plt.figure(figsize=(10, 6))
-    bars = plt.barh(agents, values, color=colors)
-
-    plt.xlabel(xlabel)
-    plt.ylabel("Agents")
-    plt.title(title)
-
-    max_value = max(values) if values else values_step
-    plt.xticks(range(0, int(max_value) + values_step, values_step),
-               [f'{x // 1000000}M' if graph_type == "ytd_volume" else f'{x:,}' for x in range(0, int(max_value) + values_step, values_step)])
-
-    for bar in bars:
-        if graph_type in ["monthly_volume", "ytd_volume"]:
-            plt.text(bar.get_width(), bar.get_y() + bar.get_height() / 2, f'${bar.get_width():,.2f}', va='center')
-        elif graph_type in ["monthly_transactions", "ytd_transactions"]:
-            plt.text(bar.get_width(), bar.get_y() + bar.get_height() / 2, f'{int(bar.get_width())}', va='center')
+        ''', {'month': month, 'ytd_start': ytd_start, 'ytd_end': ytd_end}).fetchall()
+
+    leaderboards = []
+    for column, graph_type in enumerate(GRAPH_TYPES, start=1):
+        leaderboard = leaderboard_settings(graph_type, month)
+        # Best first with agents that have no data (NULL) last, like ORDER BY ... DESC
+        leaderboard['rows'] = sorted(
+            ((row[0], row[column]) for row in rows),
+            key=lambda row: (row[1] is not None, row[1] or 0),
+            reverse=True,
+        )
+        leaderboards.append(leaderboard)
+    return leaderboards
+
+# Look a rendered graph up in the in-process cache, then on disk
+def load_cached_graph(cache_key, image_format):
+    with phase('cache'):
+        # Check the in-process cache first; hits need no filesystem access
+        cached = graph_memory_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Fall back to the disk cache shared with other workers
+        cache_path = os.path.join(CACHE_DIR, f"{cache_key}.{image_format}")
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = f.read()
+        except FileNotFoundError:
+            return None
+        graph_memory_cache.put(cache_key, cached)
+        return cached
+
+# Store a rendered graph in both caches. The file is written under a
+# temporary name and renamed into place so readers never see half a PNG.
+def publish_graph(graph_type, month, image_format, cache_key, image):
+    cache_path = os.path.join(CACHE_DIR, f"{cache_key}.{image_format}")
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with phase('cache_write'):
+        with open(tmp_path, 'wb') as f:
+            f.write(image)
+        os.replace(tmp_path, cache_path)
+        graph_memory_cache.put(cache_key, image)
+    latest_graph_keys[(graph_type, month, image_format)] = cache_key
+    prune_graph_cache()
+
+def get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # Spawned workers run render_worker and renderers, not this module
+            _render_pool = render_worker.create_pool(RENDER_PROCESSES, RENDER_MAX_TASKS_PER_CHILD)
+        return _render_pool
+
+# Encode a leaderboard as an image
+def render_image(leaderboard, image_format):
+    render, _ = RENDERERS[image_format]
+    return run_renderer(render, leaderboard, pooled=image_format in POOLED_RENDER_FORMATS)
+
+# Call render(data), a renderers function, in the render process pool when it
+# is enabled and 'pooled' is true. Raises TimeoutError when a pooled render
+# takes longer than RENDER_TIMEOUT.
+def run_renderer(render, data, pooled=True):
+    if RENDER_PROCESSES <= 0 or not pooled:
+        return render(data)  # PNG renderers time their own draw and savefig phases
+
+    pool = get_render_pool()
+    try:
+        with phase('render'):
+            future = pool.submit(render, data)
+            return future.result(timeout=RENDER_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise
+    except BrokenProcessPool:
+        # A render process died (e.g. killed for memory); start over with a new pool
+        global _render_pool
+        with _render_pool_lock:
+            if _render_pool is pool:
+                _render_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+# Generate and cache graphs; returns the encoded image as bytes, or None
+# for an unknown graph type
+def generate_graph(graph_type, month, data_version=None, image_format=None):
+    image_format = image_format or GRAPH_FORMAT
+
+    # Generate a unique cache key based on graph type, month, data version and format
+    if data_version is None:
+        data_version, _ = current_data_version()
+    cache_key = generate_cache_key(graph_type, month, data_version, image_format)
+
+    cached = load_cached_graph(cache_key, image_format)
+    if cached is not None:
+        return cached
+
+    # Concurrent requests for the same graph share a single render
+    return render_flights.do(
+        cache_key, lambda: render_graph_once(graph_type, month, image_format, cache_key)
+    )
 
-    plt.gca().invert_yaxis()
-    plt.tight_layout()
+# Render and publish a graph unless another process is already doing it, in
+# which case wait for its result. Called by one thread per cache key at a time.
+def render_graph_once(graph_type, month, image_format, cache_key):
+    lock_path = os.path.join(CACHE_DIR, f"{cache_key}.{image_format}.lock")
+    deadline = time.monotonic() + RENDER_LOCK_TIMEOUT
+    waited = False
+    while True:
+        # Also catches a render published just before this flight started
+        cached = load_cached_graph(cache_key, image_format)
+        if cached is not None:
+            return cached
+        locked = acquire_lock_file(lock_path, RENDER_LOCK_STALE)
+        if locked:
+            break
+        if time.monotonic() >= deadline:
+            app.logger.warning("Gave up waiting for another process to render %s", cache_key)
+            break
+        if not waited:
+            render_flights.count_coalesced()
+            waited = True
+        with phase('lock_wait'):
+            time.sleep(RENDER_LOCK_POLL_INTERVAL)
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
+    try:
+        if graph_type == DASHBOARD_GRAPH:
+            dashboard = fetch_dashboard(month)
+            with GRAPH_RENDER_SECONDS.time(graph_type, image_format):
+                image = run_renderer(render_dashboard_png, dashboard)
+        else:
+            # Query the leaderboard behind the graph
+            leaderboard = fetch_leaderboard(graph_type, month)
+            if leaderboard is None:
+                return None  # Invalid graph type
+            with GRAPH_RENDER_SECONDS.time(graph_type, image_format):
+                image = render_image(leaderboard, image_format)
+        publish_graph(graph_type, month, image_format, cache_key, image)
+        return image
+    finally:
+        if locked:
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass  # Broken as stale by another process
+
+# Return (cache_key, image) for a /graphs request. With the pre-render
+# worker running the request never renders itself: it gets the previous
+# rendition while the worker catches up on a version dashboards have not been
+# told about yet, and otherwise waits for the worker.
+def get_graph_for_request(graph_type, month, data_version, image_format):
+    cache_key = generate_cache_key(graph_type, month, data_version, image_format)
+    cached = load_cached_graph(cache_key, image_format)
+    if cached is not None:
+        GRAPH_CACHE_REQUESTS.inc(graph_type, 'hit')
+        return cache_key, cached
+
+    if not prerender_worker_running():
+        GRAPH_CACHE_REQUESTS.inc(graph_type, 'miss')
+        return cache_key, generate_graph(graph_type, month, data_version, image_format)
+
+    done = request_prerender(graph_type, month, image_format)
+
+    # Serve the last rendition of this graph (stale by one or more writes),
+    # unless /events already sent dashboards to fetch this version
+    stale_key = latest_graph_keys.get((graph_type, month, image_format))
+    if stale_key is not None and not version_announced(data_version):
+        stale = load_cached_graph(stale_key, image_format)
+        if stale is not None:
+            GRAPH_CACHE_REQUESTS.inc(graph_type, 'stale')
+            return stale_key, stale
+
+    # Nothing to show yet: wait for the worker, rendering inline only if it is stuck
+    GRAPH_CACHE_REQUESTS.inc(graph_type, 'miss')
+    with phase('prerender_wait'):
+        done.wait(PRERENDER_WAIT_TIMEOUT)
+    cached = load_cached_graph(cache_key, image_format)
+    if cached is not None:
+        return cache_key, cached
+    app.logger.warning("Pre-render worker did not deliver %s in time; rendering inline", cache_key)
+    return cache_key, generate_graph(graph_type, month, data_version, image_format)
+
+# Background pre-rendering
+# -----------------------
+# A daemon thread keeps the standard dashboard graph (/dashboard.png for the
+# current month) and up to PRERENDER_MAX_RECENT graphs requested within
+# PRERENDER_RECENT_WINDOW warm. It re-renders as soon as the data version
+# changes: immediately for writes made by this process, and within
+# PRERENDER_POLL_INTERVAL for writes made by other processes. The standard
+# graph goes first, and /events announces the version as soon as it is done.
+
+def prerender_worker_running():
+    return _prerender_thread is not None and _prerender_thread.is_alive()
+
+# Remember a graph as recently requested (forgetting the least recently
+# requested beyond PRERENDER_MAX_RECENT) and queue it for the worker. Returns
+# an Event that is set once the worker has rendered it.
+def request_prerender(graph_type, month, image_format):
+    target = (graph_type, month, image_format)
+    with _prerender_lock:
+        recent_graphs[target] = time.time()
+        recent_graphs.move_to_end(target)
+        while len(recent_graphs) > PRERENDER_MAX_RECENT:
+            recent_graphs.popitem(last=False)
+        done = _prerender_pending.get(target)
+        if done is None:
+            done = _prerender_pending[target] = threading.Event()
+            _prerender_queue.put(target)
+    return done
+
+# The graphs to keep warm: the standard dashboard graph first, then the
+# recently requested ones, most recent first
+def prerender_targets():
+    now = time.time()
+    standard = (DASHBOARD_GRAPH, datetime.now().strftime('%Y-%m'), 'png')
+    with _prerender_lock:
+        for target, seen in list(recent_graphs.items()):
+            if now - seen > PRERENDER_RECENT_WINDOW:
+                del recent_graphs[target]
+        return [standard] + [target for target in reversed(recent_graphs) if target != standard]
+
+def _prerender(target, data_version):
+    graph_type, month, image_format = target
+    try:
+        generate_graph(graph_type, month, data_version, image_format)
+    except Exception:
+        app.logger.exception("Pre-rendering %s failed", target)
+    finally:
+        with _prerender_lock:
+            done = _prerender_pending.pop(target, None)
+        if done is not None:
+            done.set()
+
+def _prerender_loop():
+    rendered_version = None
+    while True:
+        try:
+            target = _prerender_queue.get(timeout=PRERENDER_POLL_INTERVAL)
+        except queue.Empty:
+            target = None
+
+        try:
+            data_version, _ = current_data_version()
+        except sqlite3.Error:
+            app.logger.exception("Pre-render worker could not read the data version")
+            continue
+
+        if target is not None:
+            _prerender(target, data_version)
+        if data_version != rendered_version:
+            standard_target, *recent_targets = prerender_targets()
+            _prerender(standard_target, data_version)
+            rendered_version = data_version
+            mark_prerendered(data_version)
+            for recent_target in recent_targets:
+                _prerender(recent_target, data_version)
+
+def mark_prerendered(data_version):
+    global prerendered_version
+    with _prerendered:
+        prerendered_version = data_version
+        _prerendered.notify_all()
+
+# Block until the worker has rendered the standard graph for 'data_version'
+# (or a newer one), or 'timeout' seconds pass. Returns at once without a worker.
+def wait_for_prerender(data_version, timeout):
+    if not prerender_worker_running():
+        return
+    with _prerendered:
+        _prerendered.wait_for(
+            lambda: prerendered_version is not None and prerendered_version >= data_version, timeout
+        )
 
-    with open(cache_path, 'wb') as f:
-        f.write(buf.getbuffer())
+def mark_announced(data_version):
+    global announced_version
+    with _prerendered:
+        if announced_version is None or data_version > announced_version:
+            announced_version = data_version
+
+def version_announced(data_version):
+    return announced_version is not None and data_version <= announced_version
+
+def start_prerender_worker():
+    global _prerender_thread
+    with _prerender_lock:
+        if prerender_worker_running():
+            return
+        _prerender_thread = threading.Thread(target=_prerender_loop, name='graph-prerender', daemon=True)
+        _prerender_thread.start()
+
+# Local writes wake the worker straight away (None is "just check the version")
+leaderboard_changes.add_callback(lambda months: _prerender_queue.put(None))
+
+@app.before_request
+def ensure_database_initialized():
+    ensure_database()
+
+@app.before_request
+def ensure_prerender_worker():
+    # Started lazily so it runs under any server (app.run, waitress-serve, ...);
+    # tests render inline instead
+    if PRERENDER_ENABLED and not app.testing and not prerender_worker_running():
+        start_prerender_worker()
+
+# Request timing. Phases are only collected while the view runs, so for a
+# streamed response (e.g. /admin?page_size=all) the header and log line
+# cover the work done before the first byte.
+@app.before_request
+def start_request_timing():
+    if REQUEST_TIMING_ENABLED:
+        start_timing()
+
+@app.after_request
+def report_request_timing(response):
+    timer = stop_timing()
+    if timer is None:
+        return response
+    totals = timer.totals()
+    total = timer.elapsed()
+    response.headers['Server-Timing'] = server_timing_header(totals, total)
+    request_timing_log.info(json.dumps({
+        'route': request.path,
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'params': request.args.to_dict(),
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 3),
+        'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in totals.items()},
+    }))
+    return response
 
-    return buf
+@app.teardown_request
+def discard_request_timing(exc):
+    stop_timing()  # after_request is skipped when an error propagates
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by URL rule, not path, so /graphs?graph=... and 404s stay few series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+    started = g.get('metrics_started')
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method)
+    return response
 
 # Routes
 @app.route('/')
 def index():
     current_month = datetime.now().strftime('%Y-%m')
-    return render_template('layout.html', current_month=current_month)
+    # ?render=client draws the bars in the browser from /dashboard.json
+    render_mode = 'client' if request.args.get('render') == 'client' else 'png'
+    return render_template('layout.html', current_month=current_month, render_mode=render_mode)
 
 @app.route('/graphs')
 def serve_graph():
     graph_type = request.args.get('graph', 'monthly_volume')
     month = request.args.get('month', datetime.now().strftime('%Y-%m'))
-    graph_image = generate_graph(graph_type, month)
-    if graph_image is None:
+    image_format = request.args.get('format', GRAPH_FORMAT)
+    if graph_type not in GRAPH_TYPES:
         return "Invalid graph type", 400
+    if image_format not in RENDERERS:
+        return "Invalid graph format", 400
+    if not MONTH_PATTERN.fullmatch(month):
+        return "Invalid month", 400
+    return graph_response(graph_type, month, image_format)
+
+# All four graphs as one PNG, rendered from a single query
+@app.route('/dashboard.png')
+def serve_dashboard():
+    month = request.args.get('month', datetime.now().strftime('%Y-%m'))
+    if not MONTH_PATTERN.fullmatch(month):
+        return "Invalid month", 400
+    return graph_response(DASHBOARD_GRAPH, month, 'png')
+
+# Serve a (possibly cached) graph with revalidation headers
+def graph_response(graph_type, month, image_format):
+    # The cache key changes whenever the data does, so it doubles as a strong
+    # ETag; answer revalidations before touching any cache or rendering
+    data_version, updated_at = current_data_version()
+    etag = generate_cache_key(graph_type, month, data_version, image_format)
+
+    def build_response():
+        try:
+            served_key, image = get_graph_for_request(graph_type, month, data_version, image_format)
+        except TimeoutError:
+            app.logger.error("Rendering %s for %s timed out", graph_type, month)
+            response = make_response("Graph rendering timed out", 503)
+            response.headers['Retry-After'] = '5'
+            return response
+        response = make_response(image)
+        response.headers['Content-Type'] = RENDERERS[image_format][1]
+        # A stale rendition must not be cached under the current ETag
+        response.set_etag(served_key)
+        return response
+
+    return make_revalidated_response(etag, updated_at, build_response)
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    metric = request.args.get('metric', 'volume')
+    period = request.args.get('period', 'month')
+    month = request.args.get('month', datetime.now().strftime('%Y-%m'))
+    graph_type = API_GRAPH_TYPES.get((metric, period))
+    if graph_type is None:
+        return jsonify(error="metric must be volume|count and period must be month|ytd"), 400
+    if not MONTH_PATTERN.fullmatch(month):
+        return jsonify(error="month must be YYYY-MM"), 400
+
+    data_version, updated_at = current_data_version()
+    etag = generate_cache_key(graph_type, month, data_version, 'json')
+
+    def build_response():
+        leaderboard = fetch_leaderboard(graph_type, month)
+        return jsonify(
+            graph=graph_type,
+            title=leaderboard['title'],
+            month=month,
+            version=data_version,
+            leaders=rank_leaders(leaderboard['rows']),
+        )
 
-    response = make_response(graph_image.read())
-    response.headers['Content-Type'] = 'image/png'
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    graph_image.close()
-    return response
-
-from flask import Flask, render_template, request, redirect, url_for
+    return make_revalidated_response(etag, updated_at, build_response)
 
+# The four /api/leaderboard payloads (keyed by graph type) in one response,
+# from the same single query as /dashboard.png
+@app.route('/dashboard.json')
+def dashboard_json():
+    month = request.args.get('month', datetime.now().strftime('%Y-%m'))
+    if not MONTH_PATTERN.fullmatch(month):
+        return jsonify(error="month must be YYYY-MM"), 400
+
+    data_version, updated_at = current_data_version()
+    etag = generate_cache_key(DASHBOARD_GRAPH, month, data_version, 'json')
+
+    def build_response():
+        graphs = {
+            leaderboard['graph_type']: {
+                'title': leaderboard['title'],
+                'leaders': rank_leaders(leaderboard['rows']),
+            }
+            for leaderboard in fetch_dashboard(month)
+        }
+        return jsonify(month=month, version=data_version, graphs=graphs)
+
+    return make_revalidated_response(etag, updated_at, build_response)
+
+# Turn (agent, value) rows sorted best first into the API's leader objects
+def rank_leaders(rows):
+    leaders = []
+    for position, (agent, value) in enumerate(rows, start=1):
+        value = value or 0
+        # Ties share a rank (1, 2, 2, 4)
+        rank = leaders[-1]['rank'] if leaders and leaders[-1]['value'] == value else position
+        leaders.append({'agent': agent, 'value': value, 'rank': rank})
+    return leaders
+
+@app.route('/events')
+def leaderboard_events():
+    """
+    Server-Sent Events stream announcing leaderboard changes. Each 'leaderboard'
+    event carries the new data version and the months whose graphs changed
+    (null meaning every graph), so dashboards only reload what is affected.
+    Writes from other processes (add_data.py, other workers) are picked up by
+    comparing the data version at every heartbeat. With the pre-render worker
+    running, a version is only announced once the standard dashboard graph is
+    rendered, so the reloads it triggers get the new dashboard instead of the
+    previous one.
+    """
+    if not acquire_sse_stream():
+        response = make_response('Too many open event streams, poll instead.\n', 503)
+        response.headers['Retry-After'] = str(SSE_FULL_RETRY_AFTER)
+        return response
+
+    def stream():
+        sequence = leaderboard_changes.sequence
+        version, _ = current_data_version()
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+
+        while True:
+            sequence, changed, months = leaderboard_changes.wait(sequence, SSE_HEARTBEAT_INTERVAL)
+            latest, _ = current_data_version()
+            if latest != version:
+                if not changed:
+                    months = None  # Written elsewhere; we cannot tell which months
+                wait_for_prerender(latest, PRERENDER_WAIT_TIMEOUT)
+                version = latest
+                mark_announced(version)
+                payload = json.dumps({
+                    'version': version,
+                    'months': None if months is None else sorted(months),
+                })
+                yield f"event: leaderboard\nid: {version}\ndata: {payload}\n\n"
+            else:
+                # Comments keep proxies from closing the connection and let the
+                # server notice dashboards that went away
+                yield ": keep-alive\n\n"
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Do not buffer behind nginx
+    # The server closes the response when the stream ends or the client goes
+    # away, even if the generator never started
+    response.call_on_close(release_sse_stream)
+    return response
 
-from flask import redirect, url_for
+# Take one of the SSE_MAX_STREAMS slots; False when they are all in use
+def acquire_sse_stream():
+    global _sse_streams
+    with _sse_streams_lock:
+        if _sse_streams >= SSE_MAX_STREAMS:
+            return False
+        _sse_streams += 1
+        return True
+
+def release_sse_stream():
+    global _sse_streams
+    with _sse_streams_lock:
+        _sse_streams -= 1
+
+# Wrap a response that only changes with the data version: answer
+# If-None-Match / If-Modified-Since with 304 without calling build_response
+def make_revalidated_response(etag, updated_at, build_response):
+    last_modified = datetime.fromtimestamp(int(updated_at), timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+    else:
+        response = build_response()
+        if response.status_code >= 400:
+            return response  # Errors are not tied to the data version
+
+    # Clients keep the body but must revalidate it on every poll
+    if 'ETag' not in response.headers:
+        response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-from flask import redirect, url_for
+@app.route('/graphs/cache_stats')
+def graph_cache_stats():
+    return jsonify(dict(graph_memory_cache.stats(), render_flights=render_flights.stats()))
+
+# Row counts for /metrics as [(labels, rows)]. Transactions are summed from
+# the rollup rather than counted, and both are only read again once the data
+# version has moved on, so a scrape normally costs one single-row query.
+def table_row_counts():
+    global _table_rows
+    key = (DB_PATH, current_data_version()[0])
+    cached = _table_rows
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    db = get_db()
+    with SQLITE_QUERY_SECONDS.time('table_rows'):
+        transactions = db.execute('SELECT COALESCE(SUM(transaction_count), 0) FROM agent_month_totals').fetchone()[0]
+        agents = db.execute('SELECT COUNT(*) FROM agents').fetchone()[0]
+    rows = [({'table': 'transactions'}, transactions), ({'table': 'agents'}, agents)]
+    _table_rows = (key, rows)  # Read after the version, so never older than it
+    return rows
+
+# Prometheus scrape endpoint: the recorded metrics plus values read now
+@app.route('/metrics')
+def serve_metrics():
+    cache_files = cache_bytes = 0
+    try:
+        for entry in os.scandir(CACHE_DIR):
+            try:
+                if entry.is_file():
+                    cache_files += 1
+                    cache_bytes += entry.stat().st_size
+            except OSError:
+                pass  # Removed while scanning
+    except OSError:
+        pass
+    extra = [
+        ('leaderboard_graph_cache_dir_bytes', 'Size of the files in the graph cache directory.', 'gauge',
+         [({}, cache_bytes)]),
+        ('leaderboard_graph_cache_dir_files', 'Files in the graph cache directory.', 'gauge',
+         [({}, cache_files)]),
+        ('leaderboard_table_rows', 'Rows in a database table (transactions: those in the agent/month rollup).',
+         'gauge', table_row_counts()),
+        ('leaderboard_sse_streams', 'Open /events streams.', 'gauge', [({}, _sse_streams)]),
+        ('leaderboard_sqlite_writer_waits_total',
+         'Writes that queued because another write held the writer connection.', 'counter',
+         [({}, db_writer.waits)]),
+        ('leaderboard_sqlite_writer_wait_seconds_total', 'Time writes spent queued for the writer connection.',
+         'counter', [({}, db_writer.wait_seconds)]),
+        ('leaderboard_sqlite_locked_errors_total',
+         "Writes that failed with 'database is locked' after the busy timeout.", 'counter',
+         [({}, db_writer.locked_errors)]),
+    ]
+    return Response(metrics_registry.render(extra), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/change_agent_name', methods=['POST'])
 def change_agent_name():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    renamed = False
     try:
         # Fetch and validate input data
         agent_id = escape(request.form['agent_id']).strip()
         new_name = escape(request.form['new_name']).strip()
 
-        # Ensure the agent exists
-        cursor.execute('SELECT id, name FROM agents WHERE id = ?', (agent_id,))
-        agent = cursor.fetchone()
-
-        if agent:
-            if new_name.lower() == "other":
-                cursor.execute('UPDATE agents SET name = ? WHERE id = ?', (new_name, agent_id))
-                conn.commit()
-                message = f"Agent '{agent[1]}' has been renamed to '{new_name}'."
-                status = "success"
-            else:
-                cursor.execute('SELECT id FROM agents WHERE name = ?', (new_name,))
-                existing_agent = cursor.fetchone()
+        # Check and rename in one write transaction so the checks still hold
+        with write_transaction() as cursor:
+            # Ensure the agent exists
+            cursor.execute('SELECT id, name FROM agents WHERE id = ?', (agent_id,))
+            agent = cursor.fetchone()
 
-                if existing_agent:
-                    message = f"Agent '{new_name}' already exists. Please choose a different name."
-                    status = "error"
-                else:
+            if agent:
+                if new_name.lower() == "other":
                     cursor.execute('UPDATE agents SET name = ? WHERE id = ?', (new_name, agent_id))
-                    conn.commit()
+                    bump_data_version(cursor)
+                    renamed = True
                     message = f"Agent '{agent[1]}' has been renamed to '{new_name}'."
                     status = "success"
-        else:
-            message = "Agent not found."
-            status = "error"
-    except sqlite3.Error as e:
-        message = f"Database error: {str(e)}"
-        status = "error"
-    except Exception as e:
-        message = f"An unexpected error occurred: {str(e)}"
-        status = "error"
-    finally:
-        conn.close()
-
-    # Redirect to admin page with message and status as query parameters
-    return redirect(url_for('admin_panel', message=message, status=status))
-
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    message = None
-    status = None
-
-    try:
-        # Fetch and validate input data
-        agent_id = escape(request.form['agent_id']).strip()
-        new_name = escape(request.form['new_name']).strip()
-
-        # Ensure the agent exists
-        cursor.execute('SELECT id, name FROM agents WHERE id = ?', (agent_id,))
-        agent = cursor.fetchone()
-
-        if agent:
-            if new_name.lower() == "other":
-                cursor.execute('UPDATE agents SET name = ? WHERE id = ?', (new_name, agent_id))
-                conn.commit()
-                message = f"Agent '{agent[1]}' has been renamed to '{new_name}'."
-                status = "success"
-            else:
-                cursor.execute('SELECT id FROM agents WHERE name = ?', (new_name,))
-                existing_agent = cursor.fetchone()
-
-                if existing_agent:
-                    message = f"Agent '{new_name}' already exists. Please choose a different name."
-                    status = "error"
                 else:
-                    cursor.execute('UPDATE agents SET name = ? WHERE id = ?', (new_name, agent_id))
-                    conn.commit()
-                    message = f"Agent '{agent[1]}' has been renamed to '{new_name}'."
-                    status = "success"
-        else:
-            message = "Agent not found."
-            status = "error"
+                    cursor.execute('SELECT id FROM agents WHERE name = ?', (new_name,))
+                    existing_agent = cursor.fetchone()
 
+                    if existing_agent:
+                        message = f"Agent '{new_name}' already exists. Please choose a different name."
+                        status = "error"
+                    else:
+                        cursor.execute('UPDATE agents SET name = ? WHERE id = ?', (new_name, agent_id))
+                        bump_data_version(cursor)
+                        renamed = True
+                        message = f"Agent '{agent[1]}' has been renamed to '{new_name}'."
+                        status = "success"
+            else:
+                message = "Agent not found."
+                status = "error"
     except sqlite3.Error as e:
         message = f"Database error: {str(e)}"
         status = "error"
+        renamed = False
     except Exception as e:
         message = f"An unexpected error occurred: {str(e)}"
         status = "error"
+        renamed = False
 
-    finally:
-        conn.close()
-
-    # Store message and status in the session for display after redirect
-    from flask import session
-    session['message'] = message
-    session['status'] = status
+    if renamed:
+        leaderboard_changes.notify()
 
-    # Redirect to admin page (PRG pattern)
-    return redirect(url_for('admin_panel'))
-
-
-from flask import session, redirect, url_for, render_template
+    # Redirect to admin page with message and status as query parameters
+    return redirect(url_for('admin_panel', message=message, status=status))
 
 @app.route('/admin', methods=['GET', 'POST'])
 def admin_panel():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    cursor = get_db().cursor()
     message = request.args.get('message', None)  # Retrieve message from query parameters
     status = request.args.get('status', None)    # Retrieve status from query parameters
 
+    page = admin_page_args()
+    search_query = request.args.get('search_query', '').strip()
     try:
-        # Fetch agents and transactions from the database
-        agents = cursor.execute('SELECT * FROM agents').fetchall()
-        transactions = cursor.execute('''
-            SELECT t.id, a.name, t.volume, t.date, t.address
-            FROM transactions t
-            JOIN agents a ON t.agent_id = a.id
-        ''').fetchall()
+        # Fetch agents from the database
+        with phase('sql'), SQLITE_QUERY_SECONDS.time('admin_agents'):
+            agents = cursor.execute('SELECT * FROM agents').fetchall()
 
         if request.method == 'POST':
             if 'add_agent' in request.form:
                 agent_name = request.form['agent_name'].strip()
                 try:
-                    cursor.execute('INSERT INTO agents (name) VALUES (?)', (agent_name,))
-                    conn.commit()
-                    return redirect(url_for('admin_panel', message=f"Agent '{agent_name}' added successfully!", status="success"))
+                    with write_transaction() as write:
+                        write.execute('INSERT INTO agents (name) VALUES (?)', (agent_name,))
+                        bump_data_version(write)
                 except sqlite3.IntegrityError:
                     return redirect(url_for('admin_panel', message=f"Agent '{agent_name}' already exists.", status="error"))
+                leaderboard_changes.notify()
+                return redirect(url_for('admin_panel', message=f"Agent '{agent_name}' added successfully!", status="success"))
 
             elif 'add_transaction' in request.form:
                 agent_id = request.form['transaction_agent_id']
                 volume = float(request.form['transaction_volume'])
                 date = request.form['transaction_date']
                 address = request.form['transaction_address'].strip()
-                cursor.execute(
-                    'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
-                    (agent_id, volume, date, address)
-                )
-                conn.commit()
+                with write_transaction() as write:
+                    write.execute(
+                        'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
+                        (agent_id, volume, date, address)
+                    )
+                    apply_transactions_to_rollup(write, [(agent_id, volume, date)])
+                    bump_data_version(write)
+                leaderboard_changes.notify({date[:7]})
                 return redirect(url_for('admin_panel', message="Transaction added successfully!", status="success"))
 
             elif 'remove_agent' in request.form:
                 agent_id = request.form['agent_id']
-                cursor.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-                cursor.execute('DELETE FROM transactions WHERE agent_id = ?', (agent_id,))
-                conn.commit()
+                with write_transaction() as write:
+                    write.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
+                    write.execute('DELETE FROM transactions WHERE agent_id = ?', (agent_id,))
+                    remove_agent_from_rollup(write, agent_id)
+                    bump_data_version(write)
+                leaderboard_changes.notify()
                 return redirect(url_for('admin_panel', message="Agent removed successfully!", status="success"))
 
             elif 'remove_transaction' in request.form:
                 transaction_id = request.form['transaction_id']
-                cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-                conn.commit()
+                with write_transaction() as write:
+                    removed_date = remove_transaction_from_rollup(write, transaction_id)
+                    write.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
+                    removed = write.rowcount > 0
+                    if removed:
+                        bump_data_version(write)
+                if not removed:
+                    return redirect(url_for('admin_panel', message="Transaction not found.", status="error"))
+                leaderboard_changes.notify({removed_date[:7]} if removed_date else set())
                 return redirect(url_for('admin_panel', message="Transaction removed successfully!", status="success"))
 
+        # ?page_size=all streams every row (or every match) off the cursor,
+        # otherwise it's the best matches for a search or one page of the table
+        if page['stream']:
+            transactions = iter_transactions(
+                cursor, page['sort'], page['dir'] == 'desc',
+                search_query or None, ADMIN_STREAM_BATCH_ROWS
+            )
+        elif search_query:
+            with phase('sql'), SQLITE_QUERY_SECONDS.time('admin_search'):
+                transactions = search_transactions(cursor, search_query, ADMIN_SEARCH_LIMIT)
+        else:
+            with phase('sql'), SQLITE_QUERY_SECONDS.time('admin_page'):
+                transactions = fetch_admin_page(cursor, page)
+
     except sqlite3.Error as e:
         message = f"Database error: {e}"
         status = "error"
         agents = []
         transactions = []
 
-    finally:
-        conn.close()
-
-    return render_template(
-        'admin.html',
+    context = dict(
         agents=agents,
         transactions=transactions,
+        page=page,
+        search_query=search_query,
+        search_limit=ADMIN_SEARCH_LIMIT,
         message=message,
         status=status
     )
-
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    message = None
-    status = None
-
-    # Check if there's a message in the session (for PRG pattern)
-    if 'message' in session and 'status' in session:
-        message = session.pop('message', None)
-        status = session.pop('status', None)
-
-    try:
-        # Fetch agents and transactions from the database
-        agents = cursor.execute('SELECT * FROM agents').fetchall()
-        transactions = cursor.execute('''
-            SELECT t.id, a.name, t.volume, t.date, t.address
-            FROM transactions t
-            JOIN agents a ON t.agent_id = a.id
-        ''').fetchall()
-
-        # Handle form submissions (POST requests)
-        if request.method == 'POST':
-            if 'add_agent' in request.form:
-                agent_name = request.form['agent_name'].strip()
-                try:
-                    # Check for duplicate agent name
-                    cursor.execute('SELECT id FROM agents WHERE name = ?', (agent_name,))
-                    existing_agent = cursor.fetchone()
-
-                    if existing_agent:
-                        session['message'] = f"Agent '{agent_name}' already exists. Please choose a different name."
-                        session['status'] = "error"
-                    else:
-                        cursor.execute('INSERT INTO agents (name) VALUES (?)', (agent_name,))
-                        conn.commit()
-                        session['message'] = f"Agent '{agent_name}' added successfully!"
-                        session['status'] = "success"
-
-                except sqlite3.Error as e:
-                    session['message'] = f"Database error: {str(e)}"
-                    session['status'] = "error"
-
-            elif 'add_transaction' in request.form:
-                agent_id = request.form['transaction_agent_id']
-                volume = float(request.form['transaction_volume'])
-                date = request.form['transaction_date']
-                address = request.form['transaction_address'].strip()
-                try:
-                    cursor.execute(
-                        'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
-                        (agent_id, volume, date, address)
-                    )
-                    conn.commit()
-                    session['message'] = "Transaction added successfully!"
-                    session['status'] = "success"
-
-                except sqlite3.Error as e:
-                    session['message'] = f"Database error: {str(e)}"
-                    session['status'] = "error"
-
-            elif 'remove_agent' in request.form:
-                agent_id = request.form['agent_id']
-                try:
-                    cursor.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-                    cursor.execute('DELETE FROM transactions WHERE agent_id = ?', (agent_id,))
-                    conn.commit()
-                    session['message'] = "Agent removed successfully!"
-                    session['status'] = "success"
-
-                except sqlite3.Error as e:
-                    session['message'] = f"Database error: {str(e)}"
-                    session['status'] = "error"
-
-            elif 'remove_transaction' in request.form:
-                transaction_id = request.form['transaction_id']
-                try:
-                    cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-                    conn.commit()
-                    session['message'] = "Transaction removed successfully!"
-                    session['status'] = "success"
-
-                except sqlite3.Error as e:
-                    session['message'] = f"Database error: {str(e)}"
-                    session['status'] = "error"
-
-            # Redirect to prevent form resubmission (PRG pattern)
-            return redirect(url_for('admin_panel'))
-
-    except sqlite3.Error as e:
-        message = f"Database error: {str(e)}"
-        status = "error"
-        agents = []
-        transactions = []
-
-    finally:
-        conn.close()
-
-    # Render the admin panel template with agents, transactions, and any messages
-    return render_template(
-        'admin.html',
-        agents=agents,
-        transactions=transactions,
-        message=message,
-        status=status
+    if page['stream']:
+        # The page head goes out straight away and table rows follow as
+        # SQLite produces them; the request context (and with it this
+        # thread's read connection) stays open until the last row is sent
+        return Response(stream_with_context(
+            join_chunks(stream_template('admin.html', **context), ADMIN_STREAM_CHUNK_BYTES)
+        ))
+    with phase('template'):
+        return render_template('admin.html', **context)
+
+# Join the many small strings a streamed template yields into writes of
+# about 'size' characters, rather than one socket write per template tag
+def join_chunks(chunks, size):
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+# Sort, page size and keyset cursor of the admin transactions table, from the URL
+def admin_page_args():
+    sort = request.args.get('sort', 'date')
+    if sort not in TRANSACTION_SORT_COLUMNS:
+        sort = 'date'
+    direction = 'asc' if request.args.get('dir') == 'asc' else 'desc'
+    stream = request.args.get('page_size') == 'all'
+    if stream:
+        page_size = 'all'
+    else:
+        page_size = request.args.get('page_size', ADMIN_PAGE_SIZE, type=int)
+        page_size = min(max(page_size, 1), ADMIN_MAX_PAGE_SIZE)
+    after = decode_page_cursor(request.args.get('after'))
+    before = decode_page_cursor(request.args.get('before')) if after is None else None
+    return {
+        'sort': sort, 'dir': direction, 'page_size': page_size, 'stream': stream,
+        'after': after, 'before': before, 'next_url': None, 'prev_url': None,
+    }
+
+# Fetch the page of transactions described by 'page' (see admin_page_args)
+# and fill in the URLs of its neighbours
+def fetch_admin_page(cursor, page):
+    sort = page['sort']
+    rows, more = fetch_transaction_page(
+        cursor, sort, page['dir'] == 'desc', page['page_size'], page['after'], page['before']
     )
-
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    message = None
-    status = None  # To differentiate between success and error messages
-    agents = []
-    transactions = []
-    import secrets
-    secret_key = secrets.token_hex(32)  # Generates a 64-character hex key
-    print(secret_key)
-
-    try:
-        if request.method == 'POST':
-            # Add Agent
-            if 'add_agent' in request.form:
-                agent_name = request.form['agent_name'].strip()
-                try:
-                    # Check for duplicate agent name
-                    cursor.execute('SELECT id FROM agents WHERE name = ?', (agent_name,))
-                    existing_agent = cursor.fetchone()
-
-                    if existing_agent:
-                        message = f"Agent '{agent_name}' already exists. Please choose a different name."
-                        status = "error"
-                    else:
-                        cursor.execute('INSERT INTO agents (name) VALUES (?)', (agent_name,))
-                        conn.commit()
-                        message = f"Agent '{agent_name}' added successfully!"
-                        status = "success"
-
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                    status = "error"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-                    status = "error"
-
-            # Add Transaction
-            elif 'add_transaction' in request.form:
-                agent_id = request.form['transaction_agent_id']
-                volume = float(request.form['transaction_volume'])
-                date = request.form['transaction_date']
-                address = request.form['transaction_address'].strip()
-                try:
-                    cursor.execute(
-                        'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
-                        (agent_id, volume, date, address)
-                    )
-                    conn.commit()
-                    message = "Transaction added successfully!"
-                    status = "success"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                    status = "error"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-                    status = "error"
-
-            # Remove Agent
-            elif 'remove_agent' in request.form:
-                agent_id = request.form['agent_id']
-                try:
-                    cursor.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-                    cursor.execute('DELETE FROM transactions WHERE agent_id = ?', (agent_id,))
-                    conn.commit()
-                    message = "Agent removed successfully!"
-                    status = "success"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                    status = "error"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-                    status = "error"
-
-            # Remove Transaction
-            elif 'remove_transaction' in request.form:
-                transaction_id = request.form['transaction_id']
-                try:
-                    cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-                    conn.commit()
-                    message = "Transaction removed successfully!"
-                    status = "success"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                    status = "error"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-                    status = "error"
-
-        # Fetch agents and transactions for display
-        search_query = request.args.get('search_query', '').strip()
-        if search_query:
-            query = """
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-                WHERE a.name LIKE ? OR t.address LIKE ? OR t.date LIKE ?
-                ORDER BY t.date DESC
-            """
-            search_term = f"%{search_query}%"
-            transactions = cursor.execute(query, (search_term, search_term, search_term)).fetchall()
+    if rows:
+        links = {'sort': sort, 'dir': page['dir'], 'page_size': page['page_size']}
+        if page['before'] is not None:
+            # Came back from the next page, so it exists; 'more' is about earlier rows
+            has_next, has_prev = True, more
         else:
-            transactions = cursor.execute('''
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-            ''').fetchall()
-
-        agents = cursor.execute('SELECT * FROM agents').fetchall()
-
-    except sqlite3.Error as e:
-        message = f"Database error: {str(e)}"
-        status = "error"
-    except Exception as e:
-        message = f"An unexpected error occurred: {str(e)}"
-        status = "error"
-    finally:
-        conn.commit()
-        conn.close()
-
-    # Render the admin template with the data and message
-    return render_template(
-        'admin.html',
-        agents=agents,
-        transactions=transactions,
-        message=message,
-        status=status
+            has_next, has_prev = more, page['after'] is not None
+        if has_next:
+            page['next_url'] = url_for(
+                'admin_panel', after=encode_page_cursor(transaction_page_key(rows[-1], sort)), **links
+            )
+        if has_prev:
+            page['prev_url'] = url_for(
+                'admin_panel', before=encode_page_cursor(transaction_page_key(rows[0], sort)), **links
+            )
+    return rows
+
+# CSV exports for the accountants. Both stream rows straight off a cursor;
+# ?gzip=1 compresses the download on the fly.
+@app.route('/export/transactions.csv')
+def export_transactions():
+    try:
+        start, end = export_date_range()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    page = admin_page_args()  # Same sort, direction and search as the admin table
+    search_query = request.args.get('search_query', '').strip()
+    rows = iter_transactions(
+        get_db().cursor(), page['sort'], page['dir'] == 'desc',
+        search_query or None, EXPORT_BATCH_ROWS, start, end
+    )
+    return csv_download(
+        export_filename('transactions', start, end),
+        ('id', 'agent', 'volume', 'date', 'address'),
+        ((id_, agent, format_volume(volume), date_, address) for id_, agent, volume, date_, address in rows)
     )
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    message = None  # Message to be displayed on the page
-    status = "success"  # Status indicator for success or error
-    agents = []
-    transactions = []
-
+@app.route('/export/leaderboard.csv')
+def export_leaderboard():
+    metric = request.args.get('metric', 'volume')
+    if metric not in ('volume', 'count'):
+        return jsonify(error="metric must be volume|count"), 400
     try:
-        if request.method == 'POST':
-            if 'add_agent' in request.form:
-                agent_name = request.form['agent_name'].strip()
-                try:
-                    # Check if the agent name already exists
-                    cursor.execute('SELECT id FROM agents WHERE name = ?', (agent_name,))
-                    existing_agent = cursor.fetchone()
-
-                    if existing_agent:
-                        message = f"Agent '{agent_name}' already exists. Please choose a different name."
-                        status = "error"
-                    else:
-                        cursor.execute('INSERT INTO agents (name) VALUES (?)', (agent_name,))
-                        conn.commit()
-                        message = f"Agent '{agent_name}' added successfully!"
-                        status = "success"
-
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                    status = "error"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-                    status = "error"
-
-            elif 'add_transaction' in request.form:
-                agent_id = escape(request.form['transaction_agent_id'])
-                volume = float(request.form['transaction_volume'])
-                date = escape(request.form['transaction_date'])
-                address = escape(request.form['transaction_address'].strip())
-                try:
-                    cursor.execute(
-                        'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
-                        (agent_id, volume, date, address)
-                    )
-                    conn.commit()
-                    message = "Transaction added successfully!"
-                    status = "success"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                    status = "error"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-                    status = "error"
-
-            elif 'remove_agent' in request.form:
-                agent_id = escape(request.form['agent_id'])
-                try:
-                    cursor.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-                    cursor.execute('DELETE FROM transactions WHERE agent_id = ?', (agent_id,))
-                    conn.commit()
-                    message = "Agent removed successfully!"
-                    status = "success"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                    status = "error"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-                    status = "error"
-
-            elif 'remove_transaction' in request.form:
-                transaction_id = escape(request.form['transaction_id'])
-                try:
-                    cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-                    conn.commit()
-                    message = "Transaction removed successfully!"
-                    status = "success"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                    status = "error"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-                    status = "error"
-
-        # Fetch current agents and transactions for display
-        search_query = escape(request.args.get('search_query', '').strip())
-        if search_query:
-            query = """
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-                WHERE a.name LIKE ? OR t.address LIKE ? OR t.date LIKE ?
-                ORDER BY t.date DESC
-            """
-            search_term = f"%{search_query}%"
-            transactions = cursor.execute(query, (search_term, search_term, search_term)).fetchall()
-        else:
-            transactions = cursor.execute('''
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-            ''').fetchall()
-
-        agents = cursor.execute('SELECT * FROM agents').fetchall()
-
-    except sqlite3.Error as e:
-        message = f"Database error: {str(e)}"
-        status = "error"
-    except Exception as e:
-        message = f"An unexpected error occurred: {str(e)}"
-        status = "error"
-    finally:
-        conn.commit()
-        conn.close()
-
-    return render_template(
-        'admin.html',
-        agents=agents,
-        transactions=transactions,
-        message=message,
-        status=status
+        start, end = export_date_range(default_month=datetime.now().strftime('%Y-%m'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    search_query = request.args.get('search_query', '').strip()
+    rows = iter_agent_totals(get_db().cursor(), start, end, search_query or None, metric, EXPORT_BATCH_ROWS)
+    return csv_download(
+        export_filename('leaderboard', start, end),
+        ('rank', 'agent', 'volume', 'transactions'),
+        rank_agent_totals(rows, metric)
     )
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    message = None
-    agents = []
-    transactions = []
-
+# Half-open [start, end) date range of an export, from ?month=YYYY-MM,
+# ?year=YYYY or inclusive ?start= / ?end= dates (YYYY-MM-DD). Open ends are
+# None; with no dates at all the default_month (or everything) is exported.
+# Raises ValueError on malformed input.
+def export_date_range(default_month=None):
+    month = request.args.get('month')
+    year = request.args.get('year')
+    if month:
+        if not MONTH_PATTERN.fullmatch(month):
+            raise ValueError("month must be YYYY-MM")
+        return month_bounds(month)
+    if year:
+        if not re.fullmatch(r'\d{4}', year):
+            raise ValueError("year must be YYYY")
+        return year_bounds(year)
     try:
-        if request.method == 'POST':
-            if 'add_agent' in request.form:
-                agent_name = request.form['agent_name'].strip()
-                try:
-                    # Check if the agent name already exists
-                    cursor.execute('SELECT id FROM agents WHERE name = ?', (agent_name,))
-                    existing_agent = cursor.fetchone()
-
-                    if existing_agent:
-                        message = f"Agent '{agent_name}' already exists. Please choose a different name."
-                    else:
-                        cursor.execute('INSERT INTO agents (name) VALUES (?)', (agent_name,))
-                        conn.commit()
-                        message = f"Agent '{agent_name}' added successfully!"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-
-            elif 'add_transaction' in request.form:
-                agent_id = escape(request.form['transaction_agent_id'])
-                volume = float(request.form['transaction_volume'])
-                date = escape(request.form['transaction_date'])
-                address = escape(request.form['transaction_address'].strip())
-                try:
-                    cursor.execute(
-                        'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
-                        (agent_id, volume, date, address)
-                    )
-                    conn.commit()
-                    message = "Transaction added successfully!"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-
-            elif 'remove_agent' in request.form:
-                agent_id = escape(request.form['agent_id'])
-                try:
-                    cursor.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-                    cursor.execute('DELETE FROM transactions WHERE agent_id = ?', (agent_id,))
-                    conn.commit()
-                    message = "Agent removed successfully!"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-
-            elif 'remove_transaction' in request.form:
-                transaction_id = escape(request.form['transaction_id'])
-                try:
-                    cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-                    conn.commit()
-                    message = "Transaction removed successfully!"
-                except sqlite3.Error as e:
-                    message = f"Database error: {str(e)}"
-                except Exception as e:
-                    message = f"An unexpected error occurred: {str(e)}"
-
-            # Redirect after successful POST to prevent resubmission
-            return redirect(url_for('admin_panel', message=message))
-
-        # Handle GET requests and search functionality
-        search_query = escape(request.args.get('search_query', '').strip())
-        if search_query:
-            query = """
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-                WHERE a.name LIKE ? OR t.address LIKE ? OR t.date LIKE ?
-                ORDER BY t.date DESC
-            """
-            search_term = f"%{search_query}%"
-            transactions = cursor.execute(query, (search_term, search_term, search_term)).fetchall()
-        else:
-            transactions = cursor.execute('''
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-            ''').fetchall()
-
-        agents = cursor.execute('SELECT * FROM agents').fetchall()
-
-    except sqlite3.Error as e:
-        message = f"Database error: {str(e)}"
-    except Exception as e:
-        message = f"An unexpected error occurred: {str(e)}"
-    finally:
-        conn.commit()
-        conn.close()
+        start, end = (
+            date.fromisoformat(request.args[name]) if request.args.get(name) else None
+            for name in ('start', 'end')
+        )
+    except ValueError:
+        raise ValueError("start and end must be YYYY-MM-DD dates") from None
+    if start is None and end is None and default_month:
+        return month_bounds(default_month)
+    return (
+        start.isoformat() if start else None,
+        (end + timedelta(days=1)).isoformat() if end else None,
+    )
 
-    return render_template('admin.html', agents=agents, transactions=transactions, message=message)
+# Download name for an export, e.g. transactions_2024-12-01_2024-12-31.csv
+def export_filename(name, start, end):
+    if start:
+        name += f"_{start}" if end else f"_from_{start}"
+    if end:
+        last_day = date.fromisoformat(end) - timedelta(days=1)
+        name += f"_{last_day.isoformat()}" if start else f"_to_{last_day.isoformat()}"
+    return f"{name}.csv"
+
+def format_volume(volume):
+    return f"{volume:.2f}" if volume is not None else ""
+
+# (agent, volume, count) rows best first -> CSV rows, ties sharing a rank
+def rank_agent_totals(rows, metric):
+    rank = previous = None
+    for position, (agent, volume, count) in enumerate(rows, start=1):
+        value = count if metric == 'count' else volume or 0
+        if value != previous:
+            rank, previous = position, value
+        yield rank, agent, format_volume(volume or 0), count
+
+# Streamed CSV attachment, gzipped when ?gzip=1
+def csv_download(filename, header, rows):
+    chunks = csv_chunks(header, rows, EXPORT_BATCH_ROWS)
+    mimetype = 'text/csv'
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    message = None
-    agents = []
-    transactions = []
+# Keyset cursors travel in the URL as URL-safe base64 JSON
+def encode_page_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
 
+def decode_page_cursor(value):
+    if not value:
+        return None
     try:
-        if request.method == 'POST':
-            if 'add_agent' in request.form:
-                agent_name = request.form['agent_name'].strip()
-                try:
-                    cursor.execute('INSERT INTO agents (name) VALUES (?)', (agent_name,))
-                    conn.commit()
-                    message = f"Agent '{agent_name}' added successfully!"
-                except sqlite3.IntegrityError:
-                    message = f"Agent '{agent_name}' already exists. Please choose a different name."
-                except Exception as e:
-                    message = f"Error adding agent: {str(e)}"
-
-            elif 'add_transaction' in request.form:
-                agent_id = escape(request.form['transaction_agent_id'])
-                volume = float(request.form['transaction_volume'])
-                date = escape(request.form['transaction_date'])
-                address = escape(request.form['transaction_address'].strip())
-                cursor.execute(
-                    'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
-                    (agent_id, volume, date, address)
-                )
-                conn.commit()
-                message = "Transaction added successfully!"
-
-            elif 'remove_agent' in request.form:
-                agent_id = escape(request.form['agent_id'])
-                cursor.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-                cursor.execute('DELETE FROM transactions WHERE agent_id = ?', (agent_id,))
-                conn.commit()
-                message = "Agent removed successfully!"
-
-            elif 'remove_transaction' in request.form:
-                transaction_id = escape(request.form['transaction_id'])
-                cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-                conn.commit()
-                message = "Transaction removed successfully!"
-
-            return redirect(url_for('admin_panel', message=message))
-
-        search_query = escape(request.args.get('search_query', '').strip())
-        if search_query:
-            query = """
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-                WHERE a.name LIKE ? OR t.address LIKE ? OR t.date LIKE ?
-                ORDER BY t.date DESC
-            """
-            search_term = f"%{search_query}%"
-            transactions = cursor.execute(query, (search_term, search_term, search_term)).fetchall()
-        else:
-            transactions = cursor.execute('''
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-            ''').fetchall()
-
-        agents = cursor.execute('SELECT * FROM agents').fetchall()
-
-    except sqlite3.Error as e:
-        message = f"Database error: {str(e)}"
-    except Exception as e:
-        message = f"An unexpected error occurred: {str(e)}"
-    finally:
-        conn.commit()
-        conn.close()
+        key = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(key, list) or len(key) != 2 or not isinstance(key[1], int):
+        return None
+    return tuple(key)
+
+# Bulk import parsed records (see importer.py) through the shared writer
+# and tell listeners which months changed
+def run_import(records, batch_size=DEFAULT_BATCH_SIZE, create_agents=False, dry_run=False, progress=None):
+    report = import_transactions(
+        write_transaction, records, batch_size,
+        create_agents=create_agents, dry_run=dry_run, progress=progress
+    )
+    if report.imported and not dry_run:
+        leaderboard_changes.notify(None if report.created_agents else report.months)
+    return report
+
+# One line summary of an import for the admin page
+def describe_import(report, dry_run=False):
+    verb = 'Would import' if dry_run else 'Imported'
+    summary = f"{verb} {report.imported} transaction(s)"
+    if report.created_agents:
+        summary += f", {report.created_agents} new agent(s)"
+    if report.rejected:
+        number, reason = report.errors[0]
+        summary += f"; rejected {report.rejected} (record {number}: {reason})"
+    if report.failed:
+        summary += f". {report.failed}"
+    return summary + "."
+
+@app.route('/admin/import', methods=['POST'])
+def import_upload():
+    upload = request.files.get('import_file')
+    fmt = request.form.get('format') or detect_format(upload.filename if upload else None)
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+    if not upload or fmt not in ('csv', 'json'):
+        message = "Upload a .csv, .json or .jsonl file of transactions."
+        if wants_json:
+            return jsonify(error=message), 400
+        return redirect(url_for('admin_panel', message=message, status="error"))
+
+    dry_run = 'dry_run' in request.form
+    started = time.perf_counter()
+
+    def log_progress(report):
+        app.logger.info(
+            "Import of %s: %d imported, %d rejected (%.1fs)",
+            upload.filename, report.imported, report.rejected, time.perf_counter() - started
+        )
 
-    return render_template('admin.html', agents=agents, transactions=transactions, message=message)
+    # Parse the upload as it is read instead of loading it into memory
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    report = run_import(
+        read_records(stream, fmt), create_agents='create_agents' in request.form,
+        dry_run=dry_run, progress=log_progress
+    )
+    if wants_json:
+        return jsonify(report.as_dict())
+    if report.failed or not report.imported:
+        status = "error"
+    elif report.rejected:
+        status = "warning"
+    else:
+        status = "success"
+    return redirect(url_for('admin_panel', message=describe_import(report, dry_run), status=status))
+
+@app.cli.command('import-transactions')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default=None,
+              help='File format (default: from the file extension).')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Rows per write transaction.')
+@click.option('--create-agents', is_flag=True, help='Add unknown agents instead of rejecting their rows.')
+@click.option('--dry-run', is_flag=True, help='Only validate the file.')
+def import_transactions_command(path, fmt, batch_size, create_agents, dry_run):
+    """Bulk import transactions from a CSV or JSON (Lines) file."""
+    fmt = fmt or detect_format(path)
+    if fmt is None:
+        raise click.UsageError('Cannot tell the file format from its name, pass --format.')
+    ensure_database()
+    started = time.perf_counter()
+
+    def print_progress(report):
+        elapsed = time.perf_counter() - started
+        click.echo(
+            f"{report.imported} imported, {report.rejected} rejected "
+            f"({report.imported / elapsed if elapsed else 0:,.0f} rows/s)",
+            err=True
+        )
 
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        report = run_import(read_records(stream, fmt), batch_size, create_agents, dry_run, print_progress)
+    for number, reason in report.errors:
+        click.echo(f"Record {number}: {reason}", err=True)
+    if report.rejected > len(report.errors):
+        click.echo(f"... and {report.rejected - len(report.errors)} more rejected record(s)", err=True)
+    click.echo(f"{describe_import(report, dry_run)} ({time.perf_counter() - started:.1f}s)")
+    if report.failed:
+        raise SystemExit(1)
+
+# click callback accepting a YYYY-MM month (or nothing)
+def validate_month_option(ctx, param, value):
+    if value is not None and not MONTH_PATTERN.fullmatch(value):
+        raise click.BadParameter('expected a month as YYYY-MM, e.g. 2024-12')
+    return value
+
+@app.cli.command('rebuild-rollup')
+@click.option('--month', default=None, callback=validate_month_option, help='Only rebuild this month (YYYY-MM).')
+def rebuild_rollup_command(month):
+    """Rebuild the agent/month rollup from the transactions table."""
+    ensure_database()
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    message = None
-    agents = []
-    transactions = []
-
     try:
-        if request.method == 'POST':
-            if 'add_agent' in request.form:
-                agent_name = escape(request.form['agent_name'].strip())
-                cursor.execute('INSERT INTO agents (name) VALUES (?)', (agent_name,))
-                message = f"Agent '{agent_name}' added successfully!"
-
-            elif 'add_transaction' in request.form:
-                agent_id = escape(request.form['transaction_agent_id'])
-                volume = float(request.form['transaction_volume'])
-                date = escape(request.form['transaction_date'])
-                address = escape(request.form['transaction_address'].strip())
-                cursor.execute(
-                    'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
-                    (agent_id, volume, date, address)
-                )
-                message = "Transaction added successfully!"
-
-            elif 'remove_agent' in request.form:
-                agent_id = escape(request.form['agent_id'])
-                cursor.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-                cursor.execute('DELETE FROM transactions WHERE agent_id = ?', (agent_id,))
-                message = "Agent removed successfully!"
-
-            elif 'remove_transaction' in request.form:
-                transaction_id = escape(request.form['transaction_id'])
-                cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
-                message = "Transaction removed successfully!"
-
-            # Redirect after successful POST to prevent resubmission
-            conn.commit()
-            return redirect(url_for('admin_panel', message=message))
-
-        # Handle GET requests and search functionality
-        search_query = escape(request.args.get('search_query', '').strip())
-        if search_query:
-            query = """
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-                WHERE a.name LIKE ? OR t.address LIKE ? OR t.date LIKE ?
-                ORDER BY t.date DESC
-            """
-            search_term = f"%{search_query}%"
-            transactions = cursor.execute(query, (search_term, search_term, search_term)).fetchall()
+        if month:
+            buckets = rebuild_agent_month_totals(conn, *month_bounds(month))
         else:
-            transactions = cursor.execute('''
-                SELECT t.id, a.name, t.volume, t.date, t.address
-                FROM transactions t
-                JOIN agents a ON t.agent_id = a.id
-            ''').fetchall()
-
-        agents = cursor.execute('SELECT * FROM agents').fetchall()
-
-    except sqlite3.Error as e:
-        message = f"Database error: {escape(str(e))}"
-    except Exception as e:
-        message = f"An unexpected error occurred: {escape(str(e))}"
+            buckets = rebuild_agent_month_totals(conn)
     finally:
-        conn.commit()
         conn.close()
-
-    return render_template('admin.html', agents=agents, transactions=transactions, message=message)
-
-# Initialize the database before starting the app
-initialize_database()
+    click.echo(f"Rebuilt agent_month_totals: {buckets} agent/month bucket(s).")
+
+# A waitress server with a thread for every /events stream on top of the
+# threads serving everything else
+def create_server(host, port):
+    from waitress import create_server as create_waitress_server
+    return create_waitress_server(app, host=host, port=port, threads=SSE_MAX_STREAMS + SERVER_REQUEST_THREADS)
+
+@app.cli.command('serve')
+@click.option('--host', default='0.0.0.0', show_default=True)
+@click.option('--port', default=5000, show_default=True)
+@click.option('--threads', type=click.IntRange(min=1), default=None,
+              help=f'Threads for requests other than /events (default: {SERVER_REQUEST_THREADS}).')
+@click.option('--max-streams', type=click.IntRange(min=0), default=None,
+              help=f'Open /events streams allowed at once (default: {SSE_MAX_STREAMS}).')
+def serve_command(host, port, threads, max_streams):
+    """Serve the app with waitress, sized for the open /events streams."""
+    global SERVER_REQUEST_THREADS, SSE_MAX_STREAMS
+    if threads is not None:
+        SERVER_REQUEST_THREADS = threads
+    if max_streams is not None:
+        SSE_MAX_STREAMS = max_streams
+    server = create_server(host, port)
+    click.echo(f"Serving on http://{host}:{server.effective_port} "
+               f"({SSE_MAX_STREAMS} event streams + {SERVER_REQUEST_THREADS} request threads)")
+    server.run()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
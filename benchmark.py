@@ -0,0 +1,328 @@
+"""
+Benchmarks the leaderboard's graph pipeline against databases of growing size.
+
+For each fixture size (built once with generate_data.py and kept in
+--fixtures) this times, separately:
+
+- sql.<graph>        the leaderboard query behind each graph type, and the
+                     one-pass dashboard query
+- render.<graph>     drawing the bar chart with matplotlib (no encoding)
+- encode.png         encoding a drawn figure as PNG
+- roundtrip.<graph>  GET /graphs (and /dashboard.png) through the Flask
+                     test client
+
+each cold and warm. Cold runs start from a new SQLite connection (empty page
+and statement caches), a new matplotlib figure and empty graph caches; the
+operating system's file cache is not dropped. Warm runs repeat the same call
+with everything left in place and report the median.
+
+Results are written as JSON (--output); --baseline compares them with an
+earlier run and exits with status 1 when anything got slower than the
+tolerance allows.
+
+    python benchmark.py --sizes 1k,100k --output before.json
+    python benchmark.py --sizes 1k,100k --baseline before.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import matplotlib
+from PIL import Image
+
+from generate_data import generate_database
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+DEFAULT_SIZES = '1k,100k,1m'
+FIXTURE_AGENTS = 50
+FIXTURE_SEED = 20240101
+DEFAULT_REPEAT = 7  # Warm runs per measurement
+DEFAULT_TOLERANCE = 0.25  # Allowed slowdown against a baseline (25%)
+DEFAULT_NOISE_FLOOR = 0.002  # Seconds; smaller differences are never regressions
+GRAPH_TYPES = ('monthly_volume', 'monthly_transactions', 'ytd_volume', 'ytd_transactions')
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_size(label):
+    """Returns the row count for '1k', '100k', '1m' or a plain number."""
+    label = label.strip().lower()
+    if label in SIZES:
+        return SIZES[label]
+    multiplier = {'k': 1000, 'm': 1000000}.get(label[-1:], 1)
+    return int(float(label.rstrip('km')) * multiplier)
+
+
+def fixture_path(directory, label, end):
+    """Path of the fixture database for a size label and end date."""
+    return os.path.join(directory, f"{label}-seed{FIXTURE_SEED}-{end[:7]}.db")
+
+
+def ensure_fixture(directory, label, end):
+    """
+    Returns the fixture for 'label', generating it first if needed. Fixtures
+    end at 'end' (the 1st of next month) so the current month and year have
+    data, and are rebuilt when the month changes.
+    """
+    path = fixture_path(directory, label, end)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        print(f"Generating {path} ...", file=sys.stderr, flush=True)
+        partial = path + '.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+        generate_database(partial, FIXTURE_AGENTS, parse_size(label), FIXTURE_SEED, end=end)
+        os.replace(partial, path)
+    return path
+
+
+def timed(fn):
+    """Returns (seconds, result) for one call of fn()."""
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def summarize(cold, warm):
+    """One benchmark's result: the cold time and the spread of warm times."""
+    return {
+        'cold': cold,
+        'warm': statistics.median(warm),
+        'warm_min': min(warm),
+        'warm_max': max(warm),
+        'runs': len(warm),
+    }
+
+
+class Bench:
+    """
+    Runs the benchmarks for one fixture with the app module pointed at it.
+    """
+
+    def __init__(self, app_module, repeat):
+        self.app = app_module
+        self.repeat = repeat
+        self.month = datetime.date.today().strftime('%Y-%m')
+        self.client = app_module.app.test_client()
+        self.results = {}
+
+    def reset(self):
+        """Drops every cache a cold run should not benefit from."""
+        app = self.app
+        app.db_readers.close()
+        app.graph_memory_cache.clear()
+        app.latest_graph_keys.clear()
+        for name in os.listdir(app.CACHE_DIR):
+            os.remove(os.path.join(app.CACHE_DIR, name))
+
+    def measure(self, name, fn, cold_in_new_thread=False, cold_fn=None):
+        """
+        Times fn() once after reset() (cold_fn() instead, when given) and
+        then fn() 'repeat' more times.
+        """
+        self.reset()
+        cold_fn = cold_fn or fn
+        if cold_in_new_thread:
+            # Per-thread state (connections, pooled figures) starts empty
+            box = {}
+            thread = threading.Thread(target=lambda: box.update(result=timed(cold_fn)))
+            thread.start()
+            thread.join()
+            cold, _ = box['result']
+        else:
+            cold, _ = timed(cold_fn)
+        warm = [timed(fn)[0] for _ in range(self.repeat)]
+        self.results[name] = summarize(cold, warm)
+
+    def run(self):
+        app = self.app
+        with app.app.app_context():
+            for graph_type in GRAPH_TYPES:
+                self.measure(f'sql.{graph_type}', lambda: app.fetch_leaderboard(graph_type, self.month))
+            self.measure('sql.dashboard', lambda: app.fetch_dashboard(self.month))
+
+            leaderboards = {graph_type: app.fetch_leaderboard(graph_type, self.month) for graph_type in GRAPH_TYPES}
+        for graph_type, leaderboard in leaderboards.items():
+            self.measure(f'render.{graph_type}', lambda: draw(leaderboard), cold_in_new_thread=True)
+
+        figure = draw(leaderboards['monthly_volume'])
+        fresh_figure = draw(leaderboards['monthly_volume'], pooled=False)
+        self.measure('encode.png', lambda: encode_png(figure), cold_fn=lambda: encode_png(fresh_figure))
+
+        # Requests render on the calling thread's pooled figures
+        for graph_type in GRAPH_TYPES:
+            url = f'/graphs?graph={graph_type}&month={self.month}'
+            self.measure(f'roundtrip.{graph_type}', lambda: self.get(url), cold_in_new_thread=True)
+        self.measure('roundtrip.dashboard', lambda: self.get(f'/dashboard.png?month={self.month}'),
+                     cold_in_new_thread=True)
+        return self.results
+
+    def get(self, url):
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} answered {response.status_code}")
+        return response.data
+
+
+def draw(leaderboard, pooled=True):
+    """
+    Draws a leaderboard on this thread's pooled figure (or a new one),
+    without encoding it.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from renderers import pooled_axes, draw_leaderboard
+    if pooled:
+        figure, (axes,) = pooled_axes()
+    else:
+        figure = Figure(figsize=(10, 6))
+        FigureCanvasAgg(figure)
+        axes = figure.subplots()
+    draw_leaderboard(axes, leaderboard)
+    figure.tight_layout()
+    figure.canvas.draw()
+    return figure
+
+
+def encode_png(figure):
+    """Encodes an already drawn figure's pixels as PNG, like print_png does."""
+    canvas = figure.canvas
+    image = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+    buf = io.BytesIO()
+    image.save(buf, format='png')
+    return buf.getvalue()
+
+
+def environment():
+    """Versions and machine details stored alongside the results."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'matplotlib': matplotlib.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, noise_floor=DEFAULT_NOISE_FLOOR):
+    """
+    Returns (rows, regressions) comparing two result documents: a row of
+    (size, benchmark, phase, baseline seconds, current seconds, ratio) for
+    every measurement both contain, and the rows that are more than
+    'tolerance' slower and by more than 'noise_floor' seconds.
+    """
+    rows = []
+    for size, benchmarks in results['results'].items():
+        for name, current in benchmarks.items():
+            previous = baseline.get('results', {}).get(size, {}).get(name)
+            if previous is None:
+                continue
+            for phase in ('cold', 'warm'):
+                ratio = current[phase] / previous[phase] if previous[phase] else float('inf')
+                rows.append((size, name, phase, previous[phase], current[phase], ratio))
+    regressions = [
+        row for row in rows
+        if row[5] > 1 + tolerance and row[4] - row[3] > noise_floor
+    ]
+    return rows, regressions
+
+
+def print_results(results, out=sys.stderr):
+    for size, benchmarks in results['results'].items():
+        print(f"\n{size} transactions", file=out)
+        print(f"  {'benchmark':<34}{'cold ms':>10}{'warm ms':>10}", file=out)
+        for name, result in benchmarks.items():
+            print(f"  {name:<34}{result['cold'] * 1000:>10.2f}{result['warm'] * 1000:>10.2f}", file=out)
+
+
+def print_comparison(rows, regressions, out=sys.stderr):
+    print(f"\n  {'size':<6}{'benchmark':<32}{'phase':<6}{'base ms':>10}{'now ms':>10}{'ratio':>8}", file=out)
+    for row in rows:
+        size, name, phase, before, after, ratio = row
+        flag = '  REGRESSION' if row in regressions else ''
+        print(f"  {size:<6}{name:<32}{phase:<6}{before * 1000:>10.2f}{after * 1000:>10.2f}{ratio:>8.2f}{flag}",
+              file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma separated fixture sizes, e.g. 1k,100k,1m.')
+    parser.add_argument('--fixtures', default=os.path.join(REPO_DIR, 'benchmark_fixtures'),
+                        help='Directory the generated fixture databases are kept in.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Warm runs per benchmark.')
+    parser.add_argument('--output', help='Write the JSON results here (default: stdout).')
+    parser.add_argument('--baseline', help='Earlier JSON results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed slowdown against the baseline, as a fraction.')
+    parser.add_argument('--noise-floor', type=float, default=DEFAULT_NOISE_FLOOR,
+                        help='Slowdowns smaller than this many seconds are never regressions.')
+    args = parser.parse_args()
+
+    labels = [label.strip().lower() for label in args.sizes.split(',') if label.strip()]
+    today = datetime.date.today()
+    end = (today.replace(day=28) + datetime.timedelta(days=4)).replace(day=1).isoformat()
+    fixtures = {label: ensure_fixture(os.path.abspath(args.fixtures), label, end) for label in labels}
+
+    # Importing app creates ./cache, so do it from a scratch directory and
+    # then point it at each fixture
+    scratch = tempfile.mkdtemp(prefix='leaderboard-bench-')
+    os.chdir(scratch)
+    try:
+        import app as app_module
+        app_module.PRERENDER_ENABLED = False  # Time the request path, not the worker
+        app_module.CACHE_DIR = os.path.join(scratch, 'cache')
+        os.makedirs(app_module.CACHE_DIR, exist_ok=True)
+
+        results = {'environment': environment(), 'repeat': args.repeat, 'results': {}}
+        for label, path in fixtures.items():
+            print(f"Benchmarking {label} ...", file=sys.stderr, flush=True)
+            app_module.db_readers.close()
+            app_module.DB_PATH = path
+            # Fixtures are complete databases: skip the first-request setup,
+            # which would add the demo rows to them
+            app_module._initialized_databases.add(path)
+            results['results'][label] = Bench(app_module, args.repeat).run()
+        app_module.db_readers.close()
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print_results(results)
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(results, baseline, args.tolerance, args.noise_floor)
+        print_comparison(rows, regressions)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}.", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
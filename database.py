@@ -0,0 +1,661 @@
+"""
+Database helpers shared by the web app (app.py) and the maintenance
+scripts (add_data.py).
+
+The leaderboard graphs read from the 'agent_month_totals' rollup table
+instead of aggregating the whole 'transactions' table on every request.
+Every code path that writes to 'transactions' must keep the rollup in step
+using the helpers below, and bump the data version so cached graphs
+are re-rendered.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+# Each entry is a list of statements; never edit an entry once released,
+# append a new one instead.
+SCHEMA_MIGRATIONS = [
+    # 1: covering indexes so date-range and per-agent queries never scan
+    #    the whole transactions table
+    [
+        'CREATE INDEX IF NOT EXISTS idx_transactions_date_agent_volume '
+        'ON transactions (date, agent_id, volume)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_agent_date '
+        'ON transactions (agent_id, date)',
+    ],
+    # 2: single-row counter bumped by every write that changes what the
+    #    leaderboard shows; graph cache keys include it
+    [
+        '''CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )''',
+        "INSERT OR IGNORE INTO data_version (id, version, updated_at) "
+        "VALUES (1, 1, strftime('%s', 'now'))",
+    ],
+    # 3: keyset pagination of the admin transactions table walks these in
+    #    (sort column, id) order (sorting by id uses the table itself)
+    [
+        'CREATE INDEX IF NOT EXISTS idx_transactions_date_id ON transactions (date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_volume_id ON transactions (volume, id)',
+    ],
+    # 4: full-text index for the admin search box (see search_transactions),
+    #    one row per transaction (rowid = transactions.id), kept in sync by
+    #    triggers so every write path, including add_data.py, updates it
+    [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+            agent_name, address, date, prefix='2 3'
+        )''',
+        '''INSERT INTO transactions_fts (rowid, agent_name, address, date)
+        SELECT t.id, a.name, t.address, t.date
+        FROM transactions t
+        LEFT JOIN agents a ON a.id = t.agent_id''',
+        '''CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO transactions_fts (rowid, agent_name, address, date)
+            VALUES (new.id, (SELECT name FROM agents WHERE id = new.agent_id), new.address, new.date);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE ON transactions
+        BEGIN
+            DELETE FROM transactions_fts WHERE rowid = old.id;
+            INSERT INTO transactions_fts (rowid, agent_name, address, date)
+            VALUES (new.id, (SELECT name FROM agents WHERE id = new.agent_id), new.address, new.date);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions
+        BEGIN
+            DELETE FROM transactions_fts WHERE rowid = old.id;
+        END''',
+        # Renames (change_agent_name) and agents created after their transactions
+        '''CREATE TRIGGER IF NOT EXISTS agents_fts_update AFTER UPDATE OF name ON agents
+        BEGIN
+            UPDATE transactions_fts SET agent_name = new.name
+            WHERE rowid IN (SELECT id FROM transactions WHERE agent_id = new.id);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS agents_fts_insert AFTER INSERT ON agents
+        BEGIN
+            UPDATE transactions_fts SET agent_name = new.name
+            WHERE rowid IN (SELECT id FROM transactions WHERE agent_id = new.id);
+        END''',
+    ],
+    # 5: bulk loads (insert_transactions_bulk) switch the per-row search
+    #    index trigger off for their own transaction and index in one pass
+    [
+        '''CREATE TABLE IF NOT EXISTS search_index_sync (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            deferred INTEGER NOT NULL
+        )''',
+        'INSERT OR IGNORE INTO search_index_sync (id, deferred) VALUES (1, 0)',
+        'DROP TRIGGER IF EXISTS transactions_fts_insert',
+        '''CREATE TRIGGER transactions_fts_insert AFTER INSERT ON transactions
+        WHEN (SELECT deferred FROM search_index_sync WHERE id = 1) = 0
+        BEGIN
+            INSERT INTO transactions_fts (rowid, agent_name, address, date)
+            VALUES (new.id, (SELECT name FROM agents WHERE id = new.agent_id), new.address, new.date);
+        END''',
+    ],
+]
+
+# Sortable admin transaction columns: name -> (SQL column, position in the
+# rows returned by fetch_transaction_page)
+TRANSACTION_SORT_COLUMNS = {
+    'date': ('t.date', 3),
+    'volume': ('t.volume', 2),
+    'id': ('t.id', 0),
+}
+
+# Add a transaction to its agent/month bucket (creating the bucket if needed).
+# Rows whose date is not a valid date are skipped, matching the old
+# strftime('%Y-%m', t.date) = ? join in generate_graph.
+ROLLUP_ADD_SQL = '''
+    INSERT INTO agent_month_totals (agent_id, month, total_volume, transaction_count)
+    SELECT ?, strftime('%Y-%m', ?), ?, 1
+    WHERE strftime('%Y-%m', ?) IS NOT NULL
+    ON CONFLICT (agent_id, month) DO UPDATE SET
+        total_volume = total_volume + excluded.total_volume,
+        transaction_count = transaction_count + 1
+'''
+
+# Take a transaction back out of its agent/month bucket
+ROLLUP_SUBTRACT_SQL = '''
+    UPDATE agent_month_totals
+    SET total_volume = total_volume - ?,
+        transaction_count = transaction_count - 1
+    WHERE agent_id = ? AND month = strftime('%Y-%m', ?)
+'''
+
+
+def connect(path, busy_timeout=5.0, cached_statements=256, read_only=False, check_same_thread=True):
+    """
+    Opens a connection tuned for the web app. The database runs in WAL mode,
+    so readers see a consistent snapshot without blocking on writers and
+    vice versa, with synchronous=NORMAL (durable across application
+    crashes, fast commits). Colliding writers wait up to 'busy_timeout'
+    seconds instead of failing straight away with 'database is locked'.
+
+    A read_only connection is opened with mode=ro and query_only, so it
+    can never take the write lock.
+    """
+    if read_only:
+        conn = sqlite3.connect(
+            f'file:{quote(path)}?mode=ro', uri=True,
+            timeout=busy_timeout, cached_statements=cached_statements,
+            check_same_thread=check_same_thread,
+        )
+        conn.execute('PRAGMA query_only = ON')
+    else:
+        conn = sqlite3.connect(
+            path, timeout=busy_timeout, cached_statements=cached_statements,
+            check_same_thread=check_same_thread,
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
+class ThreadConnections:
+    """
+    Hands every thread one long-lived connection per database path (see
+    connect()), instead of connecting and closing on every request.
+
+    Read results must be fully fetched (fetchall, or fetchone of a single
+    row); an unfinished cursor keeps its read snapshot open.
+    """
+
+    def __init__(self, busy_timeout=5.0, cached_statements=256, read_only=False):
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.read_only = read_only
+        self._local = threading.local()
+
+    def _connections(self):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    def get(self, path):
+        """Return this thread's connection to 'path', opening it on first use."""
+        connections = self._connections()
+        conn = connections.get(path)
+        if conn is None:
+            conn = connections[path] = connect(
+                path, self.busy_timeout, self.cached_statements, self.read_only
+            )
+        return conn
+
+    def release(self):
+        """
+        End of a unit of work (e.g. a request): roll back anything left
+        uncommitted so this thread's connections hold no locks while idle.
+        """
+        for conn in self._connections().values():
+            if conn.in_transaction:
+                conn.rollback()
+
+    def close(self):
+        """Close this thread's connections."""
+        connections = self._connections()
+        while connections:
+            _, conn = connections.popitem()
+            conn.close()
+
+
+class SerializedWriter:
+    """
+    The single read-write connection per database path that every write
+    goes through, one transaction at a time. Writers queue on a lock
+    instead of fighting over SQLite's write lock, and readers on their own
+    read-only connections keep serving from their WAL snapshot meanwhile.
+
+    'waits' and 'wait_seconds' count the transactions that found the lock
+    taken and how long they queued; 'locked_errors' those that still failed
+    with 'database is locked' (another process held SQLite's write lock
+    past the busy timeout). They are only updated while holding the lock.
+    """
+
+    def __init__(self, busy_timeout=5.0, cached_statements=256):
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._connections = {}
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.locked_errors = 0
+
+    @contextmanager
+    def transaction(self, path):
+        """
+        Yields a cursor on the writer connection to 'path' while holding the
+        write lock. Commits when the block finishes, rolls back if it raises.
+        Transactions do not nest.
+        """
+        waited = None
+        if not self._lock.acquire(blocking=False):
+            started = time.perf_counter()
+            self._lock.acquire()
+            waited = time.perf_counter() - started
+        try:
+            if waited is not None:
+                self.waits += 1
+                self.wait_seconds += waited
+            conn = self._connections.get(path)
+            if conn is None:
+                conn = self._connections[path] = connect(
+                    path, self.busy_timeout, self.cached_statements, check_same_thread=False
+                )
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            except BaseException as e:
+                if isinstance(e, sqlite3.OperationalError) and 'locked' in str(e):
+                    self.locked_errors += 1
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Close the writer connections."""
+        with self._lock:
+            while self._connections:
+                _, conn = self._connections.popitem()
+                conn.close()
+
+
+def migrate_database(conn):
+    """
+    Applies any SCHEMA_MIGRATIONS the database has not seen yet.
+    Returns the resulting schema version.
+    """
+    cursor = conn.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    for number, statements in enumerate(SCHEMA_MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+        # PRAGMA does not accept bound parameters
+        cursor.execute(f'PRAGMA user_version = {int(number)}')
+        conn.commit()
+        version = number
+    return version
+
+
+def bump_data_version(cursor):
+    """
+    Marks the leaderboard data as changed. Call this inside the same
+    transaction as the write so readers never see new data with an old
+    version.
+    """
+    cursor.execute(
+        'UPDATE data_version SET version = version + 1, updated_at = ? WHERE id = 1',
+        (time.time(),)
+    )
+
+
+def get_data_version(cursor):
+    """
+    Returns (version, updated_at) for the leaderboard data.
+    """
+    cursor.execute('SELECT version, updated_at FROM data_version WHERE id = 1')
+    row = cursor.fetchone()
+    return row if row is not None else (0, 0.0)
+
+
+def insert_transactions_bulk(cursor, rows):
+    """
+    Inserts many (agent_id, volume, date, address) rows inside the caller's
+    write transaction. The search index is filled with one INSERT ... SELECT
+    over the new rows instead of the per-row trigger, which is several times
+    faster for large batches; the trigger is only switched off within this
+    transaction, so other writers never see it off. Does not touch the
+    rollup or data version.
+    """
+    last_id = cursor.execute('SELECT MAX(id) FROM transactions').fetchone()[0] or 0
+    cursor.execute('UPDATE search_index_sync SET deferred = 1 WHERE id = 1')
+    cursor.executemany(
+        'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)', rows
+    )
+    # New rows get ids above the old maximum (INTEGER PRIMARY KEY without AUTOINCREMENT)
+    cursor.execute('''
+        INSERT INTO transactions_fts (rowid, agent_name, address, date)
+        SELECT t.id, a.name, t.address, t.date
+        FROM transactions t
+        LEFT JOIN agents a ON a.id = t.agent_id
+        WHERE t.id > ?
+    ''', (last_id,))
+    cursor.execute('UPDATE search_index_sync SET deferred = 0 WHERE id = 1')
+
+
+def fetch_transaction_page(cursor, sort='date', descending=True, limit=50, after=None, before=None):
+    """
+    Returns (rows, more) for one page of the admin transactions table, using
+    keyset pagination: 'after' / 'before' is the (sort value, id) key of
+    the row the page starts after / ends before (see transaction_page_key),
+    so every page is an index range scan however deep it is. Rows are
+    (id, agent name, volume, date, address); 'more' is True when there are
+    further rows in the direction of travel. Rows whose sort value is NULL
+    only show up on the first or last page.
+    """
+    column, _ = TRANSACTION_SORT_COLUMNS[sort]
+    backwards = before is not None
+    key = before if backwards else after
+
+    # Walking back to a previous page reads in reverse and flips the rows back
+    scan_descending = descending != backwards
+    order = 'DESC' if scan_descending else 'ASC'
+    where = ''
+    params = []
+    if key is not None:
+        where = f"WHERE ({column}, t.id) {'<' if scan_descending else '>'} (?, ?)"
+        params = list(key)
+
+    cursor.execute(f'''
+        SELECT t.id, a.name, t.volume, t.date, t.address
+        FROM transactions t
+        JOIN agents a ON t.agent_id = a.id
+        {where}
+        ORDER BY {column} {order}, t.id {order}
+        LIMIT ?
+    ''', params + [limit + 1])
+    rows = cursor.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    return rows, more
+
+
+def transaction_page_key(row, sort):
+    """The (sort value, id) keyset cursor of a fetch_transaction_page row."""
+    _, position = TRANSACTION_SORT_COLUMNS[sort]
+    return row[position], row[0]
+
+
+def fts_prefix_query(text):
+    """
+    Turns free text from the search box into an FTS5 query matching rows
+    that contain every word as a prefix ('ali main' finds 'Alice' on
+    '12 Main St'). Words are quoted, so FTS5 operators and punctuation in
+    the input are searched for literally. Returns None if there is nothing
+    to search for.
+    """
+    terms = ['"{}"*'.format(word.replace('"', '""')) for word in text.split()]
+    return ' '.join(terms) or None
+
+
+def search_transactions(cursor, text, limit=100):
+    """
+    Returns up to 'limit' transactions matching the search text (see
+    fts_prefix_query) against agent name, address and date, best match
+    first, as (id, agent name, volume, date, address) rows.
+    """
+    query = fts_prefix_query(text)
+    if query is None:
+        return []
+    cursor.execute('''
+        WITH hits AS (
+            SELECT rowid, rank FROM transactions_fts
+            WHERE transactions_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        )
+        SELECT t.id, a.name, t.volume, t.date, t.address
+        FROM hits
+        JOIN transactions t ON t.id = hits.rowid
+        JOIN agents a ON a.id = t.agent_id
+        ORDER BY hits.rank
+    ''', (query, limit))
+    return cursor.fetchall()
+
+
+def iter_transactions(cursor, sort='date', descending=True, search=None, batch_size=500,
+                      start_date=None, end_date=None):
+    """
+    Yields every transaction, or every one matching the search text (see
+    fts_prefix_query), as (id, agent name, volume, date, address) rows,
+    fetching batch_size rows at a time so memory stays flat however many
+    there are. Pass a half-open [start_date, end_date) range (see
+    month_bounds) to only include those dates; either end may be None. The
+    table comes out in 'sort' order straight off its keyset index; search
+    matches come newest first in full-text index order, since ranking them
+    would mean sorting every match up front.
+    """
+    date_filter, params = date_range_filter('t.date', start_date, end_date)
+    if search is not None:
+        query = fts_prefix_query(search)
+        if query is None:
+            return
+        cursor.execute(f'''
+            SELECT t.id, a.name, t.volume, t.date, t.address
+            FROM transactions_fts
+            JOIN transactions t ON t.id = transactions_fts.rowid
+            JOIN agents a ON a.id = t.agent_id
+            WHERE transactions_fts MATCH ? {date_filter}
+            ORDER BY transactions_fts.rowid DESC
+        ''', [query] + params)
+    else:
+        column, _ = TRANSACTION_SORT_COLUMNS[sort]
+        order = 'DESC' if descending else 'ASC'
+        cursor.execute(f'''
+            SELECT t.id, a.name, t.volume, t.date, t.address
+            FROM transactions t
+            JOIN agents a ON t.agent_id = a.id
+            WHERE 1 {date_filter}
+            ORDER BY {column} {order}, t.id {order}
+        ''', params)
+    yield from iter_fetched(cursor, batch_size)
+
+
+def iter_agent_totals(cursor, start_date=None, end_date=None, search=None, metric='volume',
+                      batch_size=500):
+    """
+    Yields (agent name, total volume, transaction count) for every agent
+    over the half-open [start_date, end_date) range (either end may be
+    None), best first by 'metric' ('volume' or 'count'). Agents without
+    transactions in the range are included with a NULL volume and a zero
+    count, as on the leaderboard. Whole-month ranges are read from the
+    rollup; other ranges aggregate the (date, agent_id, volume) covering
+    index. With search text only matching transactions count (see
+    fts_prefix_query), and only agents with a match are listed.
+    """
+    whole_months = all(date is None or date.endswith('-01') for date in (start_date, end_date))
+    order = 'volume' if metric == 'volume' else 'count'
+    if search is None and whole_months:
+        # Per-agent searches of the rollup's (agent_id, month) key, like the graphs
+        date_filter, params = date_range_filter(
+            'r.month', start_date and start_date[:7], end_date and end_date[:7]
+        )
+        cursor.execute(f'''
+            SELECT a.name, SUM(r.total_volume) AS volume,
+                COALESCE(SUM(r.transaction_count), 0) AS count
+            FROM agents a
+            LEFT JOIN agent_month_totals r ON r.agent_id = a.id {date_filter}
+            GROUP BY a.id
+            ORDER BY {order} DESC, a.name
+        ''', params)
+        yield from iter_fetched(cursor, batch_size)
+        return
+
+    date_filter, params = date_range_filter('t.date', start_date, end_date)
+    if search is not None:
+        query = fts_prefix_query(search)
+        if query is None:
+            return
+        totals = f'''
+            SELECT t.agent_id, SUM(t.volume) AS volume, COUNT(*) AS count
+            FROM transactions_fts
+            JOIN transactions t ON t.id = transactions_fts.rowid
+            WHERE transactions_fts MATCH ? {date_filter}
+            GROUP BY t.agent_id
+        '''
+        params = [query] + params
+        join = 'JOIN'
+    else:
+        totals = f'''
+            SELECT t.agent_id, SUM(t.volume) AS volume, COUNT(*) AS count
+            FROM transactions t
+            WHERE 1 {date_filter}
+            GROUP BY t.agent_id
+        '''
+        join = 'LEFT JOIN'
+    cursor.execute(f'''
+        SELECT a.name, totals.volume AS volume, COALESCE(totals.count, 0) AS count
+        FROM agents a
+        {join} ({totals}) totals ON totals.agent_id = a.id
+        ORDER BY {order} DESC, a.name
+    ''', params)
+    yield from iter_fetched(cursor, batch_size)
+
+
+def date_range_filter(column, start, end):
+    """
+    Returns an ('AND column >= ? AND column < ?' SQL fragment, params) pair
+    for a half-open range, leaving out whichever end is None.
+    """
+    sql = ''
+    params = []
+    if start is not None:
+        sql += f' AND {column} >= ?'
+        params.append(start)
+    if end is not None:
+        sql += f' AND {column} < ?'
+        params.append(end)
+    return sql, params
+
+
+def iter_fetched(cursor, batch_size=500):
+    """Yields an executed cursor's rows, fetching batch_size at a time."""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def month_bounds(month):
+    """
+    Returns the half-open ISO date range [first day, first day of next month)
+    for a 'YYYY-MM' month, so queries can use 'date >= ? AND date < ?' and
+    stay index friendly instead of wrapping the column in strftime().
+    """
+    year, month_number = (int(part) for part in month.split('-')[:2])
+    if month_number == 12:
+        return f"{year:04d}-12-01", f"{year + 1:04d}-01-01"
+    return f"{year:04d}-{month_number:02d}-01", f"{year:04d}-{month_number + 1:02d}-01"
+
+
+def year_bounds(year):
+    """
+    Returns the half-open ISO date range [Jan 1st, Jan 1st of next year).
+    """
+    year = int(year)
+    return f"{year:04d}-01-01", f"{year + 1:04d}-01-01"
+
+
+def create_rollup_table(cursor):
+    """
+    Creates the 'agent_month_totals' rollup table if it does not exist.
+    Returns True when the table was created by this call, meaning it still
+    has to be populated with rebuild_agent_month_totals().
+    """
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'agent_month_totals'"
+    )
+    exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS agent_month_totals (
+            agent_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            total_volume REAL NOT NULL DEFAULT 0,
+            transaction_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (agent_id, month)
+        )
+    ''')
+    return not exists
+
+
+def apply_transactions_to_rollup(cursor, rows):
+    """
+    Adds newly inserted transactions to the rollup.
+    'rows' is an iterable of (agent_id, volume, date) tuples.
+    """
+    cursor.executemany(
+        ROLLUP_ADD_SQL,
+        ((agent_id, date, volume, date) for agent_id, volume, date in rows)
+    )
+
+
+def remove_transaction_from_rollup(cursor, transaction_id):
+    """
+    Subtracts a transaction from the rollup. Must be called before the
+    transaction row itself is deleted. Returns the transaction's date, or
+    None if it does not exist.
+    """
+    cursor.execute(
+        'SELECT agent_id, volume, date FROM transactions WHERE id = ?',
+        (transaction_id,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    agent_id, volume, date = row
+    cursor.execute(ROLLUP_SUBTRACT_SQL, (volume or 0, agent_id, date))
+    cursor.execute('''
+        DELETE FROM agent_month_totals
+        WHERE agent_id = ? AND month = strftime('%Y-%m', ?) AND transaction_count <= 0
+    ''', (agent_id, date))
+    return date
+
+
+def remove_agent_from_rollup(cursor, agent_id):
+    """
+    Drops every rollup bucket belonging to an agent.
+    """
+    cursor.execute('DELETE FROM agent_month_totals WHERE agent_id = ?', (agent_id,))
+
+
+def rebuild_agent_month_totals(conn, start_date=None, end_date=None):
+    """
+    Recomputes the rollup from the 'transactions' table.
+    Use this for databases created before the rollup existed or after
+    rows were written behind the app's back. Pass a half-open
+    [start_date, end_date) range (see month_bounds) to only rebuild the
+    months inside it; the range is served by the (date, agent_id, volume)
+    covering index. Returns the number of buckets rebuilt.
+    """
+    cursor = conn.cursor()
+    create_rollup_table(cursor)
+
+    if start_date is None or end_date is None:
+        cursor.execute('DELETE FROM agent_month_totals')
+        date_filter = ''
+        params = ()
+    else:
+        cursor.execute(
+            'DELETE FROM agent_month_totals WHERE month >= ? AND month < ?',
+            (start_date[:7], end_date[:7])
+        )
+        date_filter = 'AND date >= ? AND date < ?'
+        params = (start_date, end_date)
+
+    cursor.execute(f'''
+        INSERT INTO agent_month_totals (agent_id, month, total_volume, transaction_count)
+        SELECT agent_id, strftime('%Y-%m', date), COALESCE(SUM(volume), 0), COUNT(*)
+        FROM transactions
+        WHERE agent_id IS NOT NULL AND strftime('%Y-%m', date) IS NOT NULL {date_filter}
+        GROUP BY agent_id, strftime('%Y-%m', date)
+    ''', params)
+    rebuilt = cursor.rowcount
+    bump_data_version(cursor)
+    conn.commit()
+    return rebuilt
@@ -0,0 +1,57 @@
+"""
+In-process change notifications for the leaderboard.
+
+Write paths in app.py call ChangeNotifier.notify() after committing; the
+/events Server-Sent Events stream waits on it, so idle dashboards cost one
+parked connection each instead of a poll every few seconds.
+"""
+import threading
+from collections import deque
+
+
+class ChangeNotifier:
+    """
+    Records which months each leaderboard write touched and wakes up every
+    waiting listener.
+
+    Listeners remember the sequence number they last saw and call wait()
+    with it. 'months' is a set of 'YYYY-MM' strings, or None when every
+    graph may have changed (agent added/removed/renamed, or the listener
+    fell too far behind to know).
+    """
+
+    def __init__(self, history=256):
+        self._condition = threading.Condition()
+        self._changes = deque(maxlen=history)  # (sequence, months)
+        self._callbacks = []
+        self.sequence = 0
+
+    def add_callback(self, callback):
+        """Call callback(months) after every notify(), e.g. to wake a worker thread."""
+        self._callbacks.append(callback)
+
+    def notify(self, months=None):
+        """Record a committed change and wake up all listeners."""
+        with self._condition:
+            self.sequence += 1
+            self._changes.append((self.sequence, None if months is None else frozenset(months)))
+            self._condition.notify_all()
+        for callback in self._callbacks:
+            callback(months)
+
+    def wait(self, after_sequence, timeout):
+        """
+        Blocks until there is a change newer than 'after_sequence' or the
+        timeout expires. Returns (sequence, changed, months) where 'months'
+        merges every change the listener has not seen yet.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.sequence != after_sequence, timeout)
+            sequence = self.sequence
+            if sequence == after_sequence:
+                return sequence, False, set()
+
+            pending = [months for seq, months in self._changes if seq > after_sequence]
+            if len(pending) < sequence - after_sequence or any(m is None for m in pending):
+                return sequence, True, None  # Missed some history, or a global change
+            return sequence, True, set().union(*pending)
@@ -0,0 +1,64 @@
+"""
+Streaming CSV export.
+
+The /export/*.csv endpoints in app.py pass a generator of database rows
+through csv_chunks (and gzip_chunks when compression is asked for), so a
+response only ever holds one chunk of rows in memory however big the table
+is.
+
+Text that a spreadsheet would take for a formula (an address typed as
+'=HYPERLINK(...)', say) is exported with a leading apostrophe, so opening
+the file never runs anything a user entered.
+"""
+import csv
+import io
+import re
+import zlib
+
+CHUNK_ROWS = 1000  # Rows encoded per chunk of CSV
+GZIP_LEVEL = 6
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')  # Spreadsheets evaluate cells starting with these
+NUMBER = re.compile(r'[+-]?\d+(\.\d+)?')  # e.g. a negative volume formatted by the caller
+
+
+def escape_formula(value):
+    """
+    Prefixes text a spreadsheet would evaluate with an apostrophe. Plain
+    numbers and non-text values pass through.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def csv_chunks(header, rows, chunk_rows=CHUNK_ROWS):
+    """
+    Yields the CSV text of a header row followed by 'rows', chunk_rows rows
+    per string.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    count = 0
+    for row in rows:
+        writer.writerow([escape_formula(value) for value in row])
+        count += 1
+        if count == chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    """
+    Compresses a stream of text chunks into a gzip file, encoded as UTF-8,
+    yielding compressed bytes as they become available.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
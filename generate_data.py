@@ -0,0 +1,244 @@
+"""
+Builds synthetic leaderboard databases for load and performance testing.
+
+Unlike add_data.py, which appends a few hundred random rows to the live
+database.db, this writes a complete new database at the given path: agents
+and transactions generated with numpy in vectorised chunks from one seed, so
+the same arguments always produce the same data. Transaction dates follow a
+seasonal, weekday-heavy curve, agents get Zipf-skewed shares of the
+business and their own price levels, and rows are written in date order
+like a real history.
+
+The load is tuned for tens of millions of rows: synchronous=OFF and no
+journal while loading (the file is thrown away if generation fails), one
+transaction per chunk, and the secondary indexes, full-text index and
+leaderboard rollup are built once at the end by the normal schema
+migrations instead of row by row.
+
+    python generate_data.py fixtures/1m.db --agents 200 --transactions 1000000 --seed 7
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from database import migrate_database, create_rollup_table, rebuild_agent_month_totals
+
+DEFAULT_AGENTS = 50
+DEFAULT_TRANSACTIONS = 100000
+DEFAULT_YEARS = 3
+DEFAULT_CHUNK_SIZE = 250000  # Rows generated and inserted per transaction
+DEFAULT_SKEW = 1.1  # Zipf exponent of agent activity; 0 spreads business evenly
+DEFAULT_SEASONALITY = 0.35  # Peak-month volume is (1 + s) / (1 - s) times the quietest month's
+PEAK_MONTH = 6  # June
+WEEKEND_WEIGHT = 0.3  # Relative number of closings on a Saturday or Sunday
+MEDIAN_PRICE = 350000  # Median sale price across agents
+AGENT_PRICE_SPREAD = 0.45  # Log-normal sigma of the agents' own median prices
+PRICE_SPREAD = 0.35  # Log-normal sigma of prices around an agent's median
+
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David",
+    "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah",
+    "Carlos", "Karen", "Daniel", "Lisa", "Matthew", "Nancy", "Anthony", "Betty", "Mark", "Sandra",
+    "Steven", "Ashley", "Andrew", "Kimberly", "Priya", "Emily", "Kevin", "Donna", "Wei", "Michelle",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+    "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore",
+    "Jackson", "Martin", "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez",
+    "Lewis", "Robinson", "Walker", "Young", "Allen", "King", "Wright", "Scott", "Nguyen", "Patel",
+]
+STREET_NAMES = [
+    "Main", "Elm", "Maple", "Pine", "Oak", "Cedar", "Park", "Lake", "Hill", "Washington", "Lincoln",
+    "Sunset", "River", "Spring", "Willow", "Highland", "Meadow", "Forest", "Church", "Mill",
+]
+STREET_SUFFIXES = ["St", "Ave", "Rd", "Ln", "Dr", "Ct", "Blvd", "Way"]
+CITIES = [
+    ("Springfield", "IL"), ("Rivertown", "CA"), ("Hill Valley", "CA"), ("Lakeside", "TX"),
+    ("Fairview", "NY"), ("Georgetown", "TX"), ("Madison", "FL"), ("Franklin", "TN"),
+    ("Clinton", "NY"), ("Greenville", "SC"), ("Bristol", "CT"), ("Salem", "OR"),
+]
+
+
+def agent_names(count, rng):
+    """
+    Returns 'count' unique agent names: shuffled first/last name pairs,
+    numbered once every pair has been used.
+    """
+    pairs = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    order = rng.permutation(len(pairs))
+    return [
+        pairs[order[i % len(pairs)]] + (f" {i // len(pairs) + 1}" if i >= len(pairs) else "")
+        for i in range(count)
+    ]
+
+
+def agent_profiles(count, rng, skew=DEFAULT_SKEW):
+    """
+    Returns (share, median price) arrays for 'count' agents: each agent's
+    probability of handling a given sale, following a Zipf law with
+    exponent 'skew' in random agent order, and the median of their prices.
+    """
+    share = 1.0 / np.arange(1, count + 1) ** skew
+    rng.shuffle(share)
+    median_price = rng.lognormal(np.log(MEDIAN_PRICE), AGENT_PRICE_SPREAD, count)
+    return share / share.sum(), median_price
+
+
+def day_weights(start, end, seasonality=DEFAULT_SEASONALITY):
+    """
+    Returns (days, probability) for every date in [start, end): a yearly
+    cosine peaking in PEAK_MONTH, with weekends at WEEKEND_WEIGHT.
+    """
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D'))
+    month = days.astype('datetime64[M]').astype(int) % 12 + 1
+    weight = 1 + seasonality * np.cos(2 * np.pi * (month - PEAK_MONTH) / 12)
+    weekday = (days.astype(int) + 3) % 7  # 1970-01-01 was a Thursday; Monday is 0
+    weight = np.where(weekday >= 5, weight * WEEKEND_WEIGHT, weight)
+    return days, weight / weight.sum()
+
+
+def generate_chunk(rng, dates, share, median_price):
+    """
+    Returns (agent_id, volume, date, address) rows for one chunk of
+    transactions on the given array of dates.
+    """
+    size = len(dates)
+    agents = rng.choice(len(share), size, p=share)
+    volumes = np.round(rng.lognormal(np.log(median_price[agents]), PRICE_SPREAD), -2)
+    numbers = rng.integers(1, 10000, size)
+    streets = rng.integers(len(STREET_NAMES), size=size)
+    suffixes = rng.integers(len(STREET_SUFFIXES), size=size)
+    cities = rng.integers(len(CITIES), size=size)
+    addresses = [
+        f"{number} {STREET_NAMES[street]} {STREET_SUFFIXES[suffix]}, {CITIES[city][0]}, {CITIES[city][1]}"
+        for number, street, suffix, city in zip(numbers.tolist(), streets.tolist(), suffixes.tolist(), cities.tolist())
+    ]
+    return zip(
+        (agents + 1).tolist(), volumes.tolist(), np.datetime_as_string(dates, unit='D').tolist(), addresses
+    )
+
+
+def create_schema(cursor):
+    """Creates the agents and transactions tables as app.initialize_database does."""
+    cursor.execute('''
+        CREATE TABLE agents (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE transactions (
+            id INTEGER PRIMARY KEY,
+            agent_id INTEGER,
+            volume REAL,
+            date TEXT,
+            address TEXT,
+            FOREIGN KEY (agent_id) REFERENCES agents(id)
+        )
+    ''')
+
+
+def generate_database(path, agents=DEFAULT_AGENTS, transactions=DEFAULT_TRANSACTIONS, seed=0,
+                      start=None, end=None, skew=DEFAULT_SKEW, seasonality=DEFAULT_SEASONALITY,
+                      chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Writes a new database at 'path' (which must not exist) with 'agents'
+    agents and 'transactions' transactions dated in [start, end) (ISO
+    dates, by default the DEFAULT_YEARS years up to the end of this month)
+    and returns the path. progress(rows written, total) is called after
+    every chunk.
+    """
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    if end is None:
+        today = datetime.date.today()
+        end = (today.replace(day=28) + datetime.timedelta(days=4)).replace(day=1).isoformat()
+    if start is None:
+        end_date = datetime.date.fromisoformat(end)
+        start = end_date.replace(year=end_date.year - DEFAULT_YEARS).isoformat()
+    rng = np.random.default_rng(seed)
+    share, median_price = agent_profiles(agents, rng, skew)
+    days, day_probability = day_weights(start, end, seasonality)
+    # Closings per day up front, so chunks can be written in date order
+    last_row_of_day = np.cumsum(rng.multinomial(transactions, day_probability))
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA cache_size = -262144')  # 256 MiB
+        cursor = conn.cursor()
+        create_schema(cursor)
+        cursor.executemany('INSERT INTO agents (name) VALUES (?)', ((name,) for name in agent_names(agents, rng)))
+        conn.commit()
+
+        for first in range(0, transactions, chunk_size):
+            rows = np.arange(first, min(first + chunk_size, transactions))
+            dates = days[np.searchsorted(last_row_of_day, rows, side='right')]
+            cursor.executemany(
+                'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
+                generate_chunk(rng, dates, share, median_price)
+            )
+            conn.commit()
+            if progress is not None:
+                progress(first + len(rows), transactions)
+
+        # Secondary and full-text indexes, then the rollup, each in one pass
+        migrate_database(conn)
+        create_rollup_table(cursor)
+        rebuild_agent_month_totals(conn)
+        conn.commit()
+        conn.execute('PRAGMA journal_mode = WAL')
+    except BaseException:
+        conn.close()
+        os.remove(path)
+        raise
+    conn.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('path', help='Database file to create.')
+    parser.add_argument('--agents', type=int, default=DEFAULT_AGENTS)
+    parser.add_argument('--transactions', type=int, default=DEFAULT_TRANSACTIONS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', help='First date (YYYY-MM-DD); default %d years before --end.' % DEFAULT_YEARS)
+    parser.add_argument('--end', help='Day after the last date (YYYY-MM-DD); default the 1st of next month. '
+                                      'Pass it for the same data on any day.')
+    parser.add_argument('--skew', type=float, default=DEFAULT_SKEW,
+                        help='Zipf exponent of agent activity (0 = even).')
+    parser.add_argument('--seasonality', type=float, default=DEFAULT_SEASONALITY,
+                        help='Strength of the yearly cycle, 0 to below 1.')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--force', action='store_true', help='Replace the file if it exists.')
+    args = parser.parse_args()
+
+    if not 0 <= args.seasonality < 1:
+        parser.error('--seasonality must be at least 0 and below 1')
+    if os.path.exists(args.path):
+        if not args.force:
+            parser.error(f'{args.path} exists; pass --force to replace it')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+
+    started = time.perf_counter()
+
+    def report(done, total):
+        elapsed = time.perf_counter() - started
+        print(f"{done:,}/{total:,} transactions ({done / elapsed:,.0f} rows/s)", flush=True)
+
+    generate_database(
+        args.path, args.agents, args.transactions, args.seed, args.start, args.end,
+        args.skew, args.seasonality, args.chunk_size, report
+    )
+    print(f"Wrote {args.path} in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
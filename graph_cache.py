@@ -0,0 +1,176 @@
+"""
+In-process caching for rendered leaderboard graphs.
+
+The disk cache in CACHE_DIR (see app.generate_graph) survives restarts and
+is shared between processes; MemoryGraphCache sits in front of it so hot
+graphs are served straight from memory. SingleFlight and acquire_lock_file
+make sure a graph missing from both is only rendered once, however many
+threads and processes ask for it at the same time.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryGraphCache:
+    """
+    Thread-safe LRU of rendered graphs, keyed like generate_cache_key.
+
+    Values are immutable bytes objects, so a hit can be handed to the
+    response as-is without copying. The cache is bounded by the total size
+    of the stored images ('max_bytes') and every entry expires 'ttl'
+    seconds after it was stored.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (data, expires_at)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the cached bytes for 'key', or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            data, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._discard(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        """Store 'data' (bytes) under 'key', evicting least recently used entries."""
+        data = bytes(data)
+        if len(data) > self.max_bytes:
+            return  # Would evict everything else and still not fit
+
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (data, time.monotonic() + self.ttl)
+            self._size += len(data)
+
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """Return the cache counters as a dict."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _discard(self, key):
+        # Caller must hold the lock
+        data, _ = self._entries.pop(key)
+        self._size -= len(data)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    function, callers arriving while it runs wait and get the same result
+    (or exception) instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> _Flight
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, function):
+        """Return function(), sharing the call with concurrent callers of 'key'."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def count_coalesced(self):
+        """Record a call that was coalesced elsewhere (e.g. with another process)."""
+        with self._lock:
+            self.coalesced += 1
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._flights), 'coalesced': self.coalesced}
+
+
+def acquire_lock_file(path, stale_after):
+    """
+    Atomically creates the lock file 'path'. Returns True if this call now
+    holds the lock (remove the file to release it), False if someone else
+    does. Lock files older than 'stale_after' seconds were left behind by a
+    crashed holder and are broken.
+    """
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(path).st_mtime <= stale_after:
+                    return False
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Released while we looked at it; try again
+            continue
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return True
+    return False
@@ -0,0 +1,283 @@
+"""
+Bulk transaction import.
+
+Reads transactions from a CSV or JSON file a record at a time, checks each
+one, resolves agent names to ids against one in-memory map of the agents
+table and inserts the good rows with executemany in large write
+transactions, keeping the leaderboard rollup and data version in step.
+The /admin/import endpoint and the `flask import-transactions` command in
+app.py are thin wrappers around import_transactions.
+
+Records have an 'agent' (name) or 'agent_id', a 'volume', an ISO 'date'
+(YYYY-MM-DD) and an 'address'. CSV files need a header row naming those
+columns; JSON files hold either an array of objects or one object per line
+(JSON Lines).
+"""
+import csv
+import datetime
+import json
+import math
+import os
+
+from database import apply_transactions_to_rollup, bump_data_version, insert_transactions_bulk
+
+IMPORT_FORMATS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'json', '.ndjson': 'json'}
+DEFAULT_BATCH_SIZE = 10000  # Rows per write transaction
+MAX_REPORTED_ERRORS = 20  # Rejected rows described in an ImportReport, the rest are only counted
+JSON_READ_SIZE = 64 * 1024
+MAX_JSON_RECORD_SIZE = 1024 * 1024  # Longest JSON value read_json_records will buffer
+
+
+def detect_format(filename):
+    """Returns 'csv' or 'json' from a file name's extension, or None."""
+    return IMPORT_FORMATS.get(os.path.splitext(filename or '')[1].lower())
+
+
+def read_csv_records(stream):
+    """
+    Yields (record number, dict) for every row of a CSV text stream, with
+    the header names lower-cased and stripped.
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    names = [name.strip().lower() for name in header]
+    for number, row in enumerate(reader, start=1):
+        if any(field.strip() for field in row):  # Skip blank lines
+            yield number, dict(zip(names, row))
+
+
+def read_json_records(stream, read_size=JSON_READ_SIZE):
+    """
+    Yields (record number, value) for every item of a top-level JSON array,
+    or every value of a JSON Lines stream, decoding as the text arrives
+    instead of loading the whole document. Raises ValueError on malformed
+    JSON.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    number = 0
+    opened = closed = False
+    eof = False
+    while True:
+        # Skip whitespace, the array's brackets and the commas between items
+        while position < len(buffer) and (buffer[position] in ' \t\r\n,' or
+                                          (buffer[position] == '[' and not opened and number == 0) or
+                                          (buffer[position] == ']' and opened)):
+            if buffer[position] == '[':
+                opened = True
+            elif buffer[position] == ']':
+                closed = True
+            position += 1
+        if position < len(buffer) and closed:
+            raise ValueError('Unexpected data after the end of the JSON array')
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                if buffer[position:].strip():
+                    raise ValueError(f'Malformed JSON in record {number + 1}') from None
+                if opened and not closed:
+                    raise ValueError('Unterminated JSON array') from None
+                return
+            # The value may just be cut off at the end of the buffer
+            if len(buffer) - position > MAX_JSON_RECORD_SIZE:
+                raise ValueError(f'Malformed JSON in record {number + 1}') from None
+            chunk = stream.read(read_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            eof = not chunk
+            continue
+        if end == len(buffer) and not eof:
+            # A number at the end of the buffer may continue in the next read
+            chunk = stream.read(read_size)
+            if chunk:
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            eof = True
+        number += 1
+        position = end
+        yield number, value
+
+
+def read_records(stream, fmt):
+    """Yields (record number, record) from a text stream in the given format."""
+    if fmt == 'csv':
+        return read_csv_records(stream)
+    if fmt == 'json':
+        return read_json_records(stream)
+    raise ValueError(f'Unsupported import format: {fmt}')
+
+
+def parse_volume(value):
+    """Parses a non-negative amount, allowing '$' and thousands separators."""
+    if isinstance(value, str):
+        value = value.strip().lstrip('$').replace(',', '')
+    if isinstance(value, bool) or value in (None, ''):
+        raise ValueError('missing volume')
+    try:
+        volume = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'volume {value!r} is not a number') from None
+    if not math.isfinite(volume) or volume < 0:
+        raise ValueError(f'volume {value!r} must be a non-negative amount')
+    return volume
+
+
+def parse_date(value):
+    """Parses a YYYY-MM-DD date, returning it in canonical ISO form."""
+    if not isinstance(value, str) or len(value.strip()) != 10:
+        raise ValueError(f'date {value!r} is not YYYY-MM-DD')
+    try:
+        return datetime.date.fromisoformat(value.strip()).isoformat()
+    except ValueError:
+        raise ValueError(f'date {value!r} is not a valid YYYY-MM-DD date') from None
+
+
+def parse_record(record, agents, agent_ids, create_agents=False):
+    """
+    Validates one record and returns (agent, volume, date, address), where
+    agent is an agent id, or a new agent's name when create_agents is set.
+    'agents' maps names to ids and 'agent_ids' is the set of ids. Raises
+    ValueError describing the first problem found.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('record is not an object')
+    name = record.get('agent', record.get('agent_name'))
+    agent_id = record.get('agent_id')
+    if isinstance(name, str) and name.strip():
+        name = name.strip()
+        agent = agents.get(name)
+        if agent is None:
+            if not create_agents:
+                raise ValueError(f'unknown agent {name!r}')
+            agent = name
+    elif agent_id not in (None, ''):
+        try:
+            agent = int(agent_id)
+        except (TypeError, ValueError):
+            raise ValueError(f'agent_id {agent_id!r} is not an integer') from None
+        if agent not in agent_ids:
+            raise ValueError(f'unknown agent_id {agent}')
+    else:
+        raise ValueError('missing agent')
+
+    address = record.get('address')
+    if not isinstance(address, str) or not address.strip():
+        raise ValueError('missing address')
+    return agent, parse_volume(record.get('volume')), parse_date(record.get('date')), address.strip()
+
+
+class ImportReport:
+    """
+    What an import did: rows imported and rejected, the first
+    MAX_REPORTED_ERRORS rejections as (record number, reason), agents
+    created and the 'YYYY-MM' months that received rows.
+    """
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+        self.created_agents = 0
+        self.months = set()
+        self.failed = None  # Why reading stopped early, if it did
+
+    def reject(self, number, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((number, reason))
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'errors': [{'record': number, 'error': reason} for number, reason in self.errors],
+            'created_agents': self.created_agents,
+            'months': sorted(self.months),
+            'failed': self.failed,
+        }
+
+
+def load_agents(cursor):
+    """Returns the whole agents table as a {name: id} dict."""
+    return {name: agent_id for agent_id, name in cursor.execute('SELECT id, name FROM agents')}
+
+
+def insert_batch(cursor, batch, agents, report):
+    """
+    Inserts one batch of parse_record results inside the caller's write
+    transaction, creating any new agents first, and updates the rollup and
+    data version to match.
+    """
+    new_names = sorted({agent for agent, _, _, _ in batch if isinstance(agent, str)} - agents.keys())
+    if new_names:
+        cursor.executemany('INSERT OR IGNORE INTO agents (name) VALUES (?)', [(name,) for name in new_names])
+        report.created_agents += cursor.rowcount
+        agents.update(load_agents(cursor))
+    rows = [
+        (agents[agent] if isinstance(agent, str) else agent, volume, date, address)
+        for agent, volume, date, address in batch
+    ]
+    insert_transactions_bulk(cursor, rows)
+    apply_transactions_to_rollup(cursor, ((agent_id, volume, date) for agent_id, volume, date, _ in rows))
+    bump_data_version(cursor)
+    report.imported += len(rows)
+    report.months.update(date[:7] for _, _, date, _ in rows)
+
+
+def import_transactions(write_transaction, records, batch_size=DEFAULT_BATCH_SIZE,
+                        create_agents=False, dry_run=False, progress=None):
+    """
+    Imports (record number, record) pairs from read_records and returns an
+    ImportReport. write_transaction() must return a context manager that
+    yields a cursor and commits on exit (app.write_transaction); each batch
+    of batch_size good rows is one transaction, so other writers get a turn
+    in between and a failure part way through keeps the batches already
+    committed. Bad records are skipped and reported; a file that cannot be
+    read any further stops the import, with the reason in report.failed,
+    after the rows before it are written. With dry_run nothing is written.
+    progress(report) is called after every batch.
+    """
+    report = ImportReport()
+    with write_transaction() as cursor:
+        agents = load_agents(cursor)
+    agent_ids = set(agents.values())
+
+    def flush(batch):
+        if dry_run:
+            report.imported += len(batch)
+            report.months.update(date[:7] for _, _, date, _ in batch)
+        else:
+            with write_transaction() as cursor:
+                insert_batch(cursor, batch, agents, report)
+            agent_ids.update(agents.values())
+        if progress is not None:
+            progress(report)
+
+    batch = []
+    number = 0
+    records = iter(records)
+    while True:
+        try:
+            number, record = next(records)
+        except StopIteration:
+            break
+        except (ValueError, csv.Error) as e:
+            # The file itself is broken here; keep what was read before it
+            report.failed = f'Stopped reading after record {number}: {e}'
+            break
+        try:
+            batch.append(parse_record(record, agents, agent_ids, create_agents))
+        except ValueError as e:
+            report.reject(number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return report
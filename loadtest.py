@@ -0,0 +1,550 @@
+"""
+Load-tests the leaderboard with the traffic of a fleet of wall screens.
+
+Starts the app under waitress on a copy of a database (or uses --url) and
+replays what production sees:
+
+- --screens wall screens, each behaving like layout.html: it loads the
+  dashboard, keeps an /events stream open and reloads whenever a change it
+  shows is announced, revalidating with If-None-Match so unchanged images
+  come back as 304s. A load is the four /graphs images fetched one after
+  another (--screen-mode dashboard fetches /dashboard.png instead, json
+  /dashboard.json). Screens the server refuses a stream (503) poll every
+  --interval seconds, like the page's fallback
+- --admins admin users, each adding a transaction through the /admin form
+  --admin-rate times a minute (at random, Poisson-distributed moments) and
+  following the redirect back to the admin page like a browser
+
+After --warmup seconds, which are not counted, it records every request for
+--duration seconds and reports throughput, p50/p95/p99 latency per route,
+304s, errors, 'database is locked' failures and the server's CPU use. The
+server is started with `flask serve`, so it has a thread per /events stream
+on top of --threads.
+
+    python loadtest.py --screens 40 --admins 2 --admin-rate 6 --duration 60
+    python loadtest.py --database benchmark_fixtures/100k-seed20240101-2026-11.db --threads 16
+"""
+import argparse
+import datetime
+import http.client
+import json
+import math
+import os
+import queue
+import random
+import re
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from generate_data import generate_database
+
+DEFAULT_SCREENS = 20
+DEFAULT_INTERVAL = 900.0  # Seconds between reloads of a screen without /events, as in layout.html
+SCREEN_START_SPREAD = 5.0  # Screens start within this many seconds, not in lockstep
+DEFAULT_SSE_RETRY = 5.0  # Seconds before reconnecting a closed stream, until the server sends 'retry:'
+DEFAULT_ADMINS = 1
+DEFAULT_ADMIN_RATE = 6.0  # Transactions added per admin per minute
+DEFAULT_DURATION = 60.0
+DEFAULT_WARMUP = 10.0
+DEFAULT_THREADS = 8  # waitress threads for requests other than /events
+DEFAULT_TRANSACTIONS = 100000  # Size of the generated database when --database is not given
+REQUEST_TIMEOUT = 5.0  # Seconds before a screen gives up on an image, as in layout.html
+SERVER_START_TIMEOUT = 120.0
+GRAPH_TYPES = ('monthly_volume', 'monthly_transactions', 'ytd_volume', 'ytd_transactions')
+LOCKED_MESSAGE = 'database is locked'
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Recorder:
+    """
+    Collects (route, seconds, outcome) samples from every client thread for
+    requests started inside the measured window.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+        self.window = (float('inf'), float('inf'))
+
+    def start_window(self, start, end):
+        self.window = (start, end)
+
+    def record(self, route, started, seconds, outcome):
+        start, end = self.window
+        if start <= started and started + seconds <= end:
+            with self.lock:
+                self.samples.append((route, seconds, outcome))
+
+
+class Client:
+    """One keep-alive HTTP connection, reopened after any failure."""
+
+    def __init__(self, url, recorder):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.recorder = recorder
+        self.conn = None
+
+    def request(self, route, method, path, body=None, headers=None):
+        """
+        Sends one request and records how it went; returns (response, body),
+        or (None, None) if it failed without a response.
+        """
+        started = time.monotonic()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            outcome = 'timeout' if isinstance(e, socket.timeout) else 'error'
+            self.recorder.record(route, started, time.monotonic() - started, outcome)
+            return None, None
+        seconds = time.monotonic() - started
+        if LOCKED_MESSAGE.encode() in data:
+            outcome = 'locked'
+        elif response.status == 304:
+            outcome = 'not_modified'
+        elif response.status >= 400:
+            outcome = 'error'
+        else:
+            outcome = 'ok'
+        self.recorder.record(route, started, seconds, outcome)
+        if response.will_close:
+            self.close()
+        return response, data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def screen_requests(mode, month):
+    """The (route, path) requests of one dashboard refresh."""
+    if mode == 'dashboard':
+        return [('GET /dashboard.png', f'/dashboard.png?month={month}')]
+    if mode == 'json':
+        return [('GET /dashboard.json', f'/dashboard.json?month={month}')]
+    return [(f'GET /graphs ({graph_type})', f'/graphs?graph={graph_type}&month={month}')
+            for graph_type in GRAPH_TYPES]
+
+
+def read_events(readline):
+    """
+    Parses a text/event-stream, yielding (event, data) for every dispatched
+    event and ('retry', milliseconds) for every retry field; returns when
+    readline() returns b''.
+    """
+    event, data = 'message', []
+    while True:
+        line = readline()
+        if not line:
+            return
+        line = line.decode('utf-8').rstrip('\r\n')
+        if not line:
+            if data:
+                yield event, '\n'.join(data)
+            event, data = 'message', []
+            continue
+        field, _, value = line.partition(':')
+        value = value[1:] if value.startswith(' ') else value
+        if field == 'event':
+            event = value
+        elif field == 'data':
+            data.append(value)
+        elif field == 'retry' and value.isdigit():
+            yield 'retry', value
+
+
+def dashboard_affected(months, month, today=None):
+    """Whether a change to 'months' (None meaning all) shows on a screen of 'month', as in layout.html."""
+    if months is None:
+        return True
+    year = str((today or datetime.date.today()).year)
+    return month in months or any(changed.startswith(year) for changed in months)
+
+
+class EventStream:
+    """
+    A screen's /events connection, read on a thread of its own. Every
+    announced change is put on 'changes' as its list of months (None meaning
+    all), followed by CLOSED when the stream ends.
+    """
+
+    CLOSED = object()
+
+    def __init__(self, url, recorder):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.recorder = recorder
+        self.retry = DEFAULT_SSE_RETRY
+        self.changes = queue.Queue()
+        self.sock = None
+
+    def open(self):
+        """
+        Connects and starts reading; returns the response status, or None
+        (with CLOSED queued) if the connection failed.
+        """
+        started = time.monotonic()
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        try:
+            conn.request('GET', '/events', headers={'Accept': 'text/event-stream'})
+            self.sock = conn.sock
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            outcome = 'timeout' if isinstance(e, socket.timeout) else 'error'
+            self.recorder.record('GET /events', started, time.monotonic() - started, outcome)
+            self.changes.put(self.CLOSED)
+            return None
+        self.recorder.record('GET /events', started, time.monotonic() - started,
+                             'ok' if response.status == 200 else 'error')
+        if response.status != 200:
+            response.read()
+            conn.close()
+            return response.status
+        self.sock.settimeout(None)  # Heartbeats keep it busy; close() ends it
+        threading.Thread(target=self._read, args=(conn, response), daemon=True).start()
+        return response.status
+
+    def _read(self, conn, response):
+        try:
+            for event, data in read_events(response.readline):
+                if event == 'retry':
+                    self.retry = int(data) / 1000
+                elif event == 'leaderboard':
+                    self.changes.put(json.loads(data)['months'])
+        except (OSError, http.client.HTTPException, ValueError):
+            pass
+        finally:
+            conn.close()
+            self.changes.put(self.CLOSED)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)  # Wakes up the reading thread
+            except OSError:
+                pass
+
+
+def run_screen(client, stream, requests, month, interval, deadline, rng):
+    """
+    One wall screen until 'deadline': loads the dashboard, then reloads it on
+    every announced change it shows (or every 'interval' seconds if the
+    server refused the stream), revalidating with the ETags it last got.
+    """
+    etags = {}
+
+    def load():
+        for route, path in requests:  # Sequential, like loadGraphsSequentially
+            headers = {'If-None-Match': etags[path]} if path in etags else {}
+            response, _ = client.request(route, 'GET', path, headers=headers)
+            if response is not None and response.getheader('ETag'):
+                etags[path] = response.getheader('ETag')
+
+    time.sleep(rng.uniform(0, SCREEN_START_SPREAD))
+    status = stream.open()
+    load()
+    next_poll = time.monotonic() + interval
+    while time.monotonic() < deadline:
+        if status not in (None, 200):
+            # Refused (503): EventSource gives up and the page polls instead
+            time.sleep(max(0.0, min(next_poll, deadline) - time.monotonic()))
+            if time.monotonic() < deadline:
+                load()
+            next_poll += interval
+            continue
+        try:
+            months = stream.changes.get(timeout=deadline - time.monotonic())
+        except queue.Empty:
+            break
+        if months is EventStream.CLOSED:
+            # Reconnect like EventSource, then reload in case a change was missed
+            time.sleep(max(0.0, min(stream.retry, deadline - time.monotonic())))
+            if time.monotonic() >= deadline:
+                break
+            status = stream.open()
+            next_poll = time.monotonic() + interval
+            load()
+        elif dashboard_affected(months, month):
+            load()
+    stream.close()
+    client.close()
+
+
+def run_admin(client, agent_ids, rate, deadline, rng):
+    """One admin user adding transactions at 'rate' per minute until 'deadline'."""
+    while True:
+        time.sleep(rng.expovariate(rate / 60.0))
+        if time.monotonic() >= deadline:
+            break
+        form = urllib.parse.urlencode({
+            'transaction_agent_id': rng.choice(agent_ids),
+            'transaction_volume': f'{rng.uniform(50000, 900000):.2f}',
+            'transaction_date': datetime.date.today().isoformat(),
+            'transaction_address': f'{rng.randint(1, 9999)} Load Test Way',
+            'add_transaction': '',
+        })
+        response, _ = client.request(
+            'POST /admin', 'POST', '/admin', form,
+            {'Content-Type': 'application/x-www-form-urlencoded'}
+        )
+        if response is not None and response.status in (302, 303):
+            client.request('GET /admin', 'GET', '/admin?message=Transaction+added+successfully%21&status=success')
+    client.close()
+
+
+def fetch_agent_ids(url):
+    """Reads the agent ids offered by the admin page's Add Transaction form."""
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    try:
+        conn.request('GET', '/admin')
+        page = conn.getresponse().read().decode('utf-8')
+    finally:
+        conn.close()
+    select = page.split('name="transaction_agent_id"', 1)[1].split('</select>', 1)[0]
+    return re.findall(r'<option value="(\d+)"', select)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_serving(url, process, timeout=SERVER_START_TIMEOUT):
+    parts = urllib.parse.urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            conn.request('GET', '/graphs/cache_stats')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not answer within {timeout:.0f}s")
+
+
+def process_cpu_seconds(pid):
+    """
+    User + system CPU seconds used so far by a process and its children (a
+    render process pool, for instance), or None where /proc is not available.
+    """
+    usage, parents = {}, {}
+    try:
+        entries = [entry for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return None
+    for entry in entries:
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue  # Exited meanwhile
+        parents[int(entry)] = int(fields[1])
+        usage[int(entry)] = int(fields[11]) + int(fields[12])
+    if pid not in usage:
+        return None
+    tree, ticks = {pid}, 0
+    for process in sorted(usage):  # Children have higher pids than their parents, mostly
+        if process == pid or parents[process] in tree:
+            tree.add(process)
+            ticks += usage[process]
+    return ticks / os.sysconf('SC_CLK_TCK')
+
+
+def start_server(workdir, database, threads, port):
+    """
+    Starts the app's waitress server (flask serve) on a copy of 'database'
+    in 'workdir', where the app also keeps its graph cache, and returns the
+    process.
+    """
+    shutil.copyfile(database, os.path.join(workdir, 'database.db'))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'serve', '--host=127.0.0.1', f'--port={port}',
+         f'--threads={threads}'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_values), math.ceil(fraction * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples, duration):
+    """Per-route and overall statistics for the recorded samples."""
+    routes = {}
+    for route, seconds, outcome in samples:
+        routes.setdefault(route, []).append((seconds, outcome))
+    routes['all'] = [(seconds, outcome) for _, seconds, outcome in samples]
+
+    summary = {}
+    for route, results in routes.items():
+        latencies = sorted(seconds for seconds, outcome in results if outcome in ('ok', 'not_modified'))
+        counts = {outcome: sum(1 for _, o in results if o == outcome)
+                  for outcome in ('ok', 'not_modified', 'error', 'locked', 'timeout')}
+        entry = dict(requests=len(results), throughput=len(results) / duration, **counts)
+        entry['error_rate'] = (len(results) - len(latencies)) / len(results) if results else 0.0
+        if latencies:
+            entry.update(
+                mean=statistics.fmean(latencies),
+                p50=percentile(latencies, 0.50),
+                p95=percentile(latencies, 0.95),
+                p99=percentile(latencies, 0.99),
+                max=latencies[-1],
+            )
+        summary[route] = entry
+    return summary
+
+
+def print_report(report, out=sys.stdout):
+    settings = report['settings']
+    print(f"\n{settings['screens']} screen(s) ({settings['screen_mode']}, "
+          f"on /events or every {settings['interval']:g}s), {settings['admins']} admin(s) at {settings['admin_rate']:g}/min, {report['duration']:.0f}s measured",
+          file=out)
+    print(f"\n  {'route':<36}{'reqs':>7}{'req/s':>8}{'304s':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'errors':>8}{'timeouts':>9}{'locked':>8}", file=out)
+    for route, entry in report['routes'].items():
+        ms = {key: f"{entry[key] * 1000:.1f}" if key in entry else '-' for key in ('p50', 'p95', 'p99')}
+        print(f"  {route:<36}{entry['requests']:>7}{entry['throughput']:>8.2f}{entry['not_modified']:>7}"
+              f"{ms['p50']:>9}{ms['p95']:>9}{ms['p99']:>9}{entry['error']:>8}{entry['timeout']:>9}"
+              f"{entry['locked']:>8}", file=out)
+    server = report['server']
+    if server.get('cpu_seconds') is not None:
+        print(f"\n  Server CPU: {server['cpu_seconds']:.1f}s ({server['cpu_percent']:.0f}% of one core, "
+              f"{os.cpu_count()} available)", file=out)
+    if server.get('locked_log_lines') is not None:
+        print(f"  '{LOCKED_MESSAGE}' in the server log: {server['locked_log_lines']}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help='Test an already running server instead of starting one.')
+    parser.add_argument('--database', help='Database to copy for the started server '
+                                           '(default: a generated one with --transactions rows).')
+    parser.add_argument('--transactions', type=int, default=DEFAULT_TRANSACTIONS)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help='waitress threads for requests other than /events.')
+    parser.add_argument('--screens', type=int, default=DEFAULT_SCREENS)
+    parser.add_argument('--screen-mode', choices=('graphs', 'dashboard', 'json'), default='graphs',
+                        help='What a screen refresh fetches: the four /graphs images, /dashboard.png '
+                             'or /dashboard.json.')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help='Seconds between reloads of a screen refused an /events stream.')
+    parser.add_argument('--admins', type=int, default=DEFAULT_ADMINS)
+    parser.add_argument('--admin-rate', type=float, default=DEFAULT_ADMIN_RATE,
+                        help='Transactions each admin adds per minute.')
+    parser.add_argument('--month', default=datetime.date.today().strftime('%Y-%m'))
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='Seconds measured.')
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP, help='Seconds run before measuring.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the report as JSON to this file.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='leaderboard-load-')
+    server = None
+    try:
+        if args.url:
+            url = args.url.rstrip('/')
+        else:
+            database = args.database
+            if database is None:
+                print(f"Generating a {args.transactions:,} transaction database ...", file=sys.stderr, flush=True)
+                database = generate_database(os.path.join(workdir, 'fixture.db'), transactions=args.transactions,
+                                             seed=args.seed)
+            port = free_port()
+            url = f'http://127.0.0.1:{port}'
+            server = start_server(workdir, database, args.threads, port)
+            wait_until_serving(url, server)
+        agent_ids = fetch_agent_ids(url) if args.admins else []
+
+        recorder = Recorder()
+        rng = random.Random(args.seed)
+        started = time.monotonic()
+        window_start = started + args.warmup
+        deadline = window_start + args.duration
+        recorder.start_window(window_start, deadline)
+        requests = screen_requests(args.screen_mode, args.month)
+        workers = [
+            threading.Thread(target=run_screen, daemon=True, args=(
+                Client(url, recorder), EventStream(url, recorder), requests, args.month, args.interval,
+                deadline, random.Random(rng.random())
+            ))
+            for _ in range(args.screens)
+        ]
+        if agent_ids and args.admin_rate > 0:
+            workers += [
+                threading.Thread(target=run_admin, daemon=True, args=(
+                    Client(url, recorder), agent_ids, args.admin_rate, deadline, random.Random(rng.random())
+                ))
+                for _ in range(args.admins)
+            ]
+        print(f"Running {len(workers)} client(s) against {url} ...", file=sys.stderr, flush=True)
+        for worker in workers:
+            worker.start()
+
+        time.sleep(max(0.0, window_start - time.monotonic()))
+        cpu_before = process_cpu_seconds(server.pid) if server else None
+        cpu_started = time.monotonic()
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()) + REQUEST_TIMEOUT * len(requests))
+        cpu_after = process_cpu_seconds(server.pid) if server else None
+        cpu_elapsed = time.monotonic() - cpu_started
+
+        report = {
+            'settings': {key: getattr(args, key) for key in (
+                'screens', 'screen_mode', 'interval', 'admins', 'admin_rate', 'threads', 'month', 'seed'
+            )},
+            'url': url,
+            'duration': args.duration,
+            'routes': summarize(recorder.samples, args.duration),
+            'server': {},
+        }
+        if cpu_before is not None and cpu_after is not None:
+            report['server']['cpu_seconds'] = cpu_after - cpu_before
+            report['server']['cpu_percent'] = 100 * (cpu_after - cpu_before) / cpu_elapsed
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if server is not None:
+        if 'cpu_seconds' not in report['server']:
+            # No /proc: fall back to the finished child's total, startup included
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            report['server']['cpu_seconds'] = children.ru_utime + children.ru_stime
+            report['server']['cpu_percent'] = 100 * report['server']['cpu_seconds'] / args.duration
+        with open(os.path.join(workdir, 'server.log'), errors='replace') as f:
+            report['server']['locked_log_lines'] = sum(LOCKED_MESSAGE in line for line in f)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Prometheus metrics for the leaderboard.
+
+Counters and histograms are sharded per thread: every thread updates a dict
+of its own without taking a lock, and Registry.render sums the shards of
+all threads when /metrics is scraped. A lock is only taken the first time a
+thread records anything, to register its shard. Values that are cheaper to
+read when scraped (cache directory size, row counts, ...) are passed to
+render as extra samples instead.
+
+Output follows the Prometheus text exposition format, version 0.0.4.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Local(threading.local):
+    shard = None  # A class default: reading it is cheaper than getattr() on a miss
+
+
+class Registry:
+    """The metrics of one process and the per-thread shards holding their values."""
+
+    def __init__(self):
+        self.metrics = []  # In registration (and output) order
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._local = _Local()
+
+    def shard(self):
+        """This thread's {(metric, label values): value} dict."""
+        shard = self._local.shard
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(self, name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self, name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self):
+        """Returns {metric: {label values: value}} summed over every thread's shard."""
+        with self._shards_lock:
+            shards = list(self._shards)
+        totals = {metric: {} for metric in self.metrics}
+        for shard in shards:
+            # Copying a dict is atomic under the GIL; the owning thread may be
+            # updating it meanwhile. Histogram lists are copied as read.
+            for (metric, labels), value in shard.copy().items():
+                values = totals[metric]
+                if isinstance(value, list):
+                    previous = values.get(labels)
+                    value = list(value) if previous is None else [a + b for a, b in zip(previous, value)]
+                else:
+                    value += values.get(labels, 0)
+                values[labels] = value
+        return totals
+
+    def render(self, extra=()):
+        """
+        Returns the exposition text of every metric, followed by 'extra':
+        (name, documentation, type, [(labels dict, value)]) tuples, e.g.
+        gauges read at scrape time.
+        """
+        lines = []
+        for metric, values in self.collect().items():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for labels in sorted(values):
+                lines.extend(metric.samples(labels, values[labels]))
+        for name, documentation, kind, samples in extra:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    """A monotonically increasing count, per combination of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labels, amount=1):
+        """Adds 'amount' to the count for these label values (in labelnames order)."""
+        shard = self.registry.shard()
+        key = (self, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def samples(self, labels, value):
+        return [f'{self.name}{format_labels(zip(self.labelnames, labels))} {format_value(value)}']
+
+
+class Histogram:
+    """
+    Observed values (durations, in seconds) counted into cumulative buckets,
+    per combination of label values.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        shard = self.registry.shard()
+        key = (self, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One count per bucket, then +Inf, then the sum of the values
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *labels):
+        """Context manager observing the time its block takes."""
+        return _Timer(self, labels)
+
+    def samples(self, labels, counts):
+        pairs = list(zip(self.labelnames, labels))
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else format_value(bound)
+            lines.append(f'{self.name}_bucket{format_labels(pairs + [("le", le)])} {cumulative}')
+        lines.append(f'{self.name}_sum{format_labels(pairs)} {format_value(counts[-1])}')
+        lines.append(f'{self.name}_count{format_labels(pairs)} {cumulative}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(pairs):
+    """Formats (name, value) pairs as '{name="value",...}', or '' for none."""
+    if isinstance(pairs, dict):
+        pairs = pairs.items()
+    text = ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs)
+    return f'{{{text}}}' if text else ''
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
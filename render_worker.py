@@ -0,0 +1,27 @@
+"""
+Worker processes of the render pool (see app.get_render_pool).
+
+Workers are spawned: each starts from a fresh interpreter and imports this
+module and renderers, which is all the pickled render calls need. Nothing
+here imports app. Python does re-import the parent's main script in every
+spawned process (as __mp_main__), so modules a server script imports at the
+top must not do any work at import time; app sets its database up on first
+use for that reason.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def initialize():
+    """Runs once in every worker: loads matplotlib and the renderers up front."""
+    import renderers  # noqa: F401
+
+
+def create_pool(processes, max_tasks_per_child):
+    """Returns a spawn-based pool of 'processes' render workers."""
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=initialize,
+        max_tasks_per_child=max_tasks_per_child,
+    )
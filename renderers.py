@@ -0,0 +1,221 @@
+"""
+Graph renderers for the leaderboard.
+
+Every renderer takes the leaderboard dict built by app.fetch_leaderboard
+(graph_type, title, xlabel, values_step and the (agent, value) rows sorted
+best first) and returns the encoded image as bytes. RENDERERS maps the
+format names accepted by /graphs?format= to (render function, content type).
+"""
+import io
+import threading
+from xml.sax.saxutils import escape, quoteattr
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from timing import phase
+
+VOLUME_GRAPHS = ("monthly_volume", "ytd_volume")
+
+
+def chart_series(leaderboard):
+    """
+    Returns (agents, values, colors) for a leaderboard, handling the no data
+    scenario and highlighting the top three performers.
+    """
+    data = leaderboard['rows']
+    agents = [row[0] for row in data] or ["No Data"]
+    values = [row[1] if row[1] is not None else 0 for row in data] or [0]
+    colors = [
+        'green' if i == 0 else 'gold' if i == 1 else 'silver' if i == 2 else 'skyblue'
+        for i in range(len(values))
+    ]
+    return agents, values, colors
+
+
+def x_ticks(leaderboard, values):
+    """
+    Returns the x-axis tick positions and labels, stepping by the graph's
+    values_step up to the maximum value.
+    """
+    values_step = leaderboard['values_step']
+    max_value = max(values) if values else values_step
+    positions = list(range(0, int(max_value) + values_step, values_step))
+    labels = [
+        f'{x // 1000000}M' if leaderboard['graph_type'] == "ytd_volume" else f'{x:,}'
+        for x in positions
+    ]
+    return positions, labels
+
+
+def value_label(leaderboard, value):
+    """Formats the label drawn at the end of a bar."""
+    if leaderboard['graph_type'] in VOLUME_GRAPHS:
+        return f'${value:,.2f}'
+    return f'{int(value)}'
+
+
+# Reusable figures, one per thread and grid shape. pyplot's global state
+# machine is not thread-safe, so the PNG paths only use the object-oriented API.
+_figures = threading.local()
+
+
+def pooled_axes(nrows=1, ncols=1):
+    """
+    Returns this thread's (figure, axes list) for an nrows x ncols grid of
+    10x6 inch plots, cleared and ready to draw on.
+    """
+    pool = getattr(_figures, 'pool', None)
+    if pool is None:
+        pool = _figures.pool = {}
+    axes = pool.get((nrows, ncols))
+    if axes is None:
+        figure = Figure(figsize=(10 * ncols, 6 * nrows))
+        FigureCanvasAgg(figure)
+        axes = pool[(nrows, ncols)] = list(figure.subplots(nrows, ncols, squeeze=False).flat)
+    else:
+        for ax in axes:
+            ax.clear()
+    return axes[0].figure, axes
+
+
+def draw_leaderboard(axes, leaderboard):
+    """Draws the leaderboard's horizontal bar chart on a matplotlib Axes."""
+    agents, values, colors = chart_series(leaderboard)
+    bars = axes.barh(agents, values, color=colors)
+
+    # Add labels and titles
+    axes.set_xlabel(leaderboard['xlabel'])
+    axes.set_ylabel("Agents")
+    axes.set_title(leaderboard['title'])
+
+    # Adjust x-axis ticks based on the maximum value
+    axes.set_xticks(*x_ticks(leaderboard, values))
+
+    # Add value labels to bars, skipping zero values
+    for bar in bars:
+        if bar.get_width() > 0:  # Only label non-zero values
+            axes.text(
+                bar.get_width(),
+                bar.get_y() + bar.get_height() / 2,
+                value_label(leaderboard, bar.get_width()),
+                va='center'
+            )
+
+    # Reverse the y-axis to show top performers at the top
+    axes.invert_yaxis()
+
+
+def print_png(figure):
+    """Encodes a figure straight from its Agg canvas into PNG bytes."""
+    with phase('savefig'):
+        figure.tight_layout()
+        buf = io.BytesIO()
+        figure.canvas.print_png(buf)
+    return buf.getvalue()
+
+
+def render_png(leaderboard):
+    """Renders the leaderboard as a PNG with matplotlib."""
+    with phase('draw'):
+        figure, (axes,) = pooled_axes()
+        draw_leaderboard(axes, leaderboard)
+    return print_png(figure)
+
+
+def render_dashboard_png(leaderboards):
+    """
+    Renders up to four leaderboards as one PNG, as a 2x2 grid filled row by
+    row (the dashboard layout: monthly on top, YTD below).
+    """
+    with phase('draw'):
+        figure, axes = pooled_axes(2, 2)
+        for ax, leaderboard in zip(axes, leaderboards):
+            draw_leaderboard(ax, leaderboard)
+    return print_png(figure)
+
+
+# SVG canvas, matching the 10x6 inch / 100 dpi matplotlib figure
+SVG_WIDTH = 1000
+SVG_HEIGHT = 600
+SVG_FONT_SIZE = 12
+SVG_CHAR_WIDTH = 7  # Rough average glyph width at SVG_FONT_SIZE
+
+
+def render_svg(leaderboard):
+    """
+    Renders the same horizontal bar chart as render_png as a standalone SVG
+    document, using plain string formatting instead of matplotlib.
+    """
+    agents, values, colors = chart_series(leaderboard)
+    tick_positions, tick_labels = x_ticks(leaderboard, values)
+
+    # Plot area: leave room for the title, agent names, ticks and axis labels
+    label_width = max(len(agent) for agent in agents) * SVG_CHAR_WIDTH
+    left = 50 + label_width
+    right = SVG_WIDTH - 20
+    top = 40
+    bottom = SVG_HEIGHT - 60
+    plot_width = right - left
+    plot_height = bottom - top
+
+    # Like matplotlib, pad the data by 5% and always include every tick
+    x_max = max(max(values) * 1.05, tick_positions[-1], 1)
+
+    def x(value):
+        return left + plot_width * value / x_max
+
+    band = plot_height / len(values)
+    bar_height = band * 0.8
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_WIDTH}" height="{SVG_HEIGHT}" '
+        f'viewBox="0 0 {SVG_WIDTH} {SVG_HEIGHT}" font-family="DejaVu Sans, Arial, sans-serif" '
+        f'font-size="{SVG_FONT_SIZE}">',
+        f'<rect width="{SVG_WIDTH}" height="{SVG_HEIGHT}" fill="white"/>',
+        f'<text x="{(left + right) / 2:.1f}" y="{top - 14}" text-anchor="middle" '
+        f'font-size="14">{escape(leaderboard["title"])}</text>',
+    ]
+
+    # X-axis ticks and labels
+    for position, label in zip(tick_positions, tick_labels):
+        tick_x = x(position)
+        parts.append(
+            f'<line x1="{tick_x:.1f}" y1="{bottom}" x2="{tick_x:.1f}" y2="{bottom + 4}" stroke="black"/>'
+            f'<text x="{tick_x:.1f}" y="{bottom + 17}" text-anchor="middle">{escape(label)}</text>'
+        )
+
+    # Bars, top performer first (inverted y-axis), with agent and value labels
+    for index, (agent, value, color) in enumerate(zip(agents, values, colors)):
+        center = top + band * (index + 0.5)
+        width = x(value) - left
+        parts.append(
+            f'<rect x="{left}" y="{center - bar_height / 2:.1f}" width="{width:.1f}" '
+            f'height="{bar_height:.1f}" fill={quoteattr(color)}/>'
+            f'<text x="{left - 6}" y="{center:.1f}" text-anchor="end" '
+            f'dominant-baseline="middle">{escape(agent)}</text>'
+        )
+        if value > 0:  # Only label non-zero values
+            parts.append(
+                f'<text x="{left + width:.1f}" y="{center:.1f}" dominant-baseline="middle">'
+                f'{escape(value_label(leaderboard, value))}</text>'
+            )
+
+    # Axes frame and axis labels
+    parts.append(
+        f'<rect x="{left}" y="{top}" width="{plot_width}" height="{plot_height}" '
+        f'fill="none" stroke="black"/>'
+        f'<text x="{(left + right) / 2:.1f}" y="{SVG_HEIGHT - 20}" text-anchor="middle">'
+        f'{escape(leaderboard["xlabel"])}</text>'
+        f'<text x="16" y="{(top + bottom) / 2:.1f}" text-anchor="middle" '
+        f'transform="rotate(-90 16 {(top + bottom) / 2:.1f})">Agents</text>'
+        '</svg>'
+    )
+    return ''.join(parts).encode('utf-8')
+
+
+# Format name -> (render function, content type)
+RENDERERS = {
+    'png': (render_png, 'image/png'),
+    'svg': (render_svg, 'image/svg+xml'),
+}
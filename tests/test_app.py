@@ -81,3 +81,35 @@ class BaseTestCase(unittest.TestCase):
             print(transaction)
 
         conn.close()
+
+
+class IsolatedAppTestCase(unittest.TestCase):
+    """
+    Points the app module itself at a throwaway database and cache directory,
+    so route tests do not touch database.db or cache/.
+    """
+    def setUp(self):
+        import tempfile
+        import app as app_module
+
+        self.app_module = app_module
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self._saved_paths = (app_module.DB_PATH, app_module.CACHE_DIR)
+        app_module.DB_PATH = os.path.join(self.tmpdir.name, 'database.db')
+        app_module.CACHE_DIR = os.path.join(self.tmpdir.name, 'cache')
+        os.makedirs(app_module.CACHE_DIR)
+        app_module.initialize_database()
+        app_module.graph_memory_cache.clear()
+
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+
+    def tearDown(self):
+        self.app_module.db_readers.close()
+        self.app_module.db_writer.close()
+        self.app_module.DB_PATH, self.app_module.CACHE_DIR = self._saved_paths
+        self.tmpdir.cleanup()
+
+    def get_test_database_connection(self):
+        """Get a connection to the isolated database."""
+        return sqlite3.connect(self.app_module.DB_PATH)
@@ -0,0 +1,26 @@
+import unittest
+
+from benchmark import compare, parse_size, summarize
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual([parse_size(label) for label in ('1k', '100K', '1m', '2.5m', '300')],
+                         [1000, 100000, 1000000, 2500000, 300])
+
+    def test_compare_flags_only_real_slowdowns(self):
+        baseline = {'results': {'1k': {
+            'sql.a': summarize(0.010, [0.002, 0.002]),
+            'sql.b': summarize(0.0001, [0.0001]),
+            'sql.gone': summarize(1, [1]),
+        }}}
+        current = {'results': {'1k': {
+            'sql.a': summarize(0.011, [0.004, 0.004]),  # Warm run twice as slow
+            'sql.b': summarize(0.0003, [0.0003]),  # 3x, but below the noise floor
+            'sql.new': summarize(1, [1]),
+        }}}
+        rows, regressions = compare(current, baseline, tolerance=0.25, noise_floor=0.0005)
+        self.assertEqual([(row[1], row[2]) for row in rows],
+                         [('sql.a', 'cold'), ('sql.a', 'warm'), ('sql.b', 'cold'), ('sql.b', 'warm')])
+        self.assertEqual([(row[1], row[2]) for row in regressions], [('sql.a', 'warm')])
+        self.assertAlmostEqual(regressions[0][5], 2.0)
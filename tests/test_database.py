@@ -1,5 +1,6 @@
-from tests.test_app import BaseTestCase
+from tests.test_app import BaseTestCase, IsolatedAppTestCase
 import sqlite3
+import threading
 
 class TestDatabase(BaseTestCase):
     def test_add_agent(self):
@@ -41,3 +42,78 @@ class TestDatabase(BaseTestCase):
         self.assertIsNotNone(transaction, "Failed to add transaction to the database.")
         self.assertEqual(transaction[1], agent_id, "Agent ID mismatch in the transaction.")
         self.assertAlmostEqual(transaction[2], 1000.50, places=2, msg="Transaction volume mismatch.")
+
+
+class TestConnections(IsolatedAppTestCase):
+    def test_read_connection_is_reused_per_thread(self):
+        """Each thread keeps one read-only WAL connection, shared by its requests."""
+        conn = self.app_module.get_db()
+        self.app.get('/api/leaderboard?month=2024-12')
+        self.assertIs(self.app_module.get_db(), conn)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+        self.assertEqual(conn.execute('PRAGMA query_only').fetchone()[0], 1)
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO agents (name) VALUES ('Nope')")
+
+        other = []
+        readers = self.app_module.db_readers
+        thread = threading.Thread(target=lambda: other.append(readers.get(self.app_module.DB_PATH)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+    def test_reads_are_not_blocked_by_a_long_write(self):
+        """Dashboards keep answering from the last commit while a write is open."""
+        before = self.app.get('/api/leaderboard?month=2024-12').get_json()
+        writing = threading.Event()
+        finish = threading.Event()
+
+        def long_admin_write():
+            with self.app_module.write_transaction() as cursor:
+                cursor.execute("INSERT INTO agents (name) VALUES ('Dana')")
+                writing.set()
+                finish.wait(5)
+
+        writer = threading.Thread(target=long_admin_write)
+        writer.start()
+        writing.wait(5)
+        try:
+            during = self.app.get('/api/leaderboard?month=2024-12')
+            self.assertEqual(during.status_code, 200)
+            self.assertEqual(during.get_json(), before)
+        finally:
+            finish.set()
+            writer.join()
+        names = [leader['agent'] for leader in self.app.get('/api/leaderboard').get_json()['leaders']]
+        self.assertIn('Dana', names)
+
+    def test_failed_write_is_rolled_back(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.app_module.write_transaction() as cursor:
+                cursor.execute("INSERT INTO agents (name) VALUES ('Eve')")
+                cursor.execute("INSERT INTO agents (name) VALUES ('Eve')")
+        self.assertIsNone(
+            self.app_module.get_db().execute("SELECT 1 FROM agents WHERE name = 'Eve'").fetchone()
+        )
+
+    def test_writer_counts_queued_writes(self):
+        writer = self.app_module.db_writer
+        waits, wait_seconds = writer.waits, writer.wait_seconds
+        holding = threading.Event()
+        release = threading.Event()
+
+        def hold_writer():
+            with self.app_module.write_transaction():
+                holding.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold_writer)
+        thread.start()
+        holding.wait(5)
+        threading.Timer(0.05, release.set).start()
+        with self.app_module.write_transaction() as cursor:
+            cursor.execute("INSERT INTO agents (name) VALUES ('Queued')")
+        thread.join()
+        self.assertEqual(writer.waits, waits + 1)
+        self.assertGreater(writer.wait_seconds, wait_seconds)
@@ -0,0 +1,116 @@
+import http.client
+import json
+import threading
+import unittest
+from unittest import mock
+
+from waitress import wasyncore
+
+from tests.test_app import IsolatedAppTestCase
+from events import ChangeNotifier
+
+
+class TestChangeNotifier(unittest.TestCase):
+    def test_merges_months_since_last_seen(self):
+        notifier = ChangeNotifier()
+        notifier.notify({'2024-11'})
+        notifier.notify({'2024-12'})
+        self.assertEqual(notifier.wait(0, timeout=0), (2, True, {'2024-11', '2024-12'}))
+        self.assertEqual(notifier.wait(2, timeout=0), (2, False, set()))
+
+    def test_global_change_and_lost_history(self):
+        notifier = ChangeNotifier(history=2)
+        notifier.notify({'2024-12'})
+        notifier.notify()
+        self.assertIsNone(notifier.wait(0, timeout=0)[2])
+
+        for month in ('2024-01', '2024-02', '2024-03'):
+            notifier.notify({month})
+        # Only the last two changes are remembered, so a listener at 2 lost one
+        self.assertIsNone(notifier.wait(2, timeout=0)[2])
+        self.assertEqual(notifier.wait(3, timeout=0)[2], {'2024-02', '2024-03'})
+
+
+class TestEventStream(IsolatedAppTestCase):
+    def test_stream_announces_changed_months(self):
+        """/events emits an event naming the month an admin write touched."""
+        with mock.patch.object(self.app_module, 'SSE_HEARTBEAT_INTERVAL', 0):
+            response = self.app.get('/events', buffered=False)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            stream = iter(response.response)
+            self.assertTrue(next(stream).startswith(b'retry:'))
+
+            # Nothing changed yet: only a keep-alive comment
+            self.assertEqual(next(stream), b': keep-alive\n\n')
+
+            self.app.post('/admin', data={
+                'transaction_agent_id': 1,
+                'transaction_volume': 10.0,
+                'transaction_date': '2024-12-05',
+                'transaction_address': '1 Main St',
+                'add_transaction': 'true'
+            })
+            event = next(stream).decode()
+            response.close()
+
+        self.assertTrue(event.startswith('event: leaderboard\n'))
+        payload = json.loads(event.split('data: ', 1)[1])
+        self.assertEqual(payload['months'], ['2024-12'])
+
+    def test_out_of_process_writes_refresh_everything(self):
+        """A version bump without a notification means all graphs changed."""
+        with mock.patch.object(self.app_module, 'SSE_HEARTBEAT_INTERVAL', 0):
+            response = self.app.get('/events', buffered=False)
+            stream = iter(response.response)
+            next(stream)
+            with self.get_test_database_connection() as conn:
+                conn.execute('UPDATE data_version SET version = version + 1')
+            event = next(stream).decode()
+            response.close()
+        self.assertIsNone(json.loads(event.split('data: ', 1)[1])['months'])
+
+    def test_streams_over_the_cap_are_refused(self):
+        """Above SSE_MAX_STREAMS /events answers 503 so the page polls instead."""
+        with mock.patch.object(self.app_module, 'SSE_MAX_STREAMS', 1):
+            first = self.app.get('/events', buffered=False)
+            refused = self.app.get('/events', buffered=False)
+            self.assertEqual(refused.status_code, 503)
+            self.assertIn('Retry-After', refused.headers)
+
+            first.close()  # Frees its slot
+            second = self.app.get('/events', buffered=False)
+            self.assertEqual(second.status_code, 200)
+            second.close()
+        self.assertEqual(self.app_module._sse_streams, 0)
+
+    def test_other_routes_respond_while_streams_are_open(self):
+        """Open streams cannot take every server thread."""
+        with mock.patch.object(self.app_module, 'SSE_MAX_STREAMS', 2), \
+                mock.patch.object(self.app_module, 'SERVER_REQUEST_THREADS', 1), \
+                mock.patch.object(self.app_module, 'SSE_HEARTBEAT_INTERVAL', 0.1):
+            server = self.app_module.create_server('127.0.0.1', 0)
+            thread = threading.Thread(target=server.run, daemon=True)
+            thread.start()
+            connections = []
+
+            def get(path):
+                conn = http.client.HTTPConnection('127.0.0.1', server.effective_port, timeout=5)
+                connections.append(conn)
+                conn.request('GET', path)
+                return conn.getresponse()
+
+            try:
+                for _ in range(2):
+                    stream = get('/events')
+                    self.assertEqual(stream.status, 200)
+                    stream.readline()  # retry: ...
+                self.assertEqual(get('/events').status, 503)
+                self.assertEqual(get('/dashboard.json?month=2024-12').status, 200)
+            finally:
+                for conn in connections:
+                    conn.close()
+                # Close every socket from the server's own loop thread, which
+                # then finds nothing left to serve and returns
+                server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+                thread.join(5)
+                server.task_dispatcher.shutdown()
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from database import SCHEMA_MIGRATIONS, search_transactions
+from generate_data import generate_database
+
+
+class TestGenerateData(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def generate(self, name, seed=1, **options):
+        path = os.path.join(self.tmpdir.name, name)
+        options = dict(dict(agents=20, transactions=5000, start='2024-01-01', end='2026-01-01',
+                            chunk_size=1200), **options)
+        return sqlite3.connect(generate_database(path, seed=seed, **options))
+
+    def test_database_is_complete(self):
+        conn = self.generate('a.db')
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM agents').fetchone()[0], 20)
+        count, first, last = conn.execute('SELECT COUNT(*), MIN(date), MAX(date) FROM transactions').fetchone()
+        self.assertEqual(count, 5000)
+        self.assertGreaterEqual(first, '2024-01-01')
+        self.assertLess(last, '2026-01-01')
+
+        # Ready for the app: migrated, indexed for search, rollup built, WAL
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], len(SCHEMA_MIGRATIONS))
+        self.assertEqual(conn.execute('SELECT SUM(transaction_count) FROM agent_month_totals').fetchone()[0], 5000)
+        self.assertTrue(search_transactions(conn.cursor(), 'main'))
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+        # Rows are written in date order, like a real history
+        dates = [row[0] for row in conn.execute('SELECT date FROM transactions ORDER BY id')]
+        self.assertEqual(dates, sorted(dates))
+
+    def test_same_seed_same_data(self):
+        query = 'SELECT t.id, a.name, t.volume, t.date, t.address FROM transactions t JOIN agents a ON a.id = t.agent_id'
+        first = self.generate('a.db').execute(query).fetchall()
+        self.assertEqual(self.generate('c.db').execute(query).fetchall(), first)
+        self.assertNotEqual(self.generate('d.db', seed=2).execute(query).fetchall(), first)
+
+    def test_skew_and_seasonality(self):
+        conn = self.generate('a.db', transactions=20000, skew=1.5, seasonality=0.5)
+        shares = [row[0] for row in conn.execute(
+            'SELECT COUNT(*) AS n FROM transactions GROUP BY agent_id ORDER BY n DESC'
+        )]
+        self.assertGreater(shares[0], 5 * shares[len(shares) // 2])
+        months = dict(conn.execute("SELECT substr(date, 6, 2), COUNT(*) FROM transactions GROUP BY 1"))
+        self.assertGreater(months['06'], 2 * months['12'])
+
+    def test_existing_file_is_left_alone(self):
+        path = os.path.join(self.tmpdir.name, 'live.db')
+        with open(path, 'w') as f:
+            f.write('keep me')
+        with self.assertRaises(FileExistsError):
+            generate_database(path, transactions=10)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'keep me')
@@ -0,0 +1,369 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tests.test_app import IsolatedAppTestCase
+from database import get_data_version
+from graph_cache import MemoryGraphCache, SingleFlight, acquire_lock_file
+
+
+class TestGraphCache(IsolatedAppTestCase):
+    def data_version(self):
+        with self.get_test_database_connection() as conn:
+            return get_data_version(conn.cursor())[0]
+
+    def cached_files(self):
+        return sorted(os.listdir(self.app_module.CACHE_DIR))
+
+    def test_cache_survives_until_data_changes(self):
+        """A cached graph is reused until a write bumps the data version."""
+        first = self.app.get('/graphs?graph=monthly_volume&month=2024-12')
+        files = self.cached_files()
+        self.assertEqual(len(files), 1)
+
+        # Age the cached file well past the old 5 second TTL
+        path = os.path.join(self.app_module.CACHE_DIR, files[0])
+        os.utime(path, (0, 0))
+        second = self.app.get('/graphs?graph=monthly_volume&month=2024-12')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(self.cached_files(), files)
+
+        version = self.data_version()
+        self.app.post('/admin', data={'agent_name': 'Dana', 'add_agent': 'true'})
+        self.assertEqual(self.data_version(), version + 1)
+
+        self.app.get('/graphs?graph=monthly_volume&month=2024-12')
+        self.assertEqual(len(self.cached_files()), 2)
+
+    def test_rename_bumps_data_version(self):
+        """Renaming an agent invalidates cached graphs."""
+        version = self.data_version()
+        self.app.post('/change_agent_name', data={'agent_id': 1, 'new_name': 'Alicia'})
+        self.assertEqual(self.data_version(), version + 1)
+
+    def test_removing_a_missing_transaction_changes_nothing(self):
+        version = self.data_version()
+        sequence = self.app_module.leaderboard_changes.sequence
+        response = self.app.post('/admin', data={'transaction_id': 999999, 'remove_transaction': 'true'},
+                                 follow_redirects=True)
+        self.assertIn(b'Transaction not found.', response.data)
+        self.assertEqual(self.data_version(), version)
+        self.assertEqual(self.app_module.leaderboard_changes.sequence, sequence)
+
+    def test_memory_cache_serves_without_disk(self):
+        """Hot graphs come from the in-process cache, not CACHE_DIR."""
+        first = self.app.get('/graphs?graph=ytd_volume&month=2024-12')
+        for name in self.cached_files():
+            os.remove(os.path.join(self.app_module.CACHE_DIR, name))
+
+        hits = self.app_module.graph_memory_cache.hits
+        second = self.app.get('/graphs?graph=ytd_volume&month=2024-12')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(self.cached_files(), [])
+        self.assertEqual(self.app_module.graph_memory_cache.hits, hits + 1)
+
+        stats = self.app.get('/graphs/cache_stats').get_json()
+        self.assertGreaterEqual(stats['hits'], 1)
+
+
+class TestMemoryGraphCache(unittest.TestCase):
+    def test_byte_budget_evicts_least_recently_used(self):
+        cache = MemoryGraphCache(max_bytes=10, ttl=60)
+        cache.put('a', b'1234')
+        cache.put('b', b'5678')
+        cache.get('a')  # 'b' is now the least recently used
+        cache.put('c', b'9012')
+
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), b'9012')
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['bytes'], 8)
+
+    def test_entries_expire(self):
+        cache = MemoryGraphCache(max_bytes=100, ttl=60)
+        cache.put('a', b'1234')
+        with mock.patch('graph_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def render():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return b'png'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do('key', render)))
+        leader.start()
+        started.wait(5)
+        followers = [
+            threading.Thread(target=lambda: results.append(flights.do('key', render)))
+            for _ in range(3)
+        ]
+        for thread in followers:
+            thread.start()
+        while flights.stats()['coalesced'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [b'png'] * 4)
+        self.assertEqual(flights.stats(), {'in_flight': 0, 'coalesced': 3})
+
+    def test_errors_are_shared_and_not_cached(self):
+        flights = SingleFlight()
+        with self.assertRaises(ValueError):
+            flights.do('key', mock.Mock(side_effect=ValueError))
+        self.assertEqual(flights.do('key', lambda: 42), 42)
+
+    def test_stale_lock_file_is_broken(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'graph.lock')
+            self.assertTrue(acquire_lock_file(path, stale_after=60))
+            self.assertFalse(acquire_lock_file(path, stale_after=60))
+            os.utime(path, (0, 0))
+            self.assertTrue(acquire_lock_file(path, stale_after=60))
+
+
+class TestRenderers(unittest.TestCase):
+    leaderboard = {
+        'graph_type': 'monthly_volume',
+        'title': 'Monthly Volume - December',
+        'xlabel': 'Volume ($)',
+        'values_step': 200000,
+        'rows': [('Bob', 450000.0), ('Alice <A&B>', 125000.5), ('Charlie', None), ('Dana', 0)],
+    }
+
+    def test_svg_matches_chart(self):
+        """The SVG backend draws the same colours, labels and ordering."""
+        import xml.etree.ElementTree as ElementTree
+        from renderers import render_svg
+
+        svg = render_svg(self.leaderboard)
+        root = ElementTree.fromstring(svg)  # Well-formed, names are escaped
+        ns = '{http://www.w3.org/2000/svg}'
+        fills = [rect.get('fill') for rect in root.iter(f'{ns}rect')][1:-1]
+        self.assertEqual(fills, ['green', 'gold', 'silver', 'skyblue'])
+        texts = [text.text for text in root.iter(f'{ns}text')]
+        self.assertIn('$450,000.00', texts)
+        self.assertIn('Alice <A&B>', texts)
+        self.assertNotIn('$0.00', texts)  # Zero values are not labelled
+
+        bob_y = next(float(t.get('y')) for t in root.iter(f'{ns}text') if t.text == 'Bob')
+        dana_y = next(float(t.get('y')) for t in root.iter(f'{ns}text') if t.text == 'Dana')
+        self.assertLess(bob_y, dana_y)  # Top performer first
+
+    def test_png_renderer(self):
+        from renderers import render_png
+        self.assertTrue(render_png(self.leaderboard).startswith(b'\x89PNG'))
+
+    def test_png_renderer_is_thread_safe(self):
+        """Concurrent renders on pooled per-thread figures match a serial render."""
+        from concurrent.futures import ThreadPoolExecutor
+        from renderers import render_png
+
+        other = dict(self.leaderboard, title='Other', rows=[('Eve', 10.0)])
+        expected = {self.leaderboard['title']: render_png(self.leaderboard),
+                    other['title']: render_png(other)}
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            boards = [self.leaderboard, other] * 4
+            for board, image in zip(boards, pool.map(render_png, boards)):
+                self.assertEqual(image, expected[board['title']])
+
+
+class TestPrerenderWorker(IsolatedAppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app_module.latest_graph_keys.clear()
+        self.app_module.recent_graphs.clear()
+        self.app_module.prerendered_version = None
+        self.app_module.announced_version = None
+        self.addCleanup(self.forget_queued_targets)
+
+    def forget_queued_targets(self):
+        while not self.app_module._prerender_queue.empty():
+            self.app_module._prerender_queue.get()
+        self.app_module._prerender_pending.clear()
+
+    def run_worker_once(self):
+        """Drive the worker loop body on this thread until its queue is empty."""
+        app_module = self.app_module
+        version, _ = app_module.current_data_version()
+        while not app_module._prerender_queue.empty():
+            target = app_module._prerender_queue.get()
+            if target is not None:
+                app_module._prerender(target, version)
+        for target in app_module.prerender_targets():
+            app_module._prerender(target, version)
+        app_module.mark_prerendered(version)
+
+    def test_stale_rendition_served_until_the_change_is_announced(self):
+        """With the worker running, the previous graph is served until /events announces the write."""
+        url = '/graphs?graph=monthly_volume&month=2024-12'
+        first = self.app.get(url)
+
+        self.app.post('/admin', data={'agent_name': 'Dana', 'add_agent': 'true'})
+        with mock.patch.object(self.app_module, 'prerender_worker_running', return_value=True), \
+                mock.patch.object(self.app_module, 'PRERENDER_WAIT_TIMEOUT', 0):
+            stale = self.app.get(url)
+            self.assertEqual(stale.data, first.data)
+            self.assertEqual(stale.headers['ETag'], first.headers['ETag'])
+
+            # Dashboards reloading on the announcement must not get the old graph
+            version, _ = self.app_module.current_data_version()
+            self.app_module.mark_announced(version)
+            fresh = self.app.get(url)
+        self.assertNotEqual(fresh.headers['ETag'], first.headers['ETag'])
+        self.assertIn(('monthly_volume', '2024-12', 'png'), self.app_module.recent_graphs)
+
+    def test_events_wait_for_the_worker(self):
+        """/events announces a write only once the worker has rendered its graphs."""
+        url = '/graphs?graph=monthly_volume&month=2024-12'
+        first = self.app.get(url)
+
+        with mock.patch.object(self.app_module, 'prerender_worker_running', return_value=True), \
+                mock.patch.object(self.app_module, 'SSE_HEARTBEAT_INTERVAL', 0):
+            response = self.app.get('/events', buffered=False)
+            stream = iter(response.response)
+            next(stream)
+            self.app.post('/admin', data={'agent_name': 'Dana', 'add_agent': 'true'})
+
+            events = []
+            reader = threading.Thread(target=lambda: events.append(next(stream)))
+            reader.start()
+            reader.join(0.2)
+            self.assertEqual(events, [])  # Held back while the worker renders
+
+            self.run_worker_once()
+            reader.join(5)
+            response.close()
+            self.assertTrue(events[0].startswith(b'event: leaderboard'))
+            fresh = self.app.get(url)
+        self.assertNotEqual(fresh.headers['ETag'], first.headers['ETag'])
+
+    def test_warm_set_is_bounded(self):
+        """Only the most recently requested graphs are kept warm, after the standard one."""
+        with mock.patch.object(self.app_module, 'PRERENDER_MAX_RECENT', 3):
+            for month in range(1, 6):
+                self.app_module.request_prerender('monthly_volume', f'2024-{month:02d}', 'png')
+        targets = self.app_module.prerender_targets()
+        self.assertEqual(targets[0], ('dashboard', self.app_module.datetime.now().strftime('%Y-%m'), 'png'))
+        self.assertEqual([month for _, month, _ in targets[1:]], ['2024-05', '2024-04', '2024-03'])
+
+    def test_worker_renders_standard_graphs(self):
+        """The current month's dashboard is warm after one worker pass."""
+        self.run_worker_once()
+        version, _ = self.app_module.current_data_version()
+        month = self.app_module.datetime.now().strftime('%Y-%m')
+        key = self.app_module.generate_cache_key('dashboard', month, version, 'png')
+        self.assertIsNotNone(self.app_module.load_cached_graph(key, 'png'))
+
+
+class TestRenderPool(IsolatedAppTestCase):
+    def test_pooled_render_matches_inline_render(self):
+        """PNGs rendered in worker processes are byte-identical to inline renders."""
+        url = '/graphs?graph=monthly_volume&month=2024-12'
+        inline = self.app.get(url).data
+
+        self.app_module.graph_memory_cache.clear()
+        for name in os.listdir(self.app_module.CACHE_DIR):
+            os.remove(os.path.join(self.app_module.CACHE_DIR, name))
+
+        with mock.patch.object(self.app_module, 'RENDER_PROCESSES', 1), \
+                mock.patch.object(self.app_module, '_render_pool', None):
+            try:
+                pooled = self.app.get(url)
+            finally:
+                self.app_module._render_pool.shutdown()
+        self.assertEqual(pooled.status_code, 200)
+        self.assertEqual(pooled.data, inline)
+
+    def test_render_workers_leave_the_database_alone(self):
+        """Starting render processes does not run the demo database setup again."""
+        # Run as a script, the way `python app.py` or a WSGI server would: the
+        # pool's spawned workers re-import the __main__ module, and so app
+        script = os.path.join(self.tmpdir.name, 'serve.py')
+        with open(script, 'w') as f:
+            f.write(textwrap.dedent('''
+                import json
+                import sqlite3
+                import app
+
+                def snapshot():
+                    with sqlite3.connect(app.DB_PATH) as conn:
+                        count = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+                        version = app.get_data_version(conn.cursor())[0]
+                    return count, version
+
+                if __name__ == '__main__':
+                    app.RENDER_PROCESSES = 1
+                    app.RENDER_MAX_TASKS_PER_CHILD = 1  # A new worker for every graph
+                    app.ensure_database()
+                    before = snapshot()
+                    client = app.app.test_client()
+                    for graph in ('monthly_volume', 'monthly_transactions', 'ytd_volume'):
+                        assert client.get(f'/graphs?graph={graph}&month=2024-12').status_code == 200
+                    app._render_pool.shutdown()
+                    print(json.dumps([before, snapshot()]))
+            '''))
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        output = subprocess.run([sys.executable, script], cwd=self.tmpdir.name, env=env,
+                                capture_output=True, text=True, check=True, timeout=120).stdout
+        before, after = json.loads(output.splitlines()[-1])
+        self.assertEqual(after, before)
+
+    def test_render_timeout_is_service_unavailable(self):
+        with mock.patch.object(self.app_module, 'render_image', side_effect=TimeoutError):
+            response = self.app.get('/graphs?graph=ytd_volume&month=2024-12')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertNotIn('ETag', response.headers)
+
+
+class TestCrossProcessCoalescing(IsolatedAppTestCase):
+    def test_waits_for_render_held_by_another_process(self):
+        """A graph locked by another process is awaited, not rendered again."""
+        app_module = self.app_module
+        version, _ = app_module.current_data_version()
+        key = app_module.generate_cache_key('monthly_volume', '2024-12', version, 'png')
+        path = os.path.join(app_module.CACHE_DIR, f'{key}.png')
+        self.assertTrue(acquire_lock_file(f'{path}.lock', stale_after=60))
+
+        def other_process_finishes():
+            time.sleep(0.2)
+            with open(path, 'wb') as f:
+                f.write(b'rendered elsewhere')
+            os.remove(f'{path}.lock')
+
+        coalesced = app_module.render_flights.coalesced
+        finisher = threading.Thread(target=other_process_finishes)
+        finisher.start()
+        with mock.patch.object(app_module, 'fetch_leaderboard') as fetch:
+            image = app_module.generate_graph('monthly_volume', '2024-12', version, 'png')
+        finisher.join()
+
+        fetch.assert_not_called()
+        self.assertEqual(image, b'rendered elsewhere')
+        self.assertEqual(app_module.render_flights.coalesced, coalesced + 1)
+        stats = self.app.get('/graphs/cache_stats').get_json()
+        self.assertEqual(stats['render_flights']['in_flight'], 0)
@@ -0,0 +1,129 @@
+import io
+import json
+import unittest
+
+from tests.test_app import IsolatedAppTestCase
+from database import get_data_version, search_transactions
+from importer import parse_record, read_csv_records, read_json_records
+
+
+class TestReaders(unittest.TestCase):
+    records = [
+        {'agent': 'Alice', 'volume': 1000, 'date': '2025-02-01', 'address': '1 "Quoted" Way'},
+        {'agent': 'Bob', 'volume': 12345.5, 'date': '2025-02-02', 'address': '2 [Bracket] Rd, Town'},
+    ]
+
+    def test_json_array_read_in_small_pieces(self):
+        stream = io.StringIO(json.dumps(self.records, indent=2))
+        self.assertEqual(list(read_json_records(stream, read_size=7)), list(enumerate(self.records, start=1)))
+
+    def test_json_lines(self):
+        stream = io.StringIO(''.join(json.dumps(record) + '\n' for record in self.records))
+        self.assertEqual([record for _, record in read_json_records(stream, read_size=5)], self.records)
+
+    def test_malformed_json(self):
+        for text in ('[{"agent": "Alice"}, {"agent": ', '[{}] {}', '{"agent": "Alice"} oops'):
+            with self.assertRaises(ValueError, msg=text):
+                list(read_json_records(io.StringIO(text), read_size=4))
+
+    def test_csv_headers_are_normalised(self):
+        stream = io.StringIO(' Agent ,VOLUME,date,address\r\nAlice,"$1,000",2025-02-01,"1 Main St, Town"\r\n\r\n')
+        self.assertEqual(list(read_csv_records(stream)), [
+            (1, {'agent': 'Alice', 'volume': '$1,000', 'date': '2025-02-01', 'address': '1 Main St, Town'})
+        ])
+
+    def test_parse_record(self):
+        agents = {'Alice': 1}
+        good = {'agent': ' Alice ', 'volume': '$1,000.50', 'date': '2025-02-01', 'address': ' 1 Main St '}
+        self.assertEqual(parse_record(good, agents, {1}), (1, 1000.5, '2025-02-01', '1 Main St'))
+        self.assertEqual(parse_record(dict(good, agent=None, agent_id='1'), agents, {1})[0], 1)
+        self.assertEqual(parse_record(dict(good, agent='Zed'), agents, {1}, create_agents=True)[0], 'Zed')
+        for bad in (dict(good, agent='Zed'), dict(good, agent=None, agent_id=7), dict(good, volume='-5'),
+                    dict(good, volume='NaN'), dict(good, date='2025-02-30'), dict(good, date='2/1/2025'),
+                    dict(good, address=''), ['not', 'a', 'record']):
+            with self.assertRaises(ValueError, msg=bad):
+                parse_record(bad, agents, {1})
+
+
+class TestImport(IsolatedAppTestCase):
+    csv_text = (
+        'agent,volume,date,address\n'
+        'Alice,1000,2024-12-05,10 Import Lane\n'
+        'Bob,"$2,500.00",2024-12-06,11 Import Lane\n'
+        'Nobody,10,2024-12-07,12 Import Lane\n'
+        'Charlie,abc,2024-12-08,13 Import Lane\n'
+        'Charlie,300,2024-11-09,14 Import Lane\n'
+    )
+
+    def upload(self, text, filename='closings.csv', **form):
+        return self.app.post('/admin/import', data=dict(
+            form, import_file=(io.BytesIO(text.encode('utf-8')), filename)
+        ), headers={'Accept': 'application/json'})
+
+    def data_version(self):
+        with self.get_test_database_connection() as conn:
+            return get_data_version(conn.cursor())[0]
+
+    def test_upload_imports_good_rows_and_reports_bad_ones(self):
+        version = self.data_version()
+        with self.app_module.app.app_context():
+            before = self.app_module.fetch_leaderboard('monthly_volume', '2024-12')['rows']
+        report = self.upload(self.csv_text).get_json()
+
+        self.assertEqual(report['imported'], 3)
+        self.assertEqual(report['rejected'], 2)
+        self.assertEqual([error['record'] for error in report['errors']], [3, 4])
+        self.assertEqual(report['months'], ['2024-11', '2024-12'])
+        self.assertIsNone(report['failed'])
+        self.assertGreater(self.data_version(), version)
+
+        # The rollup and the search index both see the new rows
+        with self.app_module.app.app_context():
+            after = dict(self.app_module.fetch_leaderboard('monthly_volume', '2024-12')['rows'])
+        self.assertEqual(after['Bob'] - (dict(before).get('Bob') or 0), 2500.0)
+        with self.get_test_database_connection() as conn:
+            found = search_transactions(conn.cursor(), 'import lane')
+            deferred = conn.execute('SELECT deferred FROM search_index_sync').fetchone()[0]
+        self.assertEqual(sorted(row[4] for row in found), ['10 Import Lane', '11 Import Lane', '14 Import Lane'])
+        self.assertEqual(deferred, 0)
+
+    def test_json_upload_creating_agents(self):
+        records = [{'agent': 'Dana', 'volume': 500, 'date': '2024-12-01', 'address': '1 New Agent Rd'}]
+        report = self.upload(json.dumps(records), 'closings.json', create_agents='on').get_json()
+        self.assertEqual((report['imported'], report['created_agents']), (1, 1))
+        with self.get_test_database_connection() as conn:
+            self.assertEqual(search_transactions(conn.cursor(), 'dana')[0][1], 'Dana')
+
+    def test_dry_run_writes_nothing(self):
+        version = self.data_version()
+        report = self.upload(self.csv_text, dry_run='on').get_json()
+        self.assertEqual(report['imported'], 3)
+        self.assertEqual(self.data_version(), version)
+        with self.get_test_database_connection() as conn:
+            self.assertEqual(search_transactions(conn.cursor(), 'import'), [])
+
+    def test_form_upload_redirects_with_summary(self):
+        response = self.app.post('/admin/import', data={
+            'import_file': (io.BytesIO(self.csv_text.encode('utf-8')), 'closings.csv')
+        }, follow_redirects=True)
+        self.assertIn(b'Imported 3 transaction(s); rejected 2 (record 3: unknown agent', response.data)
+
+        response = self.app.post('/admin/import', data={
+            'import_file': (io.BytesIO(b'x'), 'closings.xlsx')
+        }, headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_broken_file_keeps_rows_before_it(self):
+        text = '[{"agent": "Alice", "volume": 1, "date": "2024-12-01", "address": "1 Before Rd"}, {"agent": '
+        report = self.upload(text, 'closings.json').get_json()
+        self.assertEqual(report['imported'], 1)
+        self.assertIn('Stopped reading after record 1', report['failed'])
+
+    def test_cli(self):
+        path = f'{self.tmpdir.name}/closings.csv'
+        with open(path, 'w') as f:
+            f.write(self.csv_text)
+        result = self.app_module.app.test_cli_runner().invoke(args=['import-transactions', path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 3 transaction(s)', result.output)
+        self.assertIn('Record 4: volume', result.output)
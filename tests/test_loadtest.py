@@ -0,0 +1,52 @@
+import datetime
+import io
+import unittest
+
+from loadtest import dashboard_affected, percentile, read_events, screen_requests, summarize
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (0.5, 0.95, 0.99, 1.0)], [50, 95, 99, 100])
+        self.assertEqual(percentile([7], 0.99), 7)
+
+    def test_summarize(self):
+        samples = [('GET /graphs (ytd_volume)', 0.1, 'ok')] * 6 + [
+            ('GET /graphs (ytd_volume)', 0.01, 'not_modified'),
+            ('GET /graphs (ytd_volume)', 0.1, 'not_modified'),
+            ('GET /graphs (ytd_volume)', 5.0, 'timeout'),
+            ('POST /admin', 0.2, 'locked'),
+        ]
+        summary = summarize(samples, duration=2.0)
+        graphs = summary['GET /graphs (ytd_volume)']
+        self.assertEqual((graphs['requests'], graphs['ok'], graphs['not_modified'], graphs['timeout']), (9, 6, 2, 1))
+        self.assertEqual((graphs['throughput'], graphs['p99']), (4.5, 0.1))  # Failures have no latency
+        self.assertAlmostEqual(graphs['error_rate'], 1 / 9)  # A 304 is a success
+        self.assertEqual((summary['POST /admin']['locked'], summary['POST /admin']['error_rate']), (1, 1.0))
+        self.assertNotIn('p50', summary['POST /admin'])
+        self.assertEqual(summary['all']['requests'], 10)
+
+    def test_screen_requests_follow_the_dashboard(self):
+        self.assertEqual([path for _, path in screen_requests('graphs', '2024-12')], [
+            '/graphs?graph=monthly_volume&month=2024-12', '/graphs?graph=monthly_transactions&month=2024-12',
+            '/graphs?graph=ytd_volume&month=2024-12', '/graphs?graph=ytd_transactions&month=2024-12',
+        ])
+        self.assertEqual(screen_requests('json', '2024-12'), [('GET /dashboard.json', '/dashboard.json?month=2024-12')])
+
+    def test_read_events(self):
+        stream = io.BytesIO(
+            b'retry: 5000\n\n: keep-alive\n\n'
+            b'event: leaderboard\nid: 7\ndata: {"version": 7, "months": ["2024-12"]}\n\n'
+            b'data: partial'  # Never dispatched: the stream ended mid-event
+        )
+        self.assertEqual(list(read_events(stream.readline)), [
+            ('retry', '5000'), ('leaderboard', '{"version": 7, "months": ["2024-12"]}'),
+        ])
+
+    def test_dashboard_affected(self):
+        today = datetime.date(2024, 12, 20)
+        self.assertTrue(dashboard_affected(None, '2024-06', today))
+        self.assertTrue(dashboard_affected(['2024-06'], '2024-06', today))
+        self.assertTrue(dashboard_affected(['2024-02'], '2023-06', today))  # The YTD graphs
+        self.assertFalse(dashboard_affected(['2023-02'], '2023-06', today))
@@ -0,0 +1,49 @@
+import threading
+import unittest
+
+from metrics import Registry
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.requests = self.registry.counter('requests_total', 'Requests.', ('route',))
+        self.latency = self.registry.histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1))
+
+    def test_shards_from_every_thread_are_summed(self):
+        def work():
+            for _ in range(1000):
+                self.requests.inc('/graphs')
+                self.latency.observe(0.5, '/graphs')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.requests.inc('/admin', amount=2)
+
+        totals = self.registry.collect()
+        self.assertEqual(totals[self.requests], {('/graphs',): 8000, ('/admin',): 2})
+        self.assertEqual(totals[self.latency][('/graphs',)], [0, 8000, 0, 4000.0])
+
+    def test_exposition_format(self):
+        self.requests.inc('say "hi"\n')
+        for value in (0.05, 0.1, 0.5, 3):
+            self.latency.observe(value, '/graphs')
+        text = self.registry.render([('rows', 'Rows.', 'gauge', [({'table': 'agents'}, 3)])])
+        self.assertEqual(text.splitlines(), [
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{route="say \\"hi\\"\\n"} 1',
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{route="/graphs",le="0.1"} 2',
+            'latency_seconds_bucket{route="/graphs",le="1"} 3',
+            'latency_seconds_bucket{route="/graphs",le="+Inf"} 4',
+            'latency_seconds_sum{route="/graphs"} 3.65',
+            'latency_seconds_count{route="/graphs"} 4',
+            '# HELP rows Rows.',
+            '# TYPE rows gauge',
+            'rows{table="agents"} 3',
+        ])
@@ -0,0 +1,111 @@
+from tests.test_app import IsolatedAppTestCase
+from database import month_bounds, year_bounds
+
+
+class TestQueryPlans(IsolatedAppTestCase):
+    def traced_statements(self, func):
+        """Run func and return every SQL statement it executed."""
+        statements = []
+        conn = self.app_module.get_db()  # The connection requests on this thread reuse
+        conn.set_trace_callback(statements.append)
+        try:
+            func()
+        finally:
+            conn.set_trace_callback(None)
+        return statements
+
+    def full_scans(self, statements):
+        """
+        Return the plan lines that scan a whole table (with or without an
+        index). Walking every agent is expected, everything else must be a
+        SEARCH.
+        """
+        scans = []
+        with self.get_test_database_connection() as conn:
+            for statement in statements:
+                if not statement.lstrip().upper().startswith(('SELECT', 'DELETE', 'UPDATE')):
+                    continue
+                for row in conn.execute(f'EXPLAIN QUERY PLAN {statement}'):
+                    detail = row[3]
+                    if detail.startswith('SCAN') and detail.split()[1] not in ('a', 'agents'):
+                        scans.append((statement, detail))
+        return scans
+
+    def test_migration_creates_indexes(self):
+        """initialize_database brings the schema to the latest version."""
+        with self.get_test_database_connection() as conn:
+            indexes = {row[1] for row in conn.execute('PRAGMA index_list(transactions)')}
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        self.assertIn('idx_transactions_date_agent_volume', indexes)
+        self.assertIn('idx_transactions_agent_date', indexes)
+        self.assertGreaterEqual(version, 1)
+
+    def test_graph_queries_do_not_scan(self):
+        """None of the four leaderboard queries scans a large table."""
+        for graph_type in ('monthly_volume', 'monthly_transactions', 'ytd_volume', 'ytd_transactions'):
+            statements = self.traced_statements(
+                lambda: self.app.get(f'/graphs?graph={graph_type}&month=2024-12')
+            )
+            self.assertTrue(statements, graph_type)
+            self.assertEqual(self.full_scans(statements), [], graph_type)
+
+    def test_dashboard_query_does_not_scan(self):
+        """The one-pass dashboard query only walks the agents."""
+        statements = self.traced_statements(lambda: self.app.get('/dashboard.json?month=2024-12'))
+        self.assertTrue(any('agent_month_totals' in statement for statement in statements))
+        self.assertEqual(self.full_scans(statements), [])
+
+    def test_admin_pages_use_keyset_indexes(self):
+        """Deep admin pages are index range searches, never a sort of the table."""
+        for sort, after in (('date', '["2024-06-01", 3]'), ('volume', '[500.0, 3]'), ('id', '[3, 3]')):
+            cursor = self.app_module.encode_page_cursor(self.app_module.json.loads(after))
+            statements = self.traced_statements(
+                lambda: self.app.get(f'/admin?sort={sort}&after={cursor}')
+            )
+            page_query = [s for s in statements if 'LIMIT' in s]
+            self.assertEqual(len(page_query), 1, sort)
+            self.assertEqual(self.full_scans(page_query), [], sort)
+            with self.get_test_database_connection() as conn:
+                plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {page_query[0]}')]
+            self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], (sort, plan))
+
+    def test_admin_search_uses_fts_index(self):
+        """Searching only walks the full-text index, never transactions or agents."""
+        statements = self.traced_statements(lambda: self.app.get('/admin?search_query=main'))
+        search = [s for s in statements if 'MATCH' in s]
+        self.assertEqual(len(search), 1)
+        with self.get_test_database_connection() as conn:
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {search[0]}')]
+        scans = [line for line in plan if line.startswith('SCAN')]
+        self.assertTrue(scans)
+        for line in scans:
+            self.assertTrue('VIRTUAL TABLE' in line or line == 'SCAN hits', line)
+
+    def test_exports_use_indexes(self):
+        """
+        Date-ranged exports search an index, and transaction exports come off
+        it in order (only the per-agent leaderboard rows get sorted).
+        """
+        for url in ('/export/transactions.csv?start=2024-12-01&end=2024-12-31',
+                    '/export/leaderboard.csv?month=2024-12',
+                    '/export/leaderboard.csv?start=2024-12-02&end=2024-12-09'):
+            statements = self.traced_statements(lambda: self.app.get(url).data)
+            export = [s for s in statements if 'date' in s or 'month' in s]
+            self.assertEqual(len(export), 1, url)
+            self.assertEqual(self.full_scans(export), [], url)
+            if 'transactions.csv' in url:
+                with self.get_test_database_connection() as conn:
+                    plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {export[0]}')]
+                self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], plan)
+
+    def test_date_range_and_agent_queries_use_indexes(self):
+        """Half-open date ranges and per-agent deletes are index searches."""
+        start, end = month_bounds('2024-12')
+        statements = [
+            f"SELECT agent_id, SUM(volume), COUNT(*) FROM transactions "
+            f"WHERE date >= '{start}' AND date < '{end}' GROUP BY agent_id",
+            "DELETE FROM transactions WHERE agent_id = 1",
+        ]
+        self.assertEqual(self.full_scans(statements), [])
+        self.assertEqual(year_bounds(2024), ('2024-01-01', '2025-01-01'))
+        self.assertEqual(month_bounds('2024-12'), ('2024-12-01', '2025-01-01'))
@@ -0,0 +1,66 @@
+from tests.test_app import IsolatedAppTestCase
+from database import rebuild_agent_month_totals
+
+
+class TestRollup(IsolatedAppTestCase):
+    def rollup(self):
+        with self.get_test_database_connection() as conn:
+            return conn.execute('''
+                SELECT agent_id, month, total_volume, transaction_count
+                FROM agent_month_totals
+                ORDER BY agent_id, month
+            ''').fetchall()
+
+    def test_admin_writes_keep_rollup_in_sync(self):
+        """Add/remove transaction and remove agent update agent_month_totals."""
+        with self.get_test_database_connection() as conn:
+            conn.execute('DELETE FROM transactions')
+            conn.execute('DELETE FROM agent_month_totals')
+
+        for volume in (1000.0, 250.5):
+            self.app.post('/admin', data={
+                'transaction_agent_id': 1,
+                'transaction_volume': volume,
+                'transaction_date': '2024-12-28',
+                'transaction_address': '1 Main St',
+                'add_transaction': 'true'
+            })
+        self.assertEqual(self.rollup(), [(1, '2024-12', 1250.5, 2)])
+
+        with self.get_test_database_connection() as conn:
+            transaction_id = conn.execute(
+                'SELECT id FROM transactions WHERE volume = 1000.0'
+            ).fetchone()[0]
+        self.app.post('/admin', data={'transaction_id': transaction_id, 'remove_transaction': 'true'})
+        self.assertEqual(self.rollup(), [(1, '2024-12', 250.5, 1)])
+
+        self.app.post('/admin', data={'agent_id': 1, 'remove_agent': 'true'})
+        self.assertEqual(self.rollup(), [])
+
+    def test_rebuild_matches_transactions(self):
+        """Rebuilding picks up rows written behind the app's back."""
+        with self.get_test_database_connection() as conn:
+            conn.executemany(
+                'INSERT INTO transactions (agent_id, volume, date) VALUES (?, ?, ?)',
+                [(2, 100.0, '2025-03-01'), (2, 50.0, '2025-03-31'), (3, 10.0, 'not a date')]
+            )
+            rebuild_agent_month_totals(conn)
+            expected = conn.execute('''
+                SELECT agent_id, strftime('%Y-%m', date), SUM(volume), COUNT(*)
+                FROM transactions
+                WHERE strftime('%Y-%m', date) IS NOT NULL
+                GROUP BY 1, 2
+                ORDER BY 1, 2
+            ''').fetchall()
+        self.assertEqual(self.rollup(), expected)
+        self.assertIn((2, '2025-03', 150.0, 2), self.rollup())
+
+    def test_rebuild_command_validates_month(self):
+        runner = self.app_module.app.test_cli_runner()
+        result = runner.invoke(args=['rebuild-rollup', '--month', '2024-13'])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('expected a month as YYYY-MM', result.output)
+
+        result = runner.invoke(args=['rebuild-rollup', '--month', '2024-12'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Rebuilt agent_month_totals', result.output)
@@ -1,4 +1,9 @@
-from tests.test_app import BaseTestCase
+import json
+import os
+import re
+from unittest import mock
+
+from tests.test_app import BaseTestCase, IsolatedAppTestCase
 
 
 class TestRoutes(BaseTestCase):
@@ -66,3 +71,410 @@ class TestRoutes(BaseTestCase):
         response = self.app.post('/admin', data={'transaction_id': transaction_id, 'remove_transaction': 'true'}, follow_redirects=True)
         self.assertEqual(response.status_code, 200, "Failed to remove transaction through admin route.")
         self.assertIn("Transaction removed successfully!", response.data.decode('utf-8'), "Remove transaction message missing.")
+
+
+class TestConditionalGraphs(IsolatedAppTestCase):
+    def test_etag_revalidation(self):
+        """/graphs answers a matching If-None-Match with 304 until data changes."""
+        url = '/graphs?graph=monthly_volume&month=2024-12'
+        response = self.app.get(url)
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertIn('Last-Modified', response.headers)
+
+        response = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        self.app.post('/admin', data={'agent_name': 'Dana', 'add_agent': 'true'})
+        response = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_if_modified_since(self):
+        """/graphs honours If-Modified-Since when no ETag is sent."""
+        url = '/graphs?graph=ytd_transactions'
+        last_modified = self.app.get(url).headers['Last-Modified']
+        response = self.app.get(url, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_ytd_graphs_expire_with_the_year(self):
+        """A new year invalidates cached YTD graphs even without a write."""
+        real_datetime = self.app_module.datetime
+
+        def etags_in(year):
+            class FixedDatetime(real_datetime):
+                @classmethod
+                def now(cls, tz=None):
+                    return real_datetime(year, 6, 1)
+
+            with mock.patch.object(self.app_module, 'datetime', FixedDatetime):
+                return {graph: self.app.get(f'/graphs?graph={graph}&month=2024-12').headers['ETag']
+                        for graph in ('ytd_volume', 'monthly_volume')}
+
+        old_year, new_year = etags_in(2024), etags_in(2025)
+        self.assertNotEqual(old_year['ytd_volume'], new_year['ytd_volume'])
+        self.assertEqual(old_year['monthly_volume'], new_year['monthly_volume'])
+
+    def test_invalid_graph_type(self):
+        response = self.app.get('/graphs?graph=nope')
+        self.assertEqual(response.status_code, 400)
+
+    def test_svg_format(self):
+        """/graphs?format=svg serves the SVG backend with its own cache entry."""
+        response = self.app.get('/graphs?graph=monthly_volume&month=2024-12&format=svg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'image/svg+xml')
+        self.assertTrue(response.data.startswith(b'<svg'))
+        png = self.app.get('/graphs?graph=monthly_volume&month=2024-12')
+        self.assertNotEqual(png.headers['ETag'], response.headers['ETag'])
+        self.assertEqual(self.app.get('/graphs?format=gif').status_code, 400)
+
+
+class TestLeaderboardApi(IsolatedAppTestCase):
+    def test_leaderboard_json(self):
+        """/api/leaderboard returns ranked agents for the requested period."""
+        with self.get_test_database_connection() as conn:
+            conn.execute('DELETE FROM transactions')
+            conn.execute('DELETE FROM agent_month_totals')
+        for agent_id, volume in ((2, 300.0), (1, 100.0), (2, 50.0)):
+            self.app.post('/admin', data={
+                'transaction_agent_id': agent_id,
+                'transaction_volume': volume,
+                'transaction_date': '2024-12-05',
+                'transaction_address': '1 Main St',
+                'add_transaction': 'true'
+            })
+
+        payload = self.app.get('/api/leaderboard?metric=volume&period=month&month=2024-12').get_json()
+        self.assertEqual(payload['graph'], 'monthly_volume')
+        self.assertEqual(payload['leaders'][:2], [
+            {'agent': 'Bob', 'value': 350.0, 'rank': 1},
+            {'agent': 'Alice', 'value': 100.0, 'rank': 2},
+        ])
+
+        payload = self.app.get('/api/leaderboard?metric=count&period=month&month=2024-12').get_json()
+        self.assertEqual(payload['leaders'][0], {'agent': 'Bob', 'value': 2, 'rank': 1})
+        self.assertEqual(payload['leaders'][2], {'agent': 'Charlie', 'value': 0, 'rank': 3})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.app.get('/api/leaderboard?metric=bogus').status_code, 400)
+        self.assertEqual(self.app.get('/api/leaderboard?month=2024-13').status_code, 400)
+
+    def test_client_render_mode(self):
+        """?render=client swaps the dashboard PNG for charts fed by one JSON request."""
+        response = self.app.get('/?render=client')
+        self.assertIn(b'data-api="/dashboard.json?month=', response.data)
+        self.assertIn(b'data-graph="ytd_transactions"', response.data)
+        self.assertNotIn(b'data-src="/dashboard.png', response.data)
+        self.assertIn(b'data-src="/dashboard.png', self.app.get('/').data)
+
+
+class TestDashboard(IsolatedAppTestCase):
+    def test_dashboard_json_matches_leaderboard_api(self):
+        """One /dashboard.json carries the same leaders as the four API calls."""
+        dashboard = self.app.get('/dashboard.json?month=2024-12').get_json()
+        self.assertEqual(dashboard['month'], '2024-12')
+        for (metric, period), graph_type in self.app_module.API_GRAPH_TYPES.items():
+            single = self.app.get(
+                f'/api/leaderboard?metric={metric}&period={period}&month=2024-12'
+            ).get_json()
+            self.assertEqual(dashboard['graphs'][graph_type]['title'], single['title'])
+            self.assertEqual(dashboard['graphs'][graph_type]['leaders'], single['leaders'])
+
+    def test_dashboard_png_is_one_cached_artifact(self):
+        first = self.app.get('/dashboard.png?month=2024-12')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content_type, 'image/png')
+        self.assertEqual(len(os.listdir(self.app_module.CACHE_DIR)), 1)
+
+        revalidated = self.app.get(
+            '/dashboard.png?month=2024-12', headers={'If-None-Match': first.headers['ETag']}
+        )
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_invalid_month(self):
+        self.assertEqual(self.app.get('/dashboard.png?month=2024-13').status_code, 400)
+        self.assertEqual(self.app.get('/dashboard.json?month=bogus').status_code, 400)
+
+
+class TestAdminPagination(IsolatedAppTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.app_module.write_transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
+                [(1 + n % 3, float(n % 7), f'2024-{1 + n % 12:02d}-01', f'{n} Main St') for n in range(120)]
+            )
+        with self.get_test_database_connection() as conn:
+            self.all_rows = conn.execute('''
+                SELECT t.id, t.volume, t.date FROM transactions t JOIN agents a ON t.agent_id = a.id
+            ''').fetchall()
+
+    def page(self, url):
+        """Return (transaction ids, next url, prev url) of an admin page."""
+        with self.app_module.app.test_request_context(url):
+            page = self.app_module.admin_page_args()
+            rows = self.app_module.fetch_admin_page(self.app_module.get_db().cursor(), page)
+        return [row[0] for row in rows], page['next_url'], page['prev_url']
+
+    def test_pages_cover_every_transaction_in_order(self):
+        for sort, position in (('date', 2), ('volume', 1), ('id', 0)):
+            for direction in ('asc', 'desc'):
+                expected = [row[0] for row in sorted(
+                    self.all_rows, key=lambda row: (row[position], row[0]), reverse=direction == 'desc'
+                )]
+                seen, pages = [], []
+                url = f'/admin?sort={sort}&dir={direction}&page_size=25'
+                while url:
+                    ids, url, _ = self.page(url)
+                    seen += ids
+                    pages.append(ids)
+                self.assertEqual(seen, expected, (sort, direction))
+                self.assertEqual(len(pages), -(-len(expected) // 25))
+
+    def test_previous_page_link(self):
+        first, next_url, prev_url = self.page('/admin?page_size=50')
+        self.assertIsNone(prev_url)
+        second, _, prev_url = self.page(next_url)
+        self.assertNotEqual(first, second)
+        back, next_again, prev_again = self.page(prev_url)
+        self.assertEqual(back, first)
+        self.assertIsNone(prev_again)
+        self.assertEqual(self.page(next_again)[0], second)
+
+    def test_admin_page_renders_one_page(self):
+        response = self.app.get('/admin?page_size=10&sort=volume&dir=asc')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.count(b'Main St</td>'), 10)
+        self.assertIn(b'Next &raquo;</a>', response.data)
+
+    def test_bad_parameters_fall_back_to_defaults(self):
+        response = self.app.get('/admin?sort=address&dir=sideways&page_size=-3&after=%%%')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.count(b'Transaction #'), 1)  # page_size clamped to 1
+
+    def test_page_size_all_streams_every_row(self):
+        """?page_size=all streams the whole table in order, in several flushes."""
+        expected = [row[0] for row in sorted(self.all_rows, key=lambda row: (row[1], row[0]))]
+        with mock.patch.object(self.app_module, 'ADMIN_STREAM_BATCH_ROWS', 7), \
+                mock.patch.object(self.app_module, 'ADMIN_STREAM_CHUNK_BYTES', 1024):
+            response = self.app.get('/admin?sort=volume&dir=asc&page_size=all', buffered=False)
+            self.assertTrue(response.is_streamed)
+            chunks = list(response.response)
+            response.close()
+        self.assertGreater(len(chunks), 2)
+        self.assertIn(b'Admin Panel', chunks[0])
+        self.assertNotIn(b'Main St', chunks[0])  # The head flushes before any row
+        html = b''.join(chunks)
+        ids = [int(match) for match in re.findall(rb'<tr>\s*<td>(\d+)</td>', html.split(b'<tbody>')[-1])]
+        self.assertEqual(ids, expected)
+        self.assertIn(b'name="transaction_id" min="1"', html)
+
+    def test_streamed_search_returns_every_match(self):
+        response = self.app.get('/admin?search_query=main&page_size=all')
+        ids = [int(match) for match in re.findall(rb'<tr>\s*<td>(\d+)</td>', response.data.split(b'<tbody>')[-1])]
+        with self.get_test_database_connection() as conn:
+            expected = [row[0] for row in conn.execute(
+                "SELECT id FROM transactions WHERE address LIKE '%main%' ORDER BY id DESC"
+            )]
+        self.assertGreater(len(expected), self.app_module.ADMIN_SEARCH_LIMIT)
+        self.assertEqual(ids, expected)
+
+
+class TestAdminSearch(IsolatedAppTestCase):
+    def search(self, text):
+        with self.get_test_database_connection() as conn:
+            from database import search_transactions
+            return search_transactions(conn.cursor(), text, limit=100)
+
+    def add_transaction(self, agent_id, address):
+        self.app.post('/admin', data={
+            'transaction_agent_id': agent_id,
+            'transaction_volume': 1000,
+            'transaction_date': '2024-11-20',
+            'transaction_address': address,
+            'add_transaction': 'true'
+        })
+
+    def test_prefix_search_ranks_and_follows_writes(self):
+        self.add_transaction(1, '742 Evergreen Terrace')
+        rows = self.search('everg')
+        self.assertEqual([row[4] for row in rows], ['742 Evergreen Terrace'])
+        self.assertEqual(self.search('742 terr'), rows)
+        self.assertEqual(self.search('2024-11')[0][0], rows[0][0])
+
+        # Renames reach the index through the agents trigger
+        self.app.post('/change_agent_name', data={'agent_id': 1, 'new_name': 'Zelda'})
+        self.assertEqual([row[0] for row in self.search('zel everg')], [rows[0][0]])
+        self.assertEqual(self.search('alice everg'), [])
+
+        self.app.post('/admin', data={'transaction_id': rows[0][0], 'remove_transaction': 'true'})
+        self.assertEqual(self.search('everg'), [])
+
+    def test_search_page_and_limit(self):
+        with mock.patch.object(self.app_module, 'ADMIN_SEARCH_LIMIT', 3):
+            for n in range(5):
+                self.add_transaction(2, f'{n} Ocean Drive')
+            response = self.app.get('/admin?search_query=ocean')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.count(b'Ocean Drive</td>'), 3)
+        self.assertIn(b'refine the search', response.data)
+
+    def test_search_syntax_is_literal(self):
+        for text in ('"', 'AND', 'a OR b', 'NEAR(', '*', '-'):
+            response = self.app.get('/admin', query_string={'search_query': text})
+            self.assertEqual(response.status_code, 200, text)
+            self.assertNotIn(b'Database error', response.data, text)
+
+
+class TestExports(IsolatedAppTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.app_module.write_transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
+                [(1 + n % 3, 1000.0 + n, f'2024-12-{1 + n % 28:02d}', f'{n} Export Ave') for n in range(60)]
+            )
+            self.app_module.rebuild_agent_month_totals(cursor.connection)
+
+    def csv_rows(self, response):
+        import csv
+        import gzip
+        data = response.data
+        if response.mimetype == 'application/gzip':
+            data = gzip.decompress(data)
+        return list(csv.reader(data.decode('utf-8').splitlines()))
+
+    def test_transactions_stream_in_chunks(self):
+        with mock.patch.object(self.app_module, 'EXPORT_BATCH_ROWS', 10):
+            response = self.app.get('/export/transactions.csv?sort=id&dir=asc', buffered=False)
+            self.assertTrue(response.is_streamed)
+            chunks = list(response.response)
+            response.close()
+        self.assertGreater(len(chunks), 6)
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename="transactions.csv"')
+        rows = self.csv_rows(mock.Mock(data=b''.join(chunks), mimetype='text/csv'))
+        self.assertEqual(rows[0], ['id', 'agent', 'volume', 'date', 'address'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], list(range(1, 64)))
+
+    def test_transaction_filters_and_gzip(self):
+        response = self.app.get('/export/transactions.csv?search_query=export&start=2024-12-02&end=2024-12-03&gzip=1')
+        self.assertEqual(response.mimetype, 'application/gzip')
+        self.assertIn('transactions_2024-12-02_2024-12-03.csv.gz', response.headers['Content-Disposition'])
+        rows = self.csv_rows(response)[1:]
+        self.assertEqual(len(rows), 6)  # n = 1, 2, 29, 30, 57, 58
+        self.assertTrue(all(row[3] in ('2024-12-02', '2024-12-03') for row in rows))
+        self.assertTrue(all(row[4].endswith('Export Ave') for row in rows))
+
+    def test_leaderboard_matches_graph_data(self):
+        rows = self.csv_rows(self.app.get('/export/leaderboard.csv?month=2024-12'))
+        self.assertEqual(rows[0], ['rank', 'agent', 'volume', 'transactions'])
+        with self.app_module.app.app_context():
+            leaders = self.app_module.fetch_leaderboard('monthly_volume', '2024-12')['rows']
+        self.assertEqual([(row[1], float(row[2])) for row in rows[1:]], [(name, value) for name, value in leaders])
+        self.assertEqual([row[0] for row in rows[1:]], ['1', '2', '3'])
+
+        # A partial month aggregates the transactions themselves
+        partial = self.csv_rows(self.app.get('/export/leaderboard.csv?start=2024-12-01&end=2024-12-01&metric=count'))
+        self.assertEqual(sum(int(row[3]) for row in partial[1:]), 3)
+
+    def test_formulas_are_escaped(self):
+        """Text a spreadsheet would evaluate is exported with a leading apostrophe."""
+        with self.app_module.write_transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO transactions (agent_id, volume, date, address) VALUES (?, ?, ?, ?)',
+                [(1, -50.0, '2024-11-01', '=HYPERLINK("http://example.com")'), (1, 5.0, '2024-11-02', '@SUM(A1)'),
+                 (1, 5.0, '2024-11-03', '-2+3'), (1, 5.0, '2024-11-04', '12 Main St - Unit 3')]
+            )
+        rows = self.csv_rows(self.app.get('/export/transactions.csv?start=2024-11-01&end=2024-11-30&sort=id&dir=asc'))
+        self.assertEqual([row[4] for row in rows[1:]], [
+            '\'=HYPERLINK("http://example.com")', "'@SUM(A1)", "'-2+3", '12 Main St - Unit 3',
+        ])
+        self.assertEqual(rows[1][2], '-50.00')  # Numbers are left alone
+
+    def test_bad_parameters(self):
+        for url in ('/export/transactions.csv?start=2024-13-01', '/export/leaderboard.csv?month=2024-1',
+                    '/export/leaderboard.csv?metric=profit'):
+            self.assertEqual(self.app.get(url).status_code, 400, url)
+
+
+class TestRequestTiming(IsolatedAppTestCase):
+    def timed_get(self, url):
+        with mock.patch.object(self.app_module, 'REQUEST_TIMING_ENABLED', True), \
+                self.assertLogs(self.app_module.request_timing_log, 'INFO') as logs:
+            response = self.app.get(url)
+        return response, json.loads(logs.records[-1].getMessage())
+
+    def phases(self, response):
+        return [metric.split(';')[0] for metric in response.headers['Server-Timing'].split(', ')]
+
+    def test_graph_phases(self):
+        response, line = self.timed_get('/graphs?graph=monthly_volume&month=2024-12')
+        self.assertEqual(self.phases(response), ['version', 'cache', 'sql', 'draw', 'savefig', 'cache_write', 'total'])
+        self.assertEqual((line['route'], line['params'], line['status']),
+                         ('/graphs', {'graph': 'monthly_volume', 'month': '2024-12'}, 200))
+        self.assertGreater(line['phases_ms']['savefig'], 0)
+
+        # Served from memory the second time
+        response, _ = self.timed_get('/graphs?graph=monthly_volume&month=2024-12')
+        self.assertEqual(self.phases(response), ['version', 'cache', 'total'])
+
+    def test_admin_phases(self):
+        response, line = self.timed_get('/admin')
+        self.assertEqual(self.phases(response), ['sql', 'template', 'total'])
+        self.assertEqual(line['endpoint'], 'admin_panel')
+
+    def test_disabled_by_default(self):
+        response = self.app.get('/graphs?graph=monthly_volume&month=2024-12')
+        self.assertNotIn('Server-Timing', response.headers)
+
+
+class TestMetrics(IsolatedAppTestCase):
+    def sample(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_metrics(self):
+        self.app_module.graph_memory_cache.clear()
+        before = self.app.get('/metrics').get_data(as_text=True)
+        self.app.get('/graphs?graph=ytd_transactions&month=2024-12')
+        self.app.get('/graphs?graph=ytd_transactions&month=2024-12')
+        response = self.app.get('/metrics')
+        self.assertEqual(response.content_type, 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.get_data(as_text=True)
+
+        def delta(line_start):
+            return self.sample(text, line_start) - self.sample(before, line_start)
+
+        self.assertEqual(delta('leaderboard_http_requests_total{route="/graphs",method="GET",status="200"}'), 2)
+        self.assertEqual(delta('leaderboard_graph_cache_requests_total{graph_type="ytd_transactions",result="miss"}'), 1)
+        self.assertEqual(delta('leaderboard_graph_cache_requests_total{graph_type="ytd_transactions",result="hit"}'), 1)
+        self.assertEqual(delta('leaderboard_graph_render_seconds_count{graph_type="ytd_transactions",format="png"}'), 1)
+        self.assertGreaterEqual(delta('leaderboard_sqlite_query_duration_seconds_count{query="leaderboard"}'), 1)
+        with self.get_test_database_connection() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+        self.assertEqual(self.sample(text, 'leaderboard_table_rows{table="transactions"}'), count)
+        self.assertGreater(self.sample(text, 'leaderboard_graph_cache_dir_bytes'), 0)
+
+    def test_row_counts_are_only_read_after_writes(self):
+        def scrape():
+            text = self.app.get('/metrics').get_data(as_text=True)
+            return (self.sample(text, 'leaderboard_table_rows{table="transactions"}'),
+                    self.sample(text, 'leaderboard_sqlite_query_duration_seconds_count{query="table_rows"}'))
+
+        rows, reads = scrape()
+        self.assertEqual(scrape(), (rows, reads))  # Nothing written: the counts were not read again
+
+        self.app.post('/admin', data={
+            'transaction_agent_id': 1,
+            'transaction_volume': 10.0,
+            'transaction_date': '2024-12-05',
+            'transaction_address': '1 Main St',
+            'add_transaction': 'true'
+        })
+        self.assertEqual(scrape(), (rows + 1, reads + 1))
@@ -0,0 +1,91 @@
+"""
+Per-request phase timing.
+
+Code on a request path marks its phases with `with phase('sql'): ...`. While
+a request is being timed (app.py starts a PhaseTimer for each request when
+REQUEST_TIMING_ENABLED is set) the durations are collected and reported as a
+Server-Timing header and a structured log line. Otherwise phase() returns a
+shared do-nothing context manager, so instrumented code costs one
+thread-local lookup per phase.
+
+Timers are per thread: phases run in another thread or in a render process
+(see app.run_renderer) are not seen by the request that waits for them.
+"""
+import contextlib
+import threading
+import time
+
+_NO_PHASE = contextlib.nullcontext()
+
+
+class _Current(threading.local):
+    timer = None  # A class default: reading it is cheaper than getattr() on a miss
+
+
+_current = _Current()
+
+
+class PhaseTimer:
+    """The phases of one request, in the order they finished."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []  # (name, seconds)
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def totals(self):
+        """Seconds per phase name, summed over repeats, in first-seen order."""
+        totals = {}
+        for name, seconds in self.phases:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class _Phase:
+    __slots__ = ('timer', 'name', 'started')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.name, time.perf_counter() - self.started)
+
+
+def phase(name):
+    """Context manager timing a phase of the current request, if it is timed."""
+    timer = _current.timer
+    if timer is None:
+        return _NO_PHASE
+    return _Phase(timer, name)
+
+
+def start_timing():
+    """Starts timing phases on this thread and returns the new PhaseTimer."""
+    timer = _current.timer = PhaseTimer()
+    return timer
+
+
+def stop_timing():
+    """Stops timing phases on this thread; returns the PhaseTimer, or None."""
+    timer = _current.timer
+    _current.timer = None
+    return timer
+
+
+def server_timing_header(totals, total):
+    """
+    Formats phase totals (name -> seconds) and the request's total time as
+    a Server-Timing header value, durations in milliseconds.
+    """
+    metrics = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in totals.items()]
+    metrics.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(metrics)